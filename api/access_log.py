@@ -0,0 +1,115 @@
+import logging
+import os
+import random
+import re
+import time
+import uuid
+from typing import Dict
+
+from services.logs import close_request, open_request
+from services.readiness import startup_report
+
+
+# Taux d'échantillonnage des logs d'accès par template de route ("route=taux,...");
+# erreurs (>= 400), requêtes lentes et écritures (audit) ne sont jamais échantillonnées
+LOG_ACCESS_SAMPLE_RATE = float(os.getenv("LOG_ACCESS_SAMPLE_RATE", "1.0"))
+LOG_ACCESS_SLOW_MS = float(os.getenv("LOG_ACCESS_SLOW_MS", "1000"))
+_DEFAULT_ROUTE_RATES = "/health=0,/ready=0,/metrics=0,/api/health=0"
+
+HEADER = b"x-request-id"
+_RID_RE = re.compile(r"^[0-9A-Za-z._:-]{1,128}$")
+_WRITE_METHODS = frozenset({"POST", "PUT", "PATCH", "DELETE"})
+
+access_logger = logging.getLogger("cc.access")
+audit_logger = logging.getLogger("cc.audit")
+
+
+def _parse_rates(raw: str) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for item in raw.split(","):
+        route, sep, rate = item.strip().rpartition("=")
+        if sep and route:
+            try:
+                out[route] = max(0.0, min(1.0, float(rate)))
+            except ValueError:
+                continue
+    return out
+
+
+ROUTE_SAMPLE_RATES = _parse_rates(_DEFAULT_ROUTE_RATES + "," + os.getenv("LOG_ACCESS_SAMPLE_ROUTES", ""))
+
+
+def _request_id(scope) -> str:
+    # Id amont (client, App Gateway) repris s'il est sain, sinon généré
+    for k, v in scope.get("headers") or ():
+        if k == HEADER:
+            value = v.decode("latin-1")
+            if _RID_RE.match(value):
+                return value
+            break
+    return uuid.uuid4().hex
+
+
+class AccessLogMiddleware:
+    """
+    Middleware ASGI pur: request id (X-Request-ID, repris ou généré, renvoyé en réponse)
+    propagé aux services via services.logs; une ligne d'accès (échantillonnée) ou
+    d'audit (écritures, toujours) par requête, écrite hors du thread de la requête.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        rid = _request_id(scope)
+        ctx, token = open_request(rid)
+        state = {"status": 500}
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                message = dict(message)
+                message["headers"] = list(message.get("headers") or []) + [(HEADER, rid.encode("latin-1"))]
+            await send(message)
+
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            elapsed = time.perf_counter() - t0
+            # Rapport de démarrage (/debug/startup): durée de la première requête du worker
+            if startup_report.first_request is None:
+                startup_report.first_request_done(scope.get("path", ""), elapsed)
+            try:
+                self._log(scope, ctx, state["status"], elapsed * 1000.0)
+            finally:
+                close_request(token)
+
+    def _log(self, scope, ctx, status: int, duration_ms: float) -> None:
+        method = scope.get("method", "GET")
+        # Route résolue par le routeur (scope partagé), à défaut le chemin brut
+        route = getattr(scope.get("route"), "path", None) or scope.get("path", "")
+        audit = method in _WRITE_METHODS
+        if not audit and status < 400 and duration_ms < LOG_ACCESS_SLOW_MS:
+            rate = ROUTE_SAMPLE_RATES.get(route, LOG_ACCESS_SAMPLE_RATE)
+            if rate <= 0.0 or (rate < 1.0 and random.random() >= rate):
+                return
+
+        fields = {
+            "method": method,
+            "route": route,
+            "path": scope.get("path"),
+            "status": status,
+            "duration_ms": round(duration_ms, 2),
+        }
+        path_params = scope.get("path_params") or {}
+        if "collectivite_id" in path_params:
+            fields["collectivite_id"] = path_params["collectivite_id"]
+        # sub, arbitrage_id... ajoutés par auth / services via bind()
+        fields.update(ctx)
+        logger = audit_logger if audit else access_logger
+        logger.info("audit" if audit else "access", extra={"fields": fields, "request_id": ctx["request_id"]})
@@ -0,0 +1,136 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Tuple
+
+from fastapi import Depends, HTTPException
+
+from auth.dependencies import get_current_user
+
+
+# Contrôle d'admission en process (complète la rate-limit WAF par IP de l'App Gateway)
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1").strip() in ("1", "true", "yes")
+# Jetons/s et rafale par collectivité (tenant) et par utilisateur (sub)
+TENANT_RATE = float(os.getenv("ADMISSION_TENANT_RATE", "50"))
+TENANT_BURST = float(os.getenv("ADMISSION_TENANT_BURST", "200"))
+USER_RATE = float(os.getenv("ADMISSION_USER_RATE", "30"))
+USER_BURST = float(os.getenv("ADMISSION_USER_BURST", "120"))
+MAX_BUCKETS = int(os.getenv("ADMISSION_MAX_BUCKETS", "10000"))
+
+# Concurrence globale des runs moteur (par worker)
+ENGINE_MAX_CONCURRENCY = int(os.getenv("ENGINE_MAX_CONCURRENCY", str(os.cpu_count() or 2)))
+ENGINE_QUEUE_TIMEOUT_S = float(os.getenv("ENGINE_QUEUE_TIMEOUT_S", "0.05"))
+
+# Coût par type d'endpoint (en jetons); un run coûte RUN_BASE + n_projets / RUN_PROJETS_PER_TOKEN
+COSTS: Dict[str, float] = {
+    "read": 1.0,
+    "list": 2.0,
+    "write": 2.0,
+    "export": 20.0,
+}
+RUN_BASE_COST = 5.0
+RUN_PROJETS_PER_TOKEN = 100.0
+
+
+class _TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, cost: float, now: float) -> float:
+        """Consomme cost jetons; retourne 0 si admis, sinon l'attente (s) avant admission."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        # Un coût > rafale serait inadmissible: plafonné (le bucket est vidé)
+        cost = min(cost, self.burst)
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate if self.rate > 0 else 60.0
+
+
+class AdmissionController:
+    def __init__(self):
+        self._buckets: "OrderedDict[Tuple[str, str], _TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._engine = threading.BoundedSemaphore(max(1, ENGINE_MAX_CONCURRENCY))
+        self.stats = {"admitted": 0, "rejected_429": 0, "rejected_503": 0}
+
+    def _bucket(self, kind: str, key: str, now: float) -> _TokenBucket:
+        rate, burst = (TENANT_RATE, TENANT_BURST) if kind == "tenant" else (USER_RATE, USER_BURST)
+        b = self._buckets.get((kind, key))
+        if b is None:
+            b = _TokenBucket(rate, burst, now)
+            self._buckets[(kind, key)] = b
+            while len(self._buckets) > MAX_BUCKETS:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end((kind, key))
+        return b
+
+    def charge(self, collectivite_id: str, sub: str, cost: float) -> None:
+        """Débite les deux buckets (tenant + user) ou lève 429 avec Retry-After."""
+        if not ADMISSION_ENABLED:
+            return
+        now = time.monotonic()
+        with self._lock:
+            tenant = self._bucket("tenant", collectivite_id, now)
+            user = self._bucket("user", sub, now)
+            wait = tenant.take(cost, now)
+            if wait == 0.0:
+                wait = user.take(cost, now)
+                if wait > 0.0:
+                    # Rembourse le tenant: la requête n'est pas admise
+                    tenant.tokens = min(tenant.burst, tenant.tokens + cost)
+            if wait > 0.0:
+                self.stats["rejected_429"] += 1
+            else:
+                self.stats["admitted"] += 1
+        if wait > 0.0:
+            raise HTTPException(
+                status_code=429,
+                detail={"code": "RATE_LIMITED", "message": "Trop de requêtes, réessayer plus tard"},
+                headers={"Retry-After": str(max(1, math.ceil(wait)))},
+            )
+
+    @contextmanager
+    def engine_slot(self) -> Iterator[None]:
+        """Slot moteur; 503 immédiat (Retry-After) si tous les slots sont pris."""
+        if not ADMISSION_ENABLED:
+            yield
+            return
+        if not self._engine.acquire(timeout=ENGINE_QUEUE_TIMEOUT_S):
+            self.stats["rejected_503"] += 1
+            raise HTTPException(
+                status_code=503,
+                detail={"code": "OVERLOADED", "message": "Moteur saturé, réessayer plus tard"},
+                headers={"Retry-After": "1"},
+            )
+        try:
+            yield
+        finally:
+            self._engine.release()
+
+
+admission = AdmissionController()
+
+
+def run_cost(n_projets: int) -> float:
+    return RUN_BASE_COST + n_projets / RUN_PROJETS_PER_TOKEN
+
+
+def admit(kind: str):
+    """Dépendance FastAPI: débite COSTS[kind] pour (collectivite_id, sub)."""
+    cost = COSTS[kind]
+
+    def _admit(collectivite_id: str, user: Dict[str, Any] = Depends(get_current_user)) -> None:
+        admission.charge(collectivite_id, user.get("sub", "unknown"), cost)
+
+    return _admit
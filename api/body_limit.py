@@ -0,0 +1,79 @@
+import json
+from typing import Tuple
+
+
+class _TooLarge(Exception):
+    pass
+
+
+class BodySizeLimitMiddleware:
+    """
+    Middleware ASGI pur: borne la taille du corps des requêtes dont le chemin finit par
+    l'un des `path_suffixes` (imports multipart), AVANT tout parsing. Content-Length
+    au-delà de la limite -> 413 sans appeler l'app; corps découpé (chunked) ou
+    Content-Length sous-déclaré -> octets comptés à la lecture, 413 dès le dépassement
+    (la réponse éventuelle de l'app, erreur de parsing comprise, est remplacée).
+    """
+
+    def __init__(self, app, max_bytes: int, path_suffixes: Tuple[str, ...]):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.path_suffixes = tuple(path_suffixes)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope.get("path", "").endswith(self.path_suffixes):
+            await self.app(scope, receive, send)
+            return
+
+        for k, v in scope.get("headers") or ():
+            if k == b"content-length":
+                try:
+                    declared = int(v)
+                except ValueError:
+                    declared = 0
+                if declared > self.max_bytes:
+                    await self._reject(send)
+                    return
+                break
+
+        state = {"received": 0, "too_large": False, "started": False}
+
+        async def _receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                state["received"] += len(message.get("body", b""))
+                if state["received"] > self.max_bytes:
+                    state["too_large"] = True
+                    raise _TooLarge()
+            return message
+
+        async def _send(message):
+            if state["too_large"]:
+                return
+            if message["type"] == "http.response.start":
+                state["started"] = True
+            await send(message)
+
+        try:
+            await self.app(scope, _receive, _send)
+        except Exception:
+            if not state["too_large"]:
+                raise
+        if state["too_large"] and not state["started"]:
+            await self._reject(send)
+
+    async def _reject(self, send) -> None:
+        mb = self.max_bytes / (1024 * 1024)
+        body = json.dumps(
+            {"detail": {"code": "PAYLOAD_TOO_LARGE", "message": f"corps de requête > {mb:g} Mo"}}
+        ).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("latin-1")),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
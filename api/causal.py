@@ -0,0 +1,69 @@
+from typing import Optional
+
+from services.causal import (
+    CAUSAL_COOKIE,
+    CAUSAL_COOKIE_MAX_AGE_S,
+    CAUSAL_COOKIE_SECURE,
+    CAUSAL_HEADER,
+    close_causal,
+    open_causal,
+    outgoing_token,
+)
+
+_HEADER = CAUSAL_HEADER.lower().encode("latin-1")
+_COOKIE_PREFIX = CAUSAL_COOKIE + "="
+
+
+def _incoming(scope) -> Optional[str]:
+    # En-tête (clients API, App Gateway) prioritaire sur le cookie (front navigateur)
+    cookie = None
+    for k, v in scope.get("headers") or ():
+        if k == _HEADER:
+            return v.decode("latin-1").strip()
+        if k == b"cookie":
+            for item in v.decode("latin-1").split(";"):
+                item = item.strip()
+                if item.startswith(_COOKIE_PREFIX):
+                    cookie = item[len(_COOKIE_PREFIX):]
+    return cookie
+
+
+def _set_cookie(token: str) -> bytes:
+    value = f"{CAUSAL_COOKIE}={token}; Path=/; Max-Age={CAUSAL_COOKIE_MAX_AGE_S}; HttpOnly; SameSite=Lax"
+    if CAUSAL_COOKIE_SECURE:
+        value += "; Secure"
+    return value.encode("latin-1")
+
+
+class CausalConsistencyMiddleware:
+    """
+    Middleware ASGI pur: reprend le jeton causal de la requête (X-CC-Causal ou cookie
+    cc_causal) pour services.causal, renvoie le jeton avancé (en-tête + cookie) si la
+    requête a touché Mongo en session, puis libère la session.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        state, token = open_causal(_incoming(scope))
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                out = outgoing_token(state)
+                if out:
+                    message = dict(message)
+                    message["headers"] = list(message.get("headers") or []) + [
+                        (_HEADER, out.encode("latin-1")),
+                        (b"set-cookie", _set_cookie(out)),
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            close_causal(state, token)
@@ -0,0 +1,190 @@
+import os
+import zlib
+from typing import Optional, Tuple
+
+import anyio.to_thread
+
+try:
+    import brotli
+except ImportError:  # gzip seul si le module n'est pas installé
+    brotli = None
+
+
+# En dessous du seuil, l'en-tête + le CPU coûtent plus que les octets gagnés
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_ENABLED = os.getenv("COMPRESS_ENABLED", "1").strip() in ("1", "true", "yes")
+
+# Niveau selon la taille (borne haute exclusive, gzip, brotli): les petits corps
+# se compressent vite même à niveau élevé, les gros basculent vers un niveau rapide
+# pour borner le CPU par requête (mesures: cc_compression_bench_v1.py)
+_LEVELS = (
+    (64 * 1024, 6, 5),
+    (1024 * 1024, 5, 4),
+    (8 * 1024 * 1024, 3, 2),
+    (None, 1, 1),
+)
+# Au-delà, la compression part dans le threadpool (zlib/brotli relâchent le GIL)
+# au lieu de bloquer la boucle d'événements
+COMPRESS_OFFLOAD_BYTES = int(os.getenv("COMPRESS_OFFLOAD_BYTES", str(256 * 1024)))
+# Corps découpés: tamponnés jusqu'à cette taille avant de passer en streaming
+_STREAM_BUFFER_BYTES = 256 * 1024
+# Corps en streaming (taille inconnue): niveau rapide
+_STREAM_LEVELS = (3, 2)
+
+_COMPRESSIBLE = ("application/json", "application/x-ndjson", "text/")
+
+
+def levels_for(size: int) -> Tuple[int, int]:
+    """(niveau gzip, qualité brotli) pour un corps de `size` octets."""
+    for bound, gz, br in _LEVELS:
+        if bound is None or size < bound:
+            return gz, br
+    return _LEVELS[-1][1], _LEVELS[-1][2]
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """'br', 'gzip' ou None selon Accept-Encoding (q-values; br préféré à qualité égale)."""
+    best, best_q = None, 0.0
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name == "br" and brotli is None:
+            continue
+        if name not in ("br", "gzip", "*") or q <= 0.0:
+            continue
+        if name == "*":
+            name = "br" if brotli is not None else "gzip"
+        if q > best_q or (q == best_q and name == "br"):
+            best, best_q = name, q
+    return best
+
+
+def compress(body: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    gz, br = levels_for(len(body))
+    if encoding == "br":
+        return brotli.compress(body, quality=br if level is None else level)
+    # wbits=31: en-tête gzip (et non zlib brut)
+    c = zlib.compressobj(gz if level is None else level, zlib.DEFLATED, 31)
+    return c.compress(body) + c.flush()
+
+
+class _StreamCompressor:
+    def __init__(self, encoding: str):
+        gz, br = _STREAM_LEVELS
+        if encoding == "br":
+            self._c = brotli.Compressor(quality=br)
+            self._flush = self._c.flush
+            self._finish = self._c.finish
+            self._compress = self._c.process
+        else:
+            self._c = zlib.compressobj(gz, zlib.DEFLATED, 31)
+            self._compress = self._c.compress
+            self._flush = lambda: self._c.flush(zlib.Z_SYNC_FLUSH)
+            self._finish = self._c.flush
+
+    def chunk(self, data: bytes, more: bool) -> bytes:
+        # Flush à chaque chunk: un export NDJSON reste lisible au fil de l'eau
+        out = self._compress(data)
+        return out + (self._flush() if more else self._finish())
+
+
+class CompressionMiddleware:
+    """
+    Middleware ASGI pur: gzip/brotli négocié, seulement au-dessus de COMPRESS_MIN_BYTES
+    et pour les types texte/JSON, niveau choisi selon la taille.
+    Les réponses portant déjà un Content-Encoding (octets pré-compressés stockés,
+    voir services/precompressed.py) passent telles quelles.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = ""
+        for k, v in scope.get("headers") or ():
+            if k == b"accept-encoding":
+                accept = v.decode("latin-1")
+                break
+        encoding = negotiate(accept) if accept else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        state = {"start": None, "mode": None, "stream": None, "buffer": [], "size": 0}
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                state["start"] = message
+                headers = {k.lower(): v for k, v in message.get("headers") or ()}
+                ctype = headers.get(b"content-type", b"").decode("latin-1")
+                if b"content-encoding" in headers or not ctype.startswith(_COMPRESSIBLE):
+                    state["mode"] = "passthrough"
+                    await send(message)
+                return
+            if message["type"] != "http.response.body" or state["mode"] == "passthrough":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more = message.get("more_body", False)
+            if state["mode"] is None:
+                # Mise en tampon jusqu'à la fin du corps ou _STREAM_BUFFER_BYTES: la plupart
+                # des réponses (y compris via BaseHTTPMiddleware, qui découpe) tiennent en un
+                # corps complet, compressé selon sa taille avec un Content-Length exact
+                state["buffer"].append(body)
+                state["size"] += len(body)
+                if more and state["size"] < _STREAM_BUFFER_BYTES:
+                    return
+                body = b"".join(state["buffer"])
+                state["buffer"] = []
+                if not more:
+                    await self._send_complete(send, state, body, encoding)
+                    return
+                # Streaming long (exports): compression au fil de l'eau
+                state["mode"] = "stream"
+                state["stream"] = _StreamCompressor(encoding)
+                await send(self._start(state["start"], encoding, None))
+            await send({
+                "type": "http.response.body",
+                "body": state["stream"].chunk(body, more),
+                "more_body": more,
+            })
+
+        await self.app(scope, receive, _send)
+
+    async def _send_complete(self, send, state, body: bytes, encoding: str) -> None:
+        if len(body) < self.minimum_size:
+            state["mode"] = "passthrough"
+            await send(state["start"])
+            await send({"type": "http.response.body", "body": body})
+            return
+        if len(body) >= COMPRESS_OFFLOAD_BYTES:
+            payload = await anyio.to_thread.run_sync(compress, body, encoding)
+        else:
+            payload = compress(body, encoding)
+        await send(self._start(state["start"], encoding, len(payload)))
+        await send({"type": "http.response.body", "body": payload})
+
+    @staticmethod
+    def _start(start, encoding: str, length: Optional[int]):
+        headers = [
+            (k, v) for k, v in start.get("headers") or ()
+            if k.lower() not in (b"content-length", b"vary")
+        ]
+        vary = [v for k, v in start.get("headers") or () if k.lower() == b"vary"]
+        headers.append((b"vary", b", ".join(vary + [b"Accept-Encoding"])))
+        headers.append((b"content-encoding", encoding.encode("ascii")))
+        if length is not None:
+            headers.append((b"content-length", str(length).encode("ascii")))
+        return {**start, "headers": headers}
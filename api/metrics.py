@@ -0,0 +1,76 @@
+import time
+
+from fastapi import APIRouter, Response
+from starlette.routing import Match
+
+from services.metrics import (
+    HTTP_DURATION,
+    HTTP_IN_FLIGHT,
+    HTTP_REQUEST_SIZE,
+    HTTP_RESPONSE_SIZE,
+    render_latest,
+)
+
+
+router = APIRouter(tags=["system"])
+
+
+@router.get("/metrics", include_in_schema=False)
+def metrics():
+    body, content_type = render_latest()
+    return Response(content=body, media_type=content_type)
+
+
+def _route_template(scope) -> str:
+    """
+    Template de la route (ex: /api/v1/collectivites/{collectivite_id}/arbitrage:last),
+    jamais l'URL brute: cardinalité bornée par le nombre de routes.
+    """
+    app = scope.get("app")
+    router = getattr(app, "router", None)
+    for route in getattr(router, "routes", ()):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", "unmatched")
+    return "unmatched"
+
+
+class PrometheusMiddleware:
+    """Middleware ASGI pur (pas de BaseHTTPMiddleware: ni tâche ni copie du corps)."""
+
+    def __init__(self, app, skip_paths=("/metrics",)):
+        self.app = app
+        self.skip_paths = frozenset(skip_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("path") in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        method = scope.get("method", "GET")
+        route = _route_template(scope)
+        t0 = time.perf_counter()
+        state = {"status": 500, "size": 0}
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                state["size"] += len(message.get("body", b""))
+            await send(message)
+
+        in_flight = HTTP_IN_FLIGHT.labels(method, route)
+        in_flight.inc()
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            in_flight.dec()
+            HTTP_DURATION.labels(method, route, str(state["status"])).observe(time.perf_counter() - t0)
+            HTTP_RESPONSE_SIZE.labels(route).observe(state["size"])
+            for k, v in scope.get("headers") or ():
+                if k == b"content-length":
+                    try:
+                        HTTP_REQUEST_SIZE.labels(route).observe(int(v))
+                    except ValueError:
+                        pass
+                    break
@@ -0,0 +1,267 @@
+import cProfile
+import hashlib
+import hmac
+import json
+import marshal
+import os
+import random
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse
+from fastapi.security.utils import get_authorization_scheme_param
+
+from auth.dependencies import _decode_token, require_scope
+
+
+# Désactivé par défaut: sans PROFILING_ENABLED le middleware n'est même pas installé
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0").strip() in ("1", "true", "yes")
+PROFILING_SECRET = os.getenv("PROFILING_SECRET", "").strip()
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "1.0"))
+PROFILING_DIR = os.getenv("PROFILING_DIR", "/tmp/cc_profiles")
+PROFILING_MAX_FILES = int(os.getenv("PROFILING_MAX_FILES", "50"))
+PROFILING_SAMPLE_INTERVAL_S = float(os.getenv("PROFILING_SAMPLE_INTERVAL_S", "0.002"))
+PROFILING_SCOPE = "admin:profile"
+
+HEADER = b"x-cc-profile"
+HEADER_MODE = b"x-cc-profile-mode"
+_ID_RE = re.compile(r"^[0-9A-Za-z_-]{1,64}$")
+# Threads inactifs (pool en attente, boucle en select): exclus des échantillons
+_IDLE_FILES = ("threading.py", "selectors.py", "queue.py")
+
+
+def sign_profile_header(ttl_s: int = 300, secret: Optional[str] = None) -> str:
+    """Valeur du header X-CC-Profile: '<exp>.<hmac>' (valable ttl_s secondes)."""
+    exp = str(int(time.time()) + ttl_s)
+    key = (secret or PROFILING_SECRET).encode("utf-8")
+    return f"{exp}.{hmac.new(key, exp.encode(), hashlib.sha256).hexdigest()[:32]}"
+
+
+def _signed_ok(value: str) -> bool:
+    if not PROFILING_SECRET or "." not in value:
+        return False
+    exp, sig = value.split(".", 1)
+    if not exp.isdigit() or int(exp) < time.time():
+        return False
+    expected = hmac.new(PROFILING_SECRET.encode("utf-8"), exp.encode(), hashlib.sha256).hexdigest()[:32]
+    return hmac.compare_digest(sig, expected)
+
+
+def _admin_ok(headers: Dict[bytes, bytes]) -> Optional[str]:
+    scheme, token = get_authorization_scheme_param(headers.get(b"authorization", b"").decode("latin-1"))
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        user = _decode_token(token)
+    except HTTPException:
+        return None
+    return user.get("sub") if PROFILING_SCOPE in user.scopes_set else None
+
+
+# ---------- Échantillonneur de piles (tous threads: couvre le threadpool des routes sync) ----------
+class _StackSampler:
+    def __init__(self, interval_s: float):
+        self.interval_s = interval_s
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="cc-profiler", daemon=True)
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval_s):
+            for tid, frame in sys._current_frames().items():
+                if tid == me or frame.f_code.co_filename.endswith(_IDLE_FILES):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> str:
+        self._stop.set()
+        self._thread.join()
+        # Format "collapsed" (flamegraph.pl, speedscope)
+        return "".join(f"{s} {n}\n" for s, n in self.stacks.most_common())
+
+
+# ---------- Anneau sur disque ----------
+def _meta_path(profile_id: str) -> str:
+    return os.path.join(PROFILING_DIR, f"{profile_id}.json")
+
+
+def _enforce_ring() -> None:
+    metas = sorted(
+        (os.path.join(PROFILING_DIR, f) for f in os.listdir(PROFILING_DIR) if f.endswith(".json")),
+        key=os.path.getmtime,
+    )
+    for meta in metas[: max(0, len(metas) - PROFILING_MAX_FILES)]:
+        stem = meta[: -len(".json")]
+        for ext in (".json", ".prof", ".collapsed.txt"):
+            try:
+                os.unlink(stem + ext)
+            except FileNotFoundError:
+                pass
+
+
+def _store(meta: Dict[str, Any], data: bytes, ext: str) -> None:
+    os.makedirs(PROFILING_DIR, exist_ok=True)
+    pid = meta["profile_id"]
+    with open(os.path.join(PROFILING_DIR, pid + ext), "wb") as f:
+        f.write(data)
+    meta["file"] = pid + ext
+    # Métadonnées écrites en dernier: un profil listé est toujours complet
+    with open(_meta_path(pid), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    _enforce_ring()
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+    if not os.path.isdir(PROFILING_DIR):
+        return []
+    out = []
+    for name in os.listdir(PROFILING_DIR):
+        if name.endswith(".json"):
+            try:
+                with open(os.path.join(PROFILING_DIR, name), "r", encoding="utf-8") as f:
+                    out.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    return sorted(out, key=lambda m: m.get("created_at", ""), reverse=True)
+
+
+# ---------- Middleware ----------
+class ProfilingMiddleware:
+    """
+    Profil d'une requête précise, sur demande (header X-CC-Profile signé, ou "1" + token
+    avec le scope admin:profile), échantillonné à PROFILING_SAMPLE_RATE.
+    Mode "sample" (défaut, piles de tous les threads) ou "cprofile" (thread de la boucle,
+    utile pour les routes async) via X-CC-Profile-Mode. Pic tracemalloc dans les deux cas.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._lock = threading.Lock()  # un seul profil à la fois (tracemalloc est global)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or ())
+        value = headers.get(HEADER)
+        if value is None:
+            await self.app(scope, receive, send)
+            return
+
+        value = value.decode("latin-1")
+        who = "signed" if _signed_ok(value) else _admin_ok(headers)
+        if (
+            who is None
+            or random.random() >= PROFILING_SAMPLE_RATE
+            or not self._lock.acquire(blocking=False)
+        ):
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self._profiled(scope, receive, send, who, headers.get(HEADER_MODE, b"sample").decode("latin-1"))
+        finally:
+            self._lock.release()
+
+    async def _profiled(self, scope, receive, send, who: str, mode: str) -> None:
+        profile_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S") + "-" + uuid.uuid4().hex[:8]
+        status = {"code": 500}
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message = dict(message)
+                message["headers"] = list(message.get("headers") or []) + [
+                    (b"x-cc-profile-id", profile_id.encode("ascii"))
+                ]
+            await send(message)
+
+        started_tracemalloc = not tracemalloc.is_tracing()
+        if started_tracemalloc:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        profiler = cProfile.Profile() if mode == "cprofile" else None
+        sampler = None if profiler else _StackSampler(PROFILING_SAMPLE_INTERVAL_S)
+
+        t0 = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        else:
+            sampler.start()
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            duration = time.perf_counter() - t0
+            if profiler:
+                profiler.disable()
+                profiler.create_stats()
+                # Même format que dump_stats (lisible par pstats / snakeviz)
+                data, ext = marshal.dumps(profiler.stats), ".prof"
+            else:
+                data, ext = sampler.stop().encode("utf-8"), ".collapsed.txt"
+            _, peak = tracemalloc.get_traced_memory()
+            if started_tracemalloc:
+                tracemalloc.stop()
+
+            route = scope.get("route")
+            _store(
+                {
+                    "profile_id": profile_id,
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                    "method": scope.get("method"),
+                    "path": scope.get("path"),
+                    "route": getattr(route, "path", None),
+                    "status": status["code"],
+                    "duration_ms": round(duration * 1000.0, 2),
+                    "tracemalloc_peak_kb": round(peak / 1024.0, 1),
+                    "mode": "cprofile" if profiler else "sample",
+                    "samples": None if profiler else sampler.samples,
+                    "requested_by": who,
+                    "pid": os.getpid(),
+                },
+                data,
+                ext,
+            )
+
+
+# ---------- Admin ----------
+router = APIRouter(prefix="/api/v1/admin", tags=["admin"])
+
+
+@router.get("/profiles")
+def get_profiles(_scope=Depends(require_scope(PROFILING_SCOPE))):
+    return {"enabled": PROFILING_ENABLED, "items": list_profiles()}
+
+
+@router.get("/profiles/{profile_id}")
+def download_profile(profile_id: str, _scope=Depends(require_scope(PROFILING_SCOPE))):
+    if not _ID_RE.match(profile_id):
+        raise HTTPException(status_code=400, detail={"code": "INVALID_ID", "message": "Identifiant invalide"})
+    try:
+        with open(_meta_path(profile_id), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        raise HTTPException(status_code=404, detail={"code": "NOT_FOUND", "message": "Profil introuvable"})
+    path = os.path.join(PROFILING_DIR, meta["file"])
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail={"code": "NOT_FOUND", "message": "Profil introuvable"})
+    media = "text/plain" if path.endswith(".txt") else "application/octet-stream"
+    return FileResponse(path, media_type=media, filename=meta["file"])
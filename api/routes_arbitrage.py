@@ -1,13 +1,27 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+import os
+import tempfile
+from datetime import datetime
+from typing import Literal, Union
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import ValidationError
+from starlette.background import BackgroundTask
 
-from auth.dependencies import require_collectivite_access, require_scope
+from api.admission import COSTS, admission, admit, run_cost
+from api.compression import negotiate
+from auth.dependencies import get_current_user, require_collectivite_access, require_scope
 from schemas.arbitrage import (
     ArbitrageRunIn,
+    ArbitrageRunRefIn,
     ArbitrageRunOut,
     CollectiviteSettings,
     ArbitrageListOut,
     ArbitrageCursorOut,
+    RollupsOut,
+    ArbitrageDiffOut,
+    ArbitrageOfficialIn,
+    SimRankingOut,
 )
 from services.arbitrage_service import (
     run_arbitrage,
@@ -17,6 +31,21 @@ from services.arbitrage_service import (
     get_arbitrage_by_id,
     list_arbitrages,
     list_arbitrages_cursor,
+    export_arbitrages_ndjson,
+    export_arbitrages_csv,
+    diff_arbitrages,
+)
+from services.analytics_export import write_projets_parquet, write_projets_arrow
+from services.rollups import get_rollups
+from services.archive_service import set_official
+from services.sim_service import rank_executive
+from services.precompressed import PRECOMPRESSED_ENABLED, get_blob
+from services.portfolio_service import resolve_run_payload
+from services.run_coalescing import (
+    complete_idempotency_key,
+    release_idempotency_key,
+    reserve_idempotency_key,
+    run_single_flight,
 )
 
 router = APIRouter(prefix="/api/v1", tags=["arbitrage"])
@@ -32,26 +61,72 @@ def _err(status: int, code: str, message: str):
 )
 def post_arbitrage_run(
     collectivite_id: str,
-    payload: ArbitrageRunIn,
+    payload: Union[ArbitrageRunIn, ArbitrageRunRefIn],
+    response: Response,
+    idempotency_key: str | None = Header(default=None, alias="Idempotency-Key"),
     user=Depends(require_collectivite_access),
     _scope=Depends(require_scope("arbitrage:write")),
 ):
-    try:
+    triggered_by = user.get("sub", "unknown")
+    source = None
+    if isinstance(payload, ArbitrageRunRefIn):
+        # Portefeuille stocké: déjà validé à l'import, pas de liste inline
+        try:
+            data = resolve_run_payload(collectivite_id, payload.model_dump())
+        except KeyError as e:
+            _err(404, "NOT_FOUND", str(e))
+        source = {"portfolio_id": payload.portfolio_id}
+    else:
         data = payload.model_dump()
-        triggered_by = user.get("sub", "unknown")
-        out = run_arbitrage(collectivite_id, data, triggered_by=triggered_by)
-        return {
-            "arbitrage_id": out["arbitrage_id"],
-            "collectivite_id": out["collectivite_id"],
-            "mandat": out["mandat"],
-            "synthese": out["synthese"],
-            "projets": out["projets"],
-            "audit": out["audit"],
-        }
-    except ValidationError as e:
-        _err(422, "VALIDATION_ERROR", str(e))
-    except Exception as e:
-        _err(500, "INTERNAL_ERROR", str(e))
+
+    if idempotency_key is not None:
+        # Clé réservée avant tout calcul; retry d'un run déjà fait: arbitrage d'origine, sans débit
+        try:
+            replay = reserve_idempotency_key(collectivite_id, triggered_by, idempotency_key, data)
+        except ValueError as e:
+            _err(422, "IDEMPOTENCY_KEY_MISMATCH", str(e))
+        except TimeoutError as e:
+            _err(409, "IDEMPOTENCY_KEY_IN_PROGRESS", str(e))
+        if replay is not None:
+            response.headers["Idempotent-Replayed"] = "true"
+            return _shape(replay)
+
+    def _compute():
+        # Slot moteur pris par le seul calculateur: les runs coalescés attendent sans slot
+        with admission.engine_slot():
+            return run_arbitrage(collectivite_id, data, triggered_by=triggered_by, source=source)
+
+    try:
+        # Admission: coût proportionnel au portefeuille (429)
+        admission.charge(collectivite_id, triggered_by, run_cost(len(data["projets"])))
+        try:
+            out, outcome = run_single_flight(collectivite_id, data, _compute)
+        except HTTPException:
+            raise
+        except ValidationError as e:
+            _err(422, "VALIDATION_ERROR", str(e))
+        except Exception as e:
+            _err(500, "INTERNAL_ERROR", str(e))
+    except BaseException:
+        if idempotency_key is not None:
+            release_idempotency_key(collectivite_id, triggered_by, idempotency_key)
+        raise
+    if outcome.startswith("coalesced"):
+        response.headers["X-Run-Coalesced"] = "true"
+    if idempotency_key is not None:
+        complete_idempotency_key(collectivite_id, triggered_by, idempotency_key, out["arbitrage_id"])
+    return _shape(out)
+
+
+def _shape(out: dict) -> dict:
+    return {
+        "arbitrage_id": out["arbitrage_id"],
+        "collectivite_id": out["collectivite_id"],
+        "mandat": out["mandat"],
+        "synthese": out["synthese"],
+        "projets": out["projets"],
+        "audit": out["audit"],
+    }
 
 
 @router.get(
@@ -62,6 +137,7 @@ def get_arbitrage_last(
     collectivite_id: str,
     _user=Depends(require_collectivite_access),
     _scope=Depends(require_scope("arbitrage:read")),
+    _adm=Depends(admit("read")),
 ):
     try:
         return get_last_arbitrage_out(collectivite_id)
@@ -78,10 +154,20 @@ def get_arbitrage_last(
 def get_arbitrage_by_id_route(
     collectivite_id: str,
     arbitrage_id: str,
+    request: Request,
     _user=Depends(require_collectivite_access),
     _scope=Depends(require_scope("arbitrage:read")),
+    _adm=Depends(admit("read")),
 ):
     try:
+        if PRECOMPRESSED_ENABLED:
+            # Arbitrage immuable: octets pré-compressés stockés, jamais recompressés
+            blob = get_blob(collectivite_id, arbitrage_id, lambda: get_arbitrage_by_id(collectivite_id, arbitrage_id))
+            body, encoding = blob.body_for(negotiate(request.headers.get("accept-encoding", "")))
+            headers = {"Vary": "Accept-Encoding"}
+            if encoding:
+                headers["Content-Encoding"] = encoding
+            return Response(content=body, media_type="application/json", headers=headers)
         return get_arbitrage_by_id(collectivite_id, arbitrage_id)
     except KeyError as e:
         _err(404, "NOT_FOUND", str(e))
@@ -89,6 +175,47 @@ def get_arbitrage_by_id_route(
         _err(500, "INTERNAL_ERROR", str(e))
 
 
+@router.put(
+    "/collectivites/{collectivite_id}/arbitrage/{arbitrage_id}/official",
+    response_model=dict,
+)
+def put_arbitrage_official(
+    collectivite_id: str,
+    arbitrage_id: str,
+    payload: ArbitrageOfficialIn,
+    _user=Depends(require_collectivite_access),
+    _scope=Depends(require_scope("arbitrage:write")),
+    _adm=Depends(admit("write")),
+):
+    """Un arbitrage officiel n'est jamais archivé par la politique de rétention."""
+    try:
+        return set_official(collectivite_id, arbitrage_id, payload.official)
+    except KeyError as e:
+        _err(404, "NOT_FOUND", str(e))
+    except Exception as e:
+        _err(500, "INTERNAL_ERROR", str(e))
+
+
+@router.get(
+    "/collectivites/{collectivite_id}/arbitrages/{arbitrage_id}/diff/{other_id}",
+    response_model=ArbitrageDiffOut,
+)
+def get_arbitrage_diff(
+    collectivite_id: str,
+    arbitrage_id: str,
+    other_id: str,
+    _user=Depends(require_collectivite_access),
+    _scope=Depends(require_scope("arbitrage:read")),
+    _adm=Depends(admit("list")),
+):
+    try:
+        return diff_arbitrages(collectivite_id, arbitrage_id, other_id)
+    except KeyError as e:
+        _err(404, "NOT_FOUND", str(e))
+    except Exception as e:
+        _err(500, "INTERNAL_ERROR", str(e))
+
+
 @router.get(
     "/collectivites/{collectivite_id}/arbitrages",
     response_model=ArbitrageListOut,
@@ -99,6 +226,7 @@ def get_arbitrages_paginated(
     limit: int = Query(default=10, ge=1, le=50),
     _user=Depends(require_collectivite_access),
     _scope=Depends(require_scope("arbitrage:read")),
+    _adm=Depends(admit("list")),
 ):
     try:
         return list_arbitrages(collectivite_id, page=page, limit=limit)
@@ -116,9 +244,93 @@ def get_arbitrages_cursor(
     cursor: str | None = Query(default=None),
     _user=Depends(require_collectivite_access),
     _scope=Depends(require_scope("arbitrage:read")),
+    _adm=Depends(admit("list")),
 ):
     try:
         return list_arbitrages_cursor(collectivite_id, limit=limit, cursor=cursor)
+    except ValueError as e:
+        _err(400, "INVALID_CURSOR", str(e))
+    except Exception as e:
+        _err(500, "INTERNAL_ERROR", str(e))
+
+
+@router.get("/collectivites/{collectivite_id}/arbitrages:export")
+def get_arbitrages_export(
+    collectivite_id: str,
+    format: Literal["ndjson", "csv"] = Query(default="ndjson"),
+    flatten: bool = Query(default=False, description="Une ligne par projet"),
+    since: datetime | None = Query(default=None),
+    until: datetime | None = Query(default=None),
+    _user=Depends(require_collectivite_access),
+    _scope=Depends(require_scope("arbitrage:read")),
+    _adm=Depends(admit("export")),
+):
+    if since and until and since >= until:
+        _err(422, "VALIDATION_ERROR", "'since' doit être antérieur à 'until'")
+
+    if format == "csv":
+        body = export_arbitrages_csv(collectivite_id, since=since, until=until, flatten=flatten)
+        media_type = "text/csv; charset=utf-8"
+    else:
+        body = export_arbitrages_ndjson(collectivite_id, since=since, until=until, flatten=flatten)
+        media_type = "application/x-ndjson"
+
+    filename = f"arbitrages-{collectivite_id}.{format}"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@router.get("/collectivites/{collectivite_id}/projets:export")
+def get_projets_export_columnar(
+    collectivite_id: str,
+    format: Literal["parquet", "arrow"] = Query(default="parquet"),
+    since: datetime | None = Query(default=None),
+    until: datetime | None = Query(default=None),
+    _user=Depends(require_collectivite_access),
+    _scope=Depends(require_scope("arbitrage:read")),
+    _adm=Depends(admit("export")),
+):
+    """Export colonnaire (une ligne par projet et par arbitrage) pour l'analyse."""
+    if since and until and since >= until:
+        _err(422, "VALIDATION_ERROR", "'since' doit être antérieur à 'until'")
+
+    # Fichier temporaire: Parquet a besoin d'un footer, donc pas de streaming direct
+    fd, path = tempfile.mkstemp(suffix=f".{format}")
+    os.close(fd)
+    try:
+        write = write_projets_parquet if format == "parquet" else write_projets_arrow
+        write(path, collectivite_ids=[collectivite_id], since=since, until=until)
+    except Exception as e:
+        os.unlink(path)
+        _err(500, "INTERNAL_ERROR", str(e))
+
+    media_type = "application/vnd.apache.parquet" if format == "parquet" else "application/vnd.apache.arrow.file"
+    return FileResponse(
+        path,
+        media_type=media_type,
+        filename=f"projets-{collectivite_id}.{format}",
+        background=BackgroundTask(os.unlink, path),
+    )
+
+
+@router.get(
+    "/collectivites/{collectivite_id}/arbitrages:rollups",
+    response_model=RollupsOut,
+)
+def get_arbitrages_rollups(
+    collectivite_id: str,
+    bucket: Literal["day", "month"] = Query(default="day"),
+    date_from: datetime | None = Query(default=None, alias="from"),
+    date_to: datetime | None = Query(default=None, alias="to"),
+    _user=Depends(require_collectivite_access),
+    _scope=Depends(require_scope("arbitrage:read")),
+    _adm=Depends(admit("read")),
+):
+    try:
+        return get_rollups(collectivite_id, bucket=bucket, date_from=date_from, date_to=date_to)
     except Exception as e:
         _err(500, "INTERNAL_ERROR", str(e))
 
@@ -132,6 +344,7 @@ def put_collectivite_settings(
     payload: CollectiviteSettings,
     _user=Depends(require_collectivite_access),
     _scope=Depends(require_scope("settings:write")),
+    _adm=Depends(admit("write")),
 ):
     try:
         doc = upsert_settings(collectivite_id, payload.model_dump())
@@ -150,8 +363,40 @@ def get_collectivite_settings(
     collectivite_id: str,
     _user=Depends(require_collectivite_access),
     _scope=Depends(require_scope("settings:read")),
+    _adm=Depends(admit("read")),
 ):
     try:
         return {"collectivite_id": collectivite_id, "settings": get_settings(collectivite_id)}
     except Exception as e:
         _err(500, "INTERNAL_ERROR", str(e))
+
+
+@router.get("/sim/executive:ranking", response_model=SimRankingOut)
+def get_sim_executive_ranking(
+    zone_ism: Literal["favorable", "sous_controle", "critique"] | None = Query(default=None),
+    zone_irm: Literal["faible", "vigilance", "eleve"] | None = Query(default=None),
+    sort: Literal["ism", "irm"] = Query(default="ism"),
+    top: int | None = Query(default=None, ge=1),
+    offset: int = Query(default=0, ge=0),
+    limit: int = Query(default=50, ge=1, le=1000),
+    user=Depends(get_current_user),
+    _scope=Depends(require_scope("arbitrage:read")),
+):
+    """Classement ISM/IRM de toutes les collectivités du token, en une requête."""
+    sub = user.get("sub", "unknown")
+    # Pas de collectivité unique: bucket "tenant" propre à l'utilisateur
+    admission.charge(f"ranking:{sub}", sub, COSTS["list"])
+    try:
+        return rank_executive(
+            list(user.get("collectivites") or []),
+            zone_ism=zone_ism,
+            zone_irm=zone_irm,
+            sort=sort,
+            top=top,
+            offset=offset,
+            limit=limit,
+        )
+    except ConnectionError as e:
+        _err(503, "UNAVAILABLE", str(e))
+    except Exception as e:
+        _err(500, "INTERNAL_ERROR", str(e))
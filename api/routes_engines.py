@@ -0,0 +1,36 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from auth.dependencies import get_current_user, require_scope
+from engine.registry import list_engines
+from services.engine_shadow import shadow_report, shadow_stats
+
+router = APIRouter(prefix="/api/v1", tags=["engines"])
+
+ENGINE_ADMIN_SCOPE = "admin:engine"
+
+
+def _err(status: int, code: str, message: str):
+    raise HTTPException(status_code=status, detail={"code": code, "message": message})
+
+
+@router.get("/engines")
+def get_engines(_user=Depends(get_current_user)):
+    """Versions enregistrées (épinglables via PUT /collectivites/{id}/settings)."""
+    return {"items": list_engines(), "shadow": shadow_stats()}
+
+
+@router.get("/admin/engine-shadow")
+def get_engine_shadow(
+    candidate: Optional[str] = Query(default=None),
+    collectivite_id: Optional[str] = Query(default=None),
+    only_diff: bool = Query(default=False),
+    limit: int = Query(default=50, ge=1, le=200),
+    _scope=Depends(require_scope(ENGINE_ADMIN_SCOPE)),
+):
+    """Revue des runs shadow: synthèse par candidat (sorties identiques, latences) + derniers runs."""
+    try:
+        return shadow_report(candidate=candidate, collectivite_id=collectivite_id, only_diff=only_diff, limit=limit)
+    except Exception as e:
+        _err(500, "INTERNAL_ERROR", str(e))
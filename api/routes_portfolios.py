@@ -0,0 +1,100 @@
+import io
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Query, UploadFile
+from pydantic import ValidationError
+
+from api.admission import admit
+from auth.dependencies import require_collectivite_access, require_scope
+from schemas.arbitrage import ArbitrageRunIn, Contraintes, Hypotheses, PortfolioOut
+from services.portfolio_service import create_portfolio, get_portfolio, ingest_portfolio
+
+router = APIRouter(prefix="/api/v1", tags=["portfolios"])
+
+
+def _err(status: int, code: str, message: str):
+    raise HTTPException(status_code=status, detail={"code": code, "message": message})
+
+
+def _upload_format(upload: UploadFile, fmt: Optional[str]) -> str:
+    if fmt:
+        return fmt
+    name = (upload.filename or "").lower()
+    if name.endswith(".csv") or (upload.content_type or "").startswith("text/csv"):
+        return "csv"
+    if name.endswith((".ndjson", ".jsonl", ".json")) or "json" in (upload.content_type or ""):
+        return "ndjson"
+    _err(422, "VALIDATION_ERROR", "format indéterminé: préciser ?format=csv|ndjson")
+
+
+@router.post("/collectivites/{collectivite_id}/portfolios", response_model=PortfolioOut)
+def post_portfolio(
+    collectivite_id: str,
+    payload: ArbitrageRunIn,
+    user=Depends(require_collectivite_access),
+    _scope=Depends(require_scope("arbitrage:write")),
+    _adm=Depends(admit("write")),
+):
+    """Portefeuille stocké une fois (même contenu = même portfolio_id), référencé ensuite par id."""
+    try:
+        return create_portfolio(collectivite_id, payload.model_dump(), created_by=user.get("sub", "unknown"))
+    except ValueError as e:
+        _err(422, "VALIDATION_ERROR", str(e))
+    except Exception as e:
+        _err(500, "INTERNAL_ERROR", str(e))
+
+
+@router.post("/collectivites/{collectivite_id}/portfolios:upload", response_model=PortfolioOut)
+def post_portfolio_upload(
+    collectivite_id: str,
+    projets: UploadFile = File(..., description="CSV (en-tête = champs de ProjetIn) ou NDJSON"),
+    mandat: str = Form(...),
+    contraintes: str = Form(..., description="Contraintes (JSON)"),
+    hypotheses: str = Form(..., description="Hypotheses (JSON)"),
+    format: Optional[Literal["csv", "ndjson"]] = Query(default=None),
+    user=Depends(require_collectivite_access),
+    _scope=Depends(require_scope("arbitrage:write")),
+    _adm=Depends(admit("write")),
+):
+    """
+    Import multipart d'un gros portefeuille: le fichier est spoolé sur disque par
+    Starlette puis lu en flux, validé et écrit par lots (jamais chargé en entier).
+    Taille bornée en amont du parsing par BodySizeLimitMiddleware (413).
+    """
+    fmt = _upload_format(projets, format)
+    try:
+        header = {
+            "mandat": mandat,
+            "contraintes": Contraintes.model_validate_json(contraintes).model_dump(),
+            "hypotheses": Hypotheses.model_validate_json(hypotheses).model_dump(),
+        }
+    except ValidationError as e:
+        _err(422, "VALIDATION_ERROR", str(e))
+
+    text = io.TextIOWrapper(projets.file, encoding="utf-8-sig", newline="")
+    try:
+        return ingest_portfolio(collectivite_id, header, text, fmt, created_by=user.get("sub", "unknown"))
+    except ValueError as e:
+        # Inclut les erreurs de décodage (UnicodeDecodeError)
+        _err(422, "VALIDATION_ERROR", str(e))
+    except Exception as e:
+        _err(500, "INTERNAL_ERROR", str(e))
+    finally:
+        # Le fichier spoolé est fermé par Starlette
+        text.detach()
+
+
+@router.get("/collectivites/{collectivite_id}/portfolios/{portfolio_id}", response_model=PortfolioOut)
+def get_portfolio_route(
+    collectivite_id: str,
+    portfolio_id: str,
+    _user=Depends(require_collectivite_access),
+    _scope=Depends(require_scope("arbitrage:read")),
+    _adm=Depends(admit("read")),
+):
+    try:
+        return get_portfolio(collectivite_id, portfolio_id)
+    except KeyError as e:
+        _err(404, "NOT_FOUND", str(e))
+    except Exception as e:
+        _err(500, "INTERNAL_ERROR", str(e))
@@ -0,0 +1,177 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+
+from api.admission import admission, admit, run_cost
+from auth.dependencies import require_collectivite_access, require_scope
+from schemas.arbitrage import (
+    ArbitrageRunOut,
+    ScenarioEvalOut,
+    ScenarioIn,
+    ScenarioListOut,
+    ScenarioOut,
+)
+from api.routes_arbitrage import _shape
+from services.arbitrage_service import run_arbitrage
+from services.run_coalescing import (
+    complete_idempotency_key,
+    release_idempotency_key,
+    reserve_idempotency_key,
+    run_single_flight,
+)
+from services.scenario_service import (
+    create_scenario,
+    evaluate_scenario,
+    get_scenario,
+    list_scenarios,
+    materialize_scenario,
+    scenario_calc,
+)
+
+router = APIRouter(prefix="/api/v1", tags=["scenarios"])
+
+
+def _err(status: int, code: str, message: str):
+    raise HTTPException(status_code=status, detail={"code": code, "message": message})
+
+
+@router.post("/collectivites/{collectivite_id}/scenarios", response_model=ScenarioOut)
+def post_scenario(
+    collectivite_id: str,
+    payload: ScenarioIn,
+    user=Depends(require_collectivite_access),
+    _scope=Depends(require_scope("arbitrage:write")),
+    _adm=Depends(admit("write")),
+):
+    """Scénario = base (portfolio_id ou parent_scenario_id) + delta; seul le delta est stocké."""
+    try:
+        return create_scenario(collectivite_id, payload.model_dump(), created_by=user.get("sub", "unknown"))
+    except KeyError as e:
+        _err(404, "NOT_FOUND", str(e))
+    except ValueError as e:
+        _err(422, "VALIDATION_ERROR", str(e))
+    except Exception as e:
+        _err(500, "INTERNAL_ERROR", str(e))
+
+
+@router.get("/collectivites/{collectivite_id}/scenarios", response_model=ScenarioListOut)
+def get_scenarios(
+    collectivite_id: str,
+    portfolio_id: Optional[str] = Query(default=None),
+    limit: int = Query(default=100, ge=1, le=500),
+    _user=Depends(require_collectivite_access),
+    _scope=Depends(require_scope("arbitrage:read")),
+    _adm=Depends(admit("list")),
+):
+    try:
+        return list_scenarios(collectivite_id, portfolio_id=portfolio_id, limit=limit)
+    except Exception as e:
+        _err(500, "INTERNAL_ERROR", str(e))
+
+
+@router.get("/collectivites/{collectivite_id}/scenarios/{scenario_id}", response_model=ScenarioOut)
+def get_scenario_route(
+    collectivite_id: str,
+    scenario_id: str,
+    materialize: bool = Query(default=False, description="Inclure le portefeuille complet"),
+    _user=Depends(require_collectivite_access),
+    _scope=Depends(require_scope("arbitrage:read")),
+    _adm=Depends(admit("read")),
+):
+    try:
+        return get_scenario(collectivite_id, scenario_id, materialize=materialize)
+    except KeyError as e:
+        _err(404, "NOT_FOUND", str(e))
+    except Exception as e:
+        _err(500, "INTERNAL_ERROR", str(e))
+
+
+@router.post("/collectivites/{collectivite_id}/scenarios/{scenario_id}:evaluate", response_model=ScenarioEvalOut)
+def post_scenario_evaluate(
+    collectivite_id: str,
+    scenario_id: str,
+    user=Depends(require_collectivite_access),
+    _scope=Depends(require_scope("arbitrage:write")),
+):
+    """Arbitrage du scénario sans écriture; scores des projets inchangés repris du parent."""
+    sub = user.get("sub", "unknown")
+    try:
+        n_projets = get_scenario(collectivite_id, scenario_id)["n_projets"]
+    except KeyError as e:
+        _err(404, "NOT_FOUND", str(e))
+    admission.charge(collectivite_id, sub, run_cost(n_projets))
+    with admission.engine_slot():
+        try:
+            return evaluate_scenario(collectivite_id, scenario_id)
+        except KeyError as e:
+            _err(404, "NOT_FOUND", str(e))
+        except Exception as e:
+            _err(500, "INTERNAL_ERROR", str(e))
+
+
+@router.post("/collectivites/{collectivite_id}/scenarios/{scenario_id}:run", response_model=ArbitrageRunOut)
+def post_scenario_run(
+    collectivite_id: str,
+    scenario_id: str,
+    response: Response,
+    idempotency_key: str | None = Header(default=None, alias="Idempotency-Key"),
+    user=Depends(require_collectivite_access),
+    _scope=Depends(require_scope("arbitrage:write")),
+):
+    """
+    Enregistre l'arbitrage du scénario (document arbitrages standard, source = scénario),
+    scores des projets inchangés repris du parent. Single-flight et Idempotency-Key
+    comme arbitrage:run.
+    """
+    sub = user.get("sub", "unknown")
+    try:
+        doc = get_scenario(collectivite_id, scenario_id)
+    except KeyError as e:
+        _err(404, "NOT_FOUND", str(e))
+    except Exception as e:
+        _err(500, "INTERNAL_ERROR", str(e))
+    # Scénario immuable: son id identifie le portefeuille (coalescence et Idempotency-Key)
+    key_payload = {"scenario_id": scenario_id}
+
+    if idempotency_key is not None:
+        try:
+            replay = reserve_idempotency_key(collectivite_id, sub, idempotency_key, key_payload)
+        except ValueError as e:
+            _err(422, "IDEMPOTENCY_KEY_MISMATCH", str(e))
+        except TimeoutError as e:
+            _err(409, "IDEMPOTENCY_KEY_IN_PROGRESS", str(e))
+        if replay is not None:
+            response.headers["Idempotent-Replayed"] = "true"
+            return _shape(replay)
+
+    def _compute():
+        with admission.engine_slot():
+            return run_arbitrage(
+                collectivite_id,
+                materialize_scenario(collectivite_id, scenario_id),
+                triggered_by=sub,
+                source={"scenario_id": scenario_id, "portfolio_id": doc["portfolio_id"]},
+                calc_fn=lambda weights, engine_version: scenario_calc(
+                    collectivite_id, scenario_id, weights, engine_version
+                )[0],
+            )
+
+    try:
+        admission.charge(collectivite_id, sub, run_cost(doc["n_projets"]))
+        try:
+            out, outcome = run_single_flight(collectivite_id, key_payload, _compute)
+        except HTTPException:
+            raise
+        except KeyError as e:
+            _err(404, "NOT_FOUND", str(e))
+        except Exception as e:
+            _err(500, "INTERNAL_ERROR", str(e))
+    except BaseException:
+        if idempotency_key is not None:
+            release_idempotency_key(collectivite_id, sub, idempotency_key)
+        raise
+    if outcome.startswith("coalesced"):
+        response.headers["X-Run-Coalesced"] = "true"
+    if idempotency_key is not None:
+        complete_idempotency_key(collectivite_id, sub, idempotency_key, out["arbitrage_id"])
+    return _shape(out)
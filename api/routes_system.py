@@ -1,23 +1,39 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
+from fastapi.responses import JSONResponse
 import os
 
-from engine.arbitrage_v2 import ENGINE_VERSION
+from api.admission import admission
+from auth.dependencies import require_scope, token_cache_stats
+from engine.registry import DEFAULT_ENGINE_VERSION
+from services.collectivites_index import index_stats
+from services.logs import log_stats
+from services.precompressed import precompressed_stats
+from services.readiness import readiness, startup_report
+from services.sim_service import memo_stats
 
 # v1 router
 router = APIRouter(prefix="/api/v1", tags=["system"])
 
+AUTH_ADMIN_SCOPE = "admin:auth"
+
 
 @router.get("/health")
 def health():
     return {"ok": True}
 
 
+@router.get("/ready")
+def ready():
+    status = readiness.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+
 @router.get("/version")
 def version():
     return {
         "render_git_commit": os.getenv("RENDER_GIT_COMMIT", "unknown"),
         "api_version": "v1",
-        "engine_version": ENGINE_VERSION,
+        "engine_version": DEFAULT_ENGINE_VERSION,
         "schema_version": "1.0.0",
     }
 
@@ -33,6 +49,41 @@ def debug_jwt():
     }
 
 
+@router.get("/debug/auth-cache")
+def debug_auth_cache(_scope=Depends(require_scope(AUTH_ADMIN_SCOPE))):
+    return token_cache_stats()
+
+
+@router.get("/debug/admission")
+def debug_admission():
+    return admission.stats
+
+
+@router.get("/debug/sim-cache")
+def debug_sim_cache():
+    return memo_stats
+
+
+@router.get("/debug/collectivites-index")
+def debug_collectivites_index():
+    return index_stats()
+
+
+@router.get("/debug/logs")
+def debug_logs():
+    return log_stats()
+
+
+@router.get("/debug/precompressed")
+def debug_precompressed():
+    return precompressed_stats()
+
+
+@router.get("/debug/startup")
+def debug_startup():
+    return startup_report.as_dict()
+
+
 # legacy (root + /api) — optionnel mais utile
 legacy_root = APIRouter(tags=["legacy"])
 legacy_api = APIRouter(prefix="/api", tags=["legacy"])
@@ -48,7 +99,7 @@ def version_legacy():
     return {
         "render_git_commit": os.getenv("RENDER_GIT_COMMIT", "unknown"),
         "api_version": "v1",
-        "engine_version": ENGINE_VERSION,
+        "engine_version": DEFAULT_ENGINE_VERSION,
         "schema_version": "1.0.0",
     }
 
@@ -1,15 +1,124 @@
+import hashlib
 import os
-from typing import Any, Dict, List
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, Optional, Tuple
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from jose import JWTError, jwt
 
+from services.logs import bind
+
 security = HTTPBearer(auto_error=True)
 
 JWT_SECRET = os.getenv("JWT_SECRET", "dev-secret").strip().strip()
 JWT_ALGO = os.getenv("JWT_ALGO", "HS256")
 
+# Cache des tokens vérifiés (0 = désactivé)
+TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "4096"))
+# Durée max d'une entrée, même si 'exp' est lointain ou absent
+TOKEN_CACHE_MAX_TTL_S = float(os.getenv("AUTH_TOKEN_CACHE_MAX_TTL_S", "300"))
+
+
+class CurrentUser(dict):
+    """
+    Claims du JWT (dict, compatible avec l'existant) + ensembles pré-calculés
+    pour des contrôles d'accès en O(1).
+    """
+
+    collectivites_set: FrozenSet[str]
+    scopes_set: FrozenSet[str]
+
+    @classmethod
+    def from_claims(cls, claims: Dict[str, Any]) -> "CurrentUser":
+        user = cls(claims)
+        user.collectivites_set = frozenset(claims.get("collectivites") or [])
+        user.scopes_set = frozenset(claims.get("scopes") or [])
+        return user
+
+    def copy(self) -> "CurrentUser":
+        # Copie superficielle des claims, ensembles (immuables) partagés
+        user = CurrentUser(self)
+        user.collectivites_set = self.collectivites_set
+        user.scopes_set = self.scopes_set
+        return user
+
+
+class _TokenCache:
+    """
+    LRU borné: sha256(token) -> (claims vérifiés, expiration).
+    JWT_SECRET est lu au démarrage: une rotation passe par un redémarrage des workers
+    (rolling restart), qui repartent avec un cache vide.
+    """
+
+    def __init__(self, maxsize: int, max_ttl_s: float):
+        self.maxsize = maxsize
+        self.max_ttl_s = max_ttl_s
+        self._data: "OrderedDict[str, Tuple[CurrentUser, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+        self.decode_seconds = 0.0  # temps cumulé passé dans jwt.decode (misses)
+
+    def get(self, key: str, now: float) -> Optional[CurrentUser]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            claims, expires_at = entry
+            if now >= expires_at:
+                del self._data[key]
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return claims
+
+    def put(self, key: str, claims: CurrentUser, now: float) -> None:
+        if self.maxsize <= 0:
+            return
+        expires_at = now + self.max_ttl_s
+        exp = claims.get("exp")
+        if isinstance(exp, (int, float)):
+            expires_at = min(expires_at, float(exp))
+        if expires_at <= now:
+            return
+        with self._lock:
+            self._data[key] = (claims, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        avg_decode = self.decode_seconds / self.misses if self.misses else 0.0
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+            "evictions": self.evictions,
+            "expired": self.expired,
+            "avg_decode_ms": avg_decode * 1000.0,
+            # Estimation du CPU évité: hits x coût moyen d'un decode
+            "decode_ms_saved": self.hits * avg_decode * 1000.0,
+        }
+
+
+_token_cache = _TokenCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_MAX_TTL_S)
+
+
+def token_cache_stats() -> Dict[str, Any]:
+    return _token_cache.stats()
+
 
 def _http_error(code: int, msg: str):
     raise HTTPException(
@@ -18,14 +127,20 @@ def _http_error(code: int, msg: str):
     )
 
 
-def get_current_user(
-    creds: HTTPAuthorizationCredentials = Depends(security),
-) -> Dict[str, Any]:
-    token = creds.credentials
+def _decode_token(token: str) -> CurrentUser:
+    now = time.time()
+    key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    claims = _token_cache.get(key, now)
+    if claims is not None:
+        return claims
+
+    t0 = time.perf_counter()
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGO])
     except JWTError:
         _http_error(status.HTTP_401_UNAUTHORIZED, "Invalid token")
+    finally:
+        _token_cache.decode_seconds += time.perf_counter() - t0
 
     # Champs attendus (tolérance: collectivites/scopes peuvent être absents -> liste vide)
     sub = payload.get("sub")
@@ -34,14 +149,27 @@ def get_current_user(
 
     payload.setdefault("collectivites", [])
     payload.setdefault("scopes", [])
-    return payload
+    user = CurrentUser.from_claims(payload)
+    _token_cache.put(key, user, now)
+    return user
+
+
+def get_current_user(
+    creds: HTTPAuthorizationCredentials = Depends(security),
+) -> Dict[str, Any]:
+    # Copie par requête: les claims en cache ne sont jamais mutés par les routes
+    user = _decode_token(creds.credentials).copy()
+    bind(sub=user.get("sub"))
+    return user
 
 
 def require_collectivite_access(
     collectivite_id: str,
     user: Dict[str, Any] = Depends(get_current_user),
 ) -> Dict[str, Any]:
-    allowed: List[str] = user.get("collectivites") or []
+    allowed = getattr(user, "collectivites_set", None)
+    if allowed is None:
+        allowed = frozenset(user.get("collectivites") or [])
     if collectivite_id not in allowed:
         _http_error(status.HTTP_403_FORBIDDEN, "Forbidden for this collectivite")
     return user
@@ -49,7 +177,9 @@ def require_collectivite_access(
 
 def require_scope(scope: str):
     def _checker(user: Dict[str, Any] = Depends(get_current_user)) -> Dict[str, Any]:
-        scopes: List[str] = user.get("scopes") or []
+        scopes = getattr(user, "scopes_set", None)
+        if scopes is None:
+            scopes = frozenset(user.get("scopes") or [])
         if scope not in scopes:
             _http_error(status.HTTP_403_FORBIDDEN, f"Missing scope: {scope}")
         return user
@@ -0,0 +1,40 @@
+"""
+Archivage froid des arbitrages (politique de rétention par collectivité).
+Garde les N plus récents (collectivites_settings.retention_keep_last, sinon
+ARBITRAGE_RETENTION_KEEP_LAST) + les officiels; le reste est compressé dans
+arbitrages_archive et remplacé par un stub sans projets. À lancer en cron.
+
+  MONGO_URI=... python cc_arbitrages_archive_v1.py --dry-run
+  MONGO_URI=... python cc_arbitrages_archive_v1.py --collectivite lyon --keep-last 20
+"""
+import argparse
+
+from database.mongo import ensure_indexes
+from services.archive_service import ARCHIVE_BATCH_SIZE, archive_all, archive_collectivite
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Archive les anciens arbitrages")
+    parser.add_argument("--collectivite", default=None, help="une seule collectivité; toutes si absent")
+    parser.add_argument("--keep-last", type=int, default=None, help="surcharge la rétention configurée")
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="compte sans archiver")
+    args = parser.parse_args()
+
+    ensure_indexes()
+    if args.collectivite:
+        n = archive_collectivite(
+            args.collectivite, keep_last=args.keep_last, batch_size=args.batch_size, dry_run=args.dry_run
+        )
+        result = {args.collectivite: n} if n else {}
+    else:
+        result = archive_all(batch_size=args.batch_size, dry_run=args.dry_run)
+
+    verb = "à archiver" if args.dry_run else "archivés"
+    for cid, n in sorted(result.items()):
+        print(f"{cid}: {n} {verb}")
+    print(f"OK: {sum(result.values())} arbitrages {verb}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+"""
+Backfill du champ sort_key (pagination keyset) sur les arbitrages existants.
+Idempotent: ne traite que les docs sans sort_key. Fait aussi une fois par déploiement
+par la réconciliation des index au démarrage (services.readiness).
+
+  MONGO_URI=... python cc_arbitrages_backfill_sort_key_v1.py
+"""
+from database.mongo import ensure_indexes
+from services.sort_keys import backfill_sort_keys
+
+BATCH = 500
+
+
+def main() -> None:
+    ensure_indexes()
+    n = backfill_sort_keys(batch_size=BATCH)
+    print(f"OK: sort_key ajouté sur {n} arbitrages")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+Import du référentiel collectivités (communes COG INSEE, EPCI) dans db.collectivites.
+Lecture en flux (CSV ; , ou tab / tableau JSON / NDJSON), upserts par lots non ordonnés,
+delta par empreinte: un rafraîchissement annuel ne réécrit que les lignes modifiées.
+
+  MONGO_URI=... python cc_collectivites_import_v1.py v_commune_2025.csv --type commune
+  MONGO_URI=... python cc_collectivites_import_v1.py epci_2025.json --type epci --prune
+  MONGO_URI=... python cc_collectivites_import_v1.py v_commune_2025.csv --dry-run
+"""
+import argparse
+import time
+
+from database.mongo import ensure_collectivites_indexes
+from services.collectivites_import import IMPORT_BATCH_SIZE, import_collectivites, iter_rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Importe le référentiel des collectivités")
+    parser.add_argument("path", help="fichier CSV, JSON ou NDJSON")
+    parser.add_argument("--format", choices=["csv", "json"], default=None, help="déduit de l'extension si absent")
+    parser.add_argument("--type", default=None, help="type imposé (commune, epci...); délimite --prune")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    parser.add_argument("--prune", action="store_true", help="supprime les codes absents du fichier (du --type)")
+    parser.add_argument("--dry-run", action="store_true", help="calcule le delta sans écrire")
+    args = parser.parse_args()
+
+    if not args.dry_run:
+        ensure_collectivites_indexes()
+    t0 = time.perf_counter()
+    stats = import_collectivites(
+        iter_rows(args.path, fmt=args.format),
+        default_type=args.type,
+        batch_size=args.batch_size,
+        prune=args.prune,
+        dry_run=args.dry_run,
+    )
+    for k, v in stats.items():
+        print(f"{k}: {v}")
+    print(f"OK{' (dry-run)' if args.dry_run else ''}: {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
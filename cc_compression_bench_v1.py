@@ -0,0 +1,98 @@
+"""
+Coût CPU de la compression des réponses ArbitrageRunOut contre les octets gagnés,
+par taille de portefeuille, codec et niveau (sans réseau ni Mongo: sortie réelle
+du moteur sérialisée comme la route). '*' = niveau retenu par api/compression.py
+pour cette taille; 'pré' = coût unique des octets stockés (services/precompressed.py).
+
+  python cc_compression_bench_v1.py
+  python cc_compression_bench_v1.py --projets 100,2000,10000 --repeat 5
+"""
+import argparse
+import gzip
+import random
+import statistics
+import time
+import zlib
+
+from api.compression import brotli, levels_for
+from cc_loadtest_v1 import make_run_payload
+from engine.arbitrage_v2 import ENGINE_VERSION, calculer_arbitrage_2_0
+from schemas.arbitrage import ArbitrageRunOut
+from services.precompressed import build_blob
+
+_WEIGHTS = {"poids_climat": 0.4, "poids_education": 0.3, "poids_financier": 0.3}
+_GZIP_LEVELS = (1, 3, 5, 6, 9)
+_BROTLI_LEVELS = (1, 2, 4, 5, 9)
+
+
+def response_body(n_projets: int, seed: int) -> bytes:
+    calc = calculer_arbitrage_2_0(make_run_payload(random.Random(seed), n_projets), weights=_WEIGHTS)
+    out = {
+        "arbitrage_id": "arb-bench",
+        "collectivite_id": "bench",
+        "mandat": calc["mandat"],
+        "synthese": calc["synthese"],
+        "projets": calc["projets"],
+        "audit": {
+            "engine_version": ENGINE_VERSION,
+            "triggered_by": "bench",
+            "payload_hash": "0" * 64,
+            "timestamp_utc": "2026-01-01T00:00:00Z",
+        },
+    }
+    return ArbitrageRunOut.model_validate(out).model_dump_json().encode("utf-8")
+
+
+def _cpu_ms(fn, repeat: int) -> tuple:
+    samples, out = [], b""
+    for _ in range(repeat):
+        t = time.process_time()
+        out = fn()
+        samples.append((time.process_time() - t) * 1000.0)
+    return statistics.median(samples), len(out)
+
+
+def _gzip(level: int):
+    def _run(body: bytes) -> bytes:
+        c = zlib.compressobj(level, zlib.DEFLATED, 31)
+        return c.compress(body) + c.flush()
+    return _run
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Banc CPU / octets de la compression des réponses")
+    parser.add_argument("--projets", default="10,100,1000,5000", help="tailles de portefeuille")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{'projets':>8}{'brut':>11}  {'codec':<9}{'cpu_ms':>9}{'compressé':>11}{'ratio':>7}{'gagné':>11}{'Mo/s':>8}")
+    for n in [int(x) for x in args.projets.split(",")]:
+        body = response_body(n, args.seed)
+        gz_pick, br_pick = levels_for(len(body))
+        codecs = [(f"gzip-{lv}", _gzip(lv), lv == gz_pick) for lv in _GZIP_LEVELS]
+        if brotli is not None:
+            codecs += [
+                (f"br-{lv}", (lambda lv: lambda b: brotli.compress(b, quality=lv))(lv), lv == br_pick)
+                for lv in _BROTLI_LEVELS
+            ]
+        for name, fn, picked in codecs:
+            cpu, size = _cpu_ms(lambda: fn(body), args.repeat)
+            speed = (len(body) / 1e6) / (cpu / 1000.0) if cpu else float("inf")
+            print(
+                f"{n:>8}{len(body):>11}  {name + ('*' if picked else ''):<9}{cpu:>9.2f}{size:>11}"
+                f"{len(body) / size:>7.1f}{len(body) - size:>11}{speed:>8.0f}"
+            )
+        # Octets pré-compressés: coût payé une fois, puis 0 CPU par requête (identité: gunzip)
+        t = time.process_time()
+        blob = build_blob(__import__("json").loads(body))
+        once = (time.process_time() - t) * 1000.0
+        unzip, _ = _cpu_ms(lambda: gzip.decompress(blob.gzip), args.repeat)
+        print(f"{n:>8}{len(body):>11}  {'pré':<9}{once:>9.2f}{len(blob.gzip):>11}"
+              f"{len(body) / len(blob.gzip):>7.1f}{len(body) - len(blob.gzip):>11}"
+              f"   (une fois; br {len(blob.br or b'')} o; identité = gunzip {unzip:.2f} ms)")
+        print()
+
+
+if __name__ == "__main__":
+    main()
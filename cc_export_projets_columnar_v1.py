@@ -0,0 +1,42 @@
+"""
+Dump hors-ligne des résultats projet (Parquet ou Arrow IPC), sans passer par l'API.
+
+  MONGO_URI=... python cc_export_projets_columnar_v1.py --out projets.parquet
+  MONGO_URI=... python cc_export_projets_columnar_v1.py --out lyon.arrow --format arrow \\
+      --collectivite lyon --since 2026-01-01
+"""
+import argparse
+from datetime import datetime, timezone
+
+from services.analytics_export import ROW_GROUP_SIZE, write_projets_arrow, write_projets_parquet
+
+
+def _date(value: str) -> datetime:
+    dt = datetime.fromisoformat(value)
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export colonnaire des projets arbitrés")
+    parser.add_argument("--out", required=True, help="fichier de sortie")
+    parser.add_argument("--format", choices=("parquet", "arrow"), default=None, help="déduit de l'extension sinon")
+    parser.add_argument("--collectivite", action="append", default=None, help="répétable; toutes si absent")
+    parser.add_argument("--since", type=_date, default=None)
+    parser.add_argument("--until", type=_date, default=None)
+    parser.add_argument("--row-group-size", type=int, default=ROW_GROUP_SIZE)
+    args = parser.parse_args()
+
+    fmt = args.format or ("arrow" if args.out.endswith((".arrow", ".feather")) else "parquet")
+    write = write_projets_parquet if fmt == "parquet" else write_projets_arrow
+    n = write(
+        args.out,
+        collectivite_ids=args.collectivite,
+        since=args.since,
+        until=args.until,
+        row_group_size=args.row_group_size,
+    )
+    print(f"OK: {n} lignes -> {args.out} ({fmt})")
+
+
+if __name__ == "__main__":
+    main()
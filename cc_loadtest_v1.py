@@ -0,0 +1,408 @@
+"""
+Banc de charge local reproductible: mongod local (binaire ou docker), seed de
+collectivités / settings / historique d'arbitrages, puis rejeu d'un mix de trafic
+JSONL à débit cible contre gunicorn, pour une matrice workers x threads.
+Rapport: débit et p50/p95/p99 par route, PSS du master et des workers
+(+ JSON complet avec --out).
+
+  python cc_loadtest_v1.py --mongo docker --workers 1,2,4 --threads 10,40 --rate 100 --duration 30
+  python cc_loadtest_v1.py --mongo-uri mongodb://127.0.0.1:27017 --mix traffic.jsonl --out result.json
+  python cc_loadtest_v1.py --servers baseline,tuned --workers 4 --threads 40   # avant / après gunicorn_conf.py
+
+Mix JSONL (une ligne par opération, poids relatifs; défaut: DEFAULT_MIX):
+  {"name": "last", "method": "GET", "path": "/api/v1/collectivites/{cid}/arbitrage:last", "weight": 40}
+  {"name": "run", "method": "POST", "path": "/api/v1/collectivites/{cid}/arbitrage:run", "body": "run", "weight": 5}
+Variables: {cid}, {arbitrage_id} (d'un arbitrage seedé de la collectivité), {cursor}
+("&cursor=<dernier next_cursor vu pour la collectivité>", vide sinon).
+"body": "run" = portefeuille généré. L'admission (429) est coupée sauf --admission.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+from jose import jwt
+
+
+MONGO_PORT = 27118
+API_PORT = 8118
+DB_NAME = "colconnect"
+
+DEFAULT_MIX: List[Dict[str, Any]] = [
+    {"name": "last", "method": "GET", "path": "/api/v1/collectivites/{cid}/arbitrage:last", "weight": 35},
+    {"name": "by_id", "method": "GET", "path": "/api/v1/collectivites/{cid}/arbitrage/{arbitrage_id}", "weight": 15},
+    {"name": "list", "method": "GET", "path": "/api/v1/collectivites/{cid}/arbitrages?page=1&limit=20", "weight": 10},
+    {"name": "cursor", "method": "GET", "path": "/api/v1/collectivites/{cid}/arbitrages-cursor?limit=20{cursor}", "weight": 10},
+    {"name": "settings", "method": "GET", "path": "/api/v1/collectivites/{cid}/settings", "weight": 10},
+    {"name": "sim", "method": "GET", "path": "/api/v1/collectivites/{cid}/sim", "weight": 12},
+    {"name": "run", "method": "POST", "path": "/api/v1/collectivites/{cid}/arbitrage:run", "body": "run", "weight": 8},
+]
+
+_PRIORITES = ("elevee", "moyenne", "faible")
+_IMPACTS = ("fort", "moyen", "faible")
+
+
+# ---------- Données ----------
+def make_run_payload(rng: random.Random, n_projets: Optional[int] = None) -> Dict[str, Any]:
+    n = n_projets or rng.randint(5, 60)
+    return {
+        "mandat": "2026-2032",
+        "contraintes": {
+            "budget_investissement_max": float(rng.randint(5, 60) * 1_000_000),
+            "seuil_capacite_desendettement_ans": 12.0,
+        },
+        "hypotheses": {
+            "taux_subventions_moyen": round(rng.uniform(0.1, 0.4), 2),
+            "inflation_travaux": 0.03,
+            "annee_reference": 2026,
+            "epargne_brute_annuelle": float(rng.randint(2, 10) * 1_000_000),
+            "encours_dette_initial": float(rng.randint(10, 80) * 1_000_000),
+        },
+        "projets": [
+            {
+                "id": f"PRJ-{i:04d}",
+                "nom": f"Projet {i}",
+                "cout_ttc": float(rng.randint(2, 150) * 100_000),
+                "priorite": rng.choice(_PRIORITES),
+                "impact_climat": rng.choice(_IMPACTS),
+                "impact_education": rng.choice(_IMPACTS),
+                "annee_realisation": rng.randint(2026, 2032),
+            }
+            for i in range(n)
+        ],
+    }
+
+
+def mint_token(secret: str, collectivites: List[str]) -> str:
+    # Mêmes claims que generate_token.py (collectivités seedées en plus)
+    payload = {
+        "sub": "loadtest-user",
+        "collectivites": collectivites,
+        "scopes": ["arbitrage:read", "arbitrage:write", "settings:read", "settings:write"],
+        "exp": int(time.time()) + 6 * 3600,
+    }
+    return jwt.encode(payload, secret, algorithm="HS256")
+
+
+def seed(mongo_uri: str, n_collectivites: int, history: int, seed_value: int) -> Dict[str, List[str]]:
+    """Seed via le vrai moteur/service (documents identiques à la prod). Retourne cid -> arbitrage_ids."""
+    os.environ["MONGO_URI"] = mongo_uri
+    from database.mongo import ensure_indexes, get_db
+    from services.arbitrage_service import run_arbitrage, upsert_settings
+
+    rng = random.Random(seed_value)
+    db = get_db()
+    for coll in ("arbitrages", "collectivites_settings", "collectivites", "arbitrages_rollups"):
+        db[coll].delete_many({"loadtest": True} if coll == "collectivites" else {"collectivite_id": {"$regex": "^lt-"}})
+    ensure_indexes()
+
+    ids: Dict[str, List[str]] = {}
+    for i in range(n_collectivites):
+        cid = f"lt-{i:04d}"
+        db.collectivites.insert_one({
+            "code": f"LT{i:04d}", "nom": f"Commune de test {i}", "departement": f"{rng.randint(1, 95):02d}",
+            "population": rng.randint(500, 500_000), "loadtest": True,
+        })
+        w = [rng.random() for _ in range(3)]
+        s = sum(w)
+        upsert_settings(cid, {"poids_climat": w[0] / s, "poids_education": w[1] / s, "poids_financier": w[2] / s})
+        ids[cid] = [
+            run_arbitrage(cid, make_run_payload(rng), triggered_by="loadtest-seed")["arbitrage_id"]
+            for _ in range(history)
+        ]
+    return ids
+
+
+# ---------- Processus ----------
+def start_mongo(mode: str, workdir: str) -> Tuple[str, Any]:
+    if mode == "mongod":
+        if not shutil.which("mongod"):
+            sys.exit("mongod introuvable dans le PATH (ou --mongo docker / --mongo-uri)")
+        dbpath = os.path.join(workdir, "db")
+        os.makedirs(dbpath, exist_ok=True)
+        proc = subprocess.Popen(
+            ["mongod", "--dbpath", dbpath, "--port", str(MONGO_PORT), "--bind_ip", "127.0.0.1", "--quiet"],
+            stdout=subprocess.DEVNULL,
+        )
+        stop = proc.terminate
+    else:
+        if not shutil.which("docker"):
+            sys.exit("docker introuvable (ou --mongo mongod / --mongo-uri)")
+        name = f"cc-loadtest-mongo-{os.getpid()}"
+        subprocess.run(
+            ["docker", "run", "-d", "--rm", "--name", name, "-p", f"127.0.0.1:{MONGO_PORT}:27017", "mongo:7"],
+            check=True, stdout=subprocess.DEVNULL,
+        )
+        stop = lambda: subprocess.run(["docker", "stop", name], stdout=subprocess.DEVNULL)  # noqa: E731
+    uri = f"mongodb://127.0.0.1:{MONGO_PORT}"
+    from pymongo import MongoClient
+
+    deadline = time.time() + 60
+    while True:
+        try:
+            MongoClient(uri, serverSelectionTimeoutMS=1000).admin.command("ping")
+            return uri, stop
+        except Exception:
+            if time.time() > deadline:
+                stop()
+                sys.exit("mongod n'a pas démarré")
+            time.sleep(0.5)
+
+
+def start_api(
+    mongo_uri: str, secret: str, workers: int, threads: int, admission: bool, server: str = "baseline"
+) -> subprocess.Popen:
+    env = dict(os.environ, MONGO_URI=mongo_uri, JWT_SECRET=secret, THREADPOOL_SIZE=str(threads))
+    # Un seul utilisateur synthétique: sans ça, le bucket par user (429) borne le débit mesuré
+    env["ADMISSION_ENABLED"] = "1" if admission else "0"
+    if server == "tuned":
+        # Config de prod (gunicorn_conf.py); la ligne de commande garde priorité sur -w / -b
+        cmd = [sys.executable, "-m", "gunicorn", "main:app", "-c", "gunicorn_conf.py"]
+    else:
+        cmd = [sys.executable, "-m", "gunicorn", "main:app", "-k", "uvicorn.workers.UvicornWorker"]
+    proc = subprocess.Popen(
+        cmd + ["-w", str(workers), "-b", f"127.0.0.1:{API_PORT}", "--log-level", "warning"],
+        env=env,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if requests.get(f"http://127.0.0.1:{API_PORT}/ready", timeout=1).status_code == 200:
+                return proc
+        except requests.RequestException:
+            pass
+        time.sleep(0.25)
+    proc.terminate()
+    sys.exit("l'API n'est pas devenue ready")
+
+
+def _children(pid: int) -> List[int]:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children", "r") as f:
+            return [int(x) for x in f.read().split()]
+    except OSError:
+        return []
+
+
+def _pss_kb(pid: int) -> int:
+    """PSS (Linux): mémoire privée + part des pages partagées (copy-on-write du preload)."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def api_memory(proc: subprocess.Popen) -> Dict[str, Any]:
+    """Empreinte du master gunicorn et de ses workers (somme des PSS = mémoire réelle)."""
+    workers = _children(proc.pid)
+    per_worker = [_pss_kb(p) for p in workers]
+    master = _pss_kb(proc.pid)
+    return {
+        "master_pss_mb": round(master / 1024, 1),
+        "workers_pss_mb": [round(x / 1024, 1) for x in per_worker],
+        "total_pss_mb": round((master + sum(per_worker)) / 1024, 1),
+    }
+
+
+def stop_api(proc: subprocess.Popen) -> None:
+    proc.send_signal(signal.SIGTERM)
+    try:
+        proc.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+# ---------- Rejeu ----------
+def load_mix(path: Optional[str]) -> List[Dict[str, Any]]:
+    if not path:
+        return DEFAULT_MIX
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def replay(
+    base_url: str,
+    token: str,
+    mix: List[Dict[str, Any]],
+    ids: Dict[str, List[str]],
+    rate: float,
+    duration: float,
+    concurrency: int,
+    seed_value: int,
+) -> Dict[str, List[Tuple[float, int]]]:
+    """
+    Boucle ouverte: la requête i part à t0 + i/rate; la latence est mesurée depuis
+    l'heure prévue (évite l'omission coordonnée quand le serveur sature).
+    """
+    rng = random.Random(seed_value)
+    weights = [float(op.get("weight", 1)) for op in mix]
+    cids = sorted(ids)
+    cursors: Dict[str, str] = {}
+    results: Dict[str, List[Tuple[float, int]]] = defaultdict(list)
+    lock = threading.Lock()
+    local = threading.local()
+    headers = {"Authorization": f"Bearer {token}"}
+
+    def _session() -> requests.Session:
+        if not hasattr(local, "s"):
+            local.s = requests.Session()
+        return local.s
+
+    def _one(op: Dict[str, Any], cid: str, arbitrage_id: str, scheduled: float, body_seed: int) -> None:
+        cursor = cursors.get(cid)
+        path = op["path"].format(
+            cid=cid,
+            arbitrage_id=arbitrage_id,
+            cursor=f"&cursor={cursor}" if cursor else "",
+        )
+        body = op.get("body")
+        if body == "run":
+            body = make_run_payload(random.Random(body_seed))
+        try:
+            r = _session().request(op.get("method", "GET"), base_url + path, json=body, headers=headers, timeout=60)
+            status = r.status_code
+            if op.get("name") == "cursor" and status == 200:
+                nxt = r.json().get("next_cursor")
+                with lock:
+                    if nxt:
+                        cursors[cid] = nxt
+                    else:
+                        cursors.pop(cid, None)
+        except requests.RequestException:
+            status = 0
+        latency = time.perf_counter() - scheduled
+        with lock:
+            results[op.get("name", op["path"])].append((latency, status))
+
+    n_total = int(rate * duration)
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for i in range(n_total):
+            scheduled = t0 + i / rate
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            # Tirages faits ici (thread unique): séquence reproductible avec --seed
+            op = rng.choices(mix, weights=weights)[0]
+            cid = rng.choice(cids)
+            arbitrage_id = rng.choice(ids[cid]) if ids[cid] else "none"
+            pool.submit(_one, op, cid, arbitrage_id, scheduled, rng.randrange(1 << 30))
+    return results
+
+
+def summarize(results: Dict[str, List[Tuple[float, int]]], duration: float) -> Dict[str, Dict[str, Any]]:
+    out: Dict[str, Dict[str, Any]] = {}
+    for name, rows in sorted(results.items()):
+        lat = sorted(x for x, _ in rows)
+        q = statistics.quantiles(lat, n=100, method="inclusive") if len(lat) >= 2 else lat * 99
+        errors = sum(1 for _, s in rows if s == 0 or s >= 400)
+        out[name] = {
+            "count": len(rows),
+            "errors": errors,
+            "rps": round(len(rows) / duration, 1),
+            "p50_ms": round(q[49] * 1000, 1),
+            "p95_ms": round(q[94] * 1000, 1),
+            "p99_ms": round(q[98] * 1000, 1),
+        }
+    return out
+
+
+def print_report(
+    workers: int, threads: int, summary: Dict[str, Dict[str, Any]], server: str = "baseline",
+    memory: Optional[Dict[str, Any]] = None,
+) -> None:
+    print(f"\n== server={server} workers={workers} threads={threads}")
+    if memory:
+        print(f"mémoire: total PSS {memory['total_pss_mb']} Mo (master {memory['master_pss_mb']}, "
+              f"workers {memory['workers_pss_mb']})")
+    print(f"{'route':<12}{'count':>8}{'err':>6}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for name, s in summary.items():
+        print(f"{name:<12}{s['count']:>8}{s['errors']:>6}{s['rps']:>8}{s['p50_ms']:>9}{s['p95_ms']:>9}{s['p99_ms']:>9}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Banc de charge local (rejeu JSONL)")
+    src = parser.add_mutually_exclusive_group()
+    src.add_argument("--mongo", choices=["mongod", "docker"], default="docker", help="mongod local à lancer")
+    src.add_argument("--mongo-uri", default=None, help="mongod déjà lancé (base colconnect, préfixe lt-)")
+    parser.add_argument("--mix", default=None, help="fichier JSONL du mix de trafic")
+    parser.add_argument("--collectivites", type=int, default=50)
+    parser.add_argument("--history", type=int, default=20, help="arbitrages seedés par collectivité")
+    parser.add_argument("--workers", default="1,2,4", help="liste de nombres de workers gunicorn")
+    parser.add_argument("--threads", default="40", help="liste de tailles de threadpool (THREADPOOL_SIZE)")
+    parser.add_argument(
+        "--servers", default="baseline",
+        help="configs gunicorn comparées: baseline (ligne de commande nue), tuned (gunicorn_conf.py)",
+    )
+    parser.add_argument("--rate", type=float, default=100.0, help="requêtes/s visées")
+    parser.add_argument("--duration", type=float, default=30.0, help="secondes par combinaison")
+    parser.add_argument("--concurrency", type=int, default=256, help="requêtes simultanées max côté client")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--admission", action="store_true", help="garde le contrôle d'admission actif")
+    parser.add_argument("--out", default=None, help="écrit le rapport JSON complet")
+    args = parser.parse_args()
+
+    secret = os.getenv("JWT_SECRET", "loadtest-secret")
+    workdir = tempfile.mkdtemp(prefix="cc-loadtest-")
+    stop_mongo = None
+    try:
+        if args.mongo_uri:
+            mongo_uri = args.mongo_uri
+        else:
+            mongo_uri, stop_mongo = start_mongo(args.mongo, workdir)
+        t = time.perf_counter()
+        ids = seed(mongo_uri, args.collectivites, args.history, args.seed)
+        print(f"seed: {len(ids)} collectivités x {args.history} arbitrages en {time.perf_counter() - t:.1f}s")
+
+        token = mint_token(secret, sorted(ids))
+        mix = load_mix(args.mix)
+        report = []
+        for server in args.servers.split(","):
+            for w in [int(x) for x in args.workers.split(",")]:
+                for th in [int(x) for x in args.threads.split(",")]:
+                    api = start_api(mongo_uri, secret, w, th, args.admission, server)
+                    try:
+                        results = replay(
+                            f"http://127.0.0.1:{API_PORT}", token, mix, ids,
+                            args.rate, args.duration, args.concurrency, args.seed,
+                        )
+                        # Mesurée après le rejeu: pages copy-on-write déjà touchées par la charge
+                        memory = api_memory(api)
+                    finally:
+                        stop_api(api)
+                    summary = summarize(results, args.duration)
+                    print_report(w, th, summary, server, memory)
+                    report.append({
+                        "server": server, "workers": w, "threads": th, "rate": args.rate,
+                        "memory": memory, "routes": summary,
+                    })
+
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump({"args": vars(args), "results": report}, f, indent=2)
+            print(f"\nOK: rapport écrit dans {args.out}")
+    finally:
+        if stop_mongo:
+            stop_mongo()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Mesure du surcoût de l'instrumentation Prometheus (middleware + observations)
+sur une route légère, sans réseau ni Mongo: compare l'app avec et sans
+PrometheusMiddleware, et le coût unitaire d'une observation d'histogramme.
+
+  python cc_metrics_overhead_v1.py --requests 5000
+"""
+import argparse
+import statistics
+import time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api.metrics import PrometheusMiddleware
+from services.metrics import HTTP_DURATION
+
+
+def _app(instrumented: bool) -> FastAPI:
+    app = FastAPI()
+    if instrumented:
+        app.add_middleware(PrometheusMiddleware)
+
+    @app.get("/api/v1/collectivites/{collectivite_id}/ping")
+    def ping(collectivite_id: str):
+        return {"ok": True}
+
+    # Routes factices: le coût du matching dépend du nombre de routes
+    for i in range(40):
+        app.add_api_route(f"/api/v1/dummy{i}/{{x}}", ping)
+    return app
+
+
+def _bench(instrumented: bool, n: int) -> float:
+    client = TestClient(_app(instrumented))
+    for i in range(200):
+        client.get(f"/api/v1/collectivites/c{i}/ping")
+    samples = []
+    for i in range(n):
+        t = time.perf_counter()
+        client.get(f"/api/v1/collectivites/c{i}/ping")
+        samples.append(time.perf_counter() - t)
+    return statistics.median(samples)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Surcoût de l'instrumentation /metrics")
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    base = _bench(False, args.requests)
+    inst = _bench(True, args.requests)
+
+    h = HTTP_DURATION.labels("GET", "/bench", "200")
+    t = time.perf_counter()
+    for _ in range(100_000):
+        h.observe(0.01)
+    obs_us = (time.perf_counter() - t) / 100_000 * 1e6
+
+    print(f"médiane sans middleware : {base * 1e6:.1f} µs")
+    print(f"médiane avec middleware : {inst * 1e6:.1f} µs")
+    print(f"surcoût par requête     : {(inst - base) * 1e6:.1f} µs ({(inst / base - 1) * 100:.1f} %)")
+    print(f"observe() histogramme   : {obs_us:.2f} µs")
+
+
+if __name__ == "__main__":
+    main()
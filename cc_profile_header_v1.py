@@ -0,0 +1,26 @@
+"""
+Génère la valeur du header X-CC-Profile (signée HMAC avec PROFILING_SECRET)
+pour profiler une requête en production.
+
+  PROFILING_SECRET=... python cc_profile_header_v1.py --ttl 300
+  curl -H "X-CC-Profile: $(PROFILING_SECRET=... python cc_profile_header_v1.py)" ...
+"""
+import argparse
+import os
+import sys
+
+from api.profiling import sign_profile_header
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Header X-CC-Profile signé")
+    parser.add_argument("--ttl", type=int, default=300, help="validité en secondes")
+    args = parser.parse_args()
+
+    if not os.getenv("PROFILING_SECRET", "").strip():
+        sys.exit("PROFILING_SECRET manquant")
+    print(sign_profile_header(args.ttl))
+
+
+if __name__ == "__main__":
+    main()
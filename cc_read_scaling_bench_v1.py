@@ -0,0 +1,214 @@
+"""
+Délestage du primaire par les lectures secondaires (database.mongo.get_read_db) et
+vérification de la cohérence causale (services.causal), contre un replica set réel
+(docker-compose.mongo-rs.yml). Mêmes fonctions de service que les routes de lecture
+(last, by-id, listes page/curseur, settings), appelées en parallèle, d'abord avec
+lectures sur le primaire puis avec MONGO_READ_PREFERENCE; opérations servies par
+chaque membre (serverStatus.opcounters) et latences.
+
+--causal: réplication suspendue sur les secondaires (failpoint stopReplProducer,
+mongod --setParameter enableTestCommands=1), un run est écrit puis relu sur un
+secondaire sans jeton (lecture périmée attendue) et avec le jeton (lecture qui
+attend le rattrapage, reprise de la réplication après --lag-s).
+
+  docker compose -f docker-compose.local.yml -f docker-compose.mongo-rs.yml run --rm api \\
+      python cc_read_scaling_bench_v1.py --reads 5000 --threads 16 --causal
+"""
+import argparse
+import random
+import statistics
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from pymongo import MongoClient
+from pymongo.errors import OperationFailure
+
+import database.mongo as mongo
+from cc_loadtest_v1 import make_run_payload
+from services import causal
+from services.arbitrage_service import (
+    get_arbitrage_by_id,
+    get_last_arbitrage_out,
+    get_settings,
+    list_arbitrages,
+    list_arbitrages_cursor,
+    run_arbitrage,
+    upsert_settings,
+)
+
+_COUNTERS = ("query", "getmore", "command")
+
+
+def _members(client: MongoClient) -> Tuple[str, List[str]]:
+    hello = client.admin.command("hello")
+    if not hello.get("setName"):
+        raise SystemExit("MONGO_URI ne désigne pas un replica set (hello.setName absent)")
+    return hello["primary"], list(hello["hosts"])
+
+
+def _direct(hosts: List[str]) -> Dict[str, MongoClient]:
+    return {h: MongoClient(h, directConnection=True) for h in hosts}
+
+
+def _opcounters(direct: Dict[str, MongoClient]) -> Dict[str, Dict[str, int]]:
+    out = {}
+    for host, c in direct.items():
+        ops = c.admin.command("serverStatus")["opcounters"]
+        out[host] = {k: int(ops[k]) for k in _COUNTERS}
+    return out
+
+
+def _seed(collectivite_id: str, n: int, rng: random.Random) -> List[str]:
+    upsert_settings(collectivite_id, {"poids_climat": 0.4, "poids_education": 0.3, "poids_financier": 0.3})
+    return [run_arbitrage(collectivite_id, make_run_payload(rng, 20), triggered_by="bench")["arbitrage_id"] for _ in range(n)]
+
+
+def _read_ops(collectivite_id: str, ids: List[str]) -> List[Tuple[str, Callable[[random.Random], Any]]]:
+    return [
+        ("last", lambda rng: get_last_arbitrage_out(collectivite_id)),
+        ("by_id", lambda rng: get_arbitrage_by_id(collectivite_id, rng.choice(ids))),
+        ("list", lambda rng: list_arbitrages(collectivite_id, page=1, limit=10)),
+        ("cursor", lambda rng: list_arbitrages_cursor(collectivite_id, limit=10)),
+        ("settings", lambda rng: get_settings(collectivite_id)),
+    ]
+
+
+def _phase(mode: str, ops, reads: int, threads: int, seed: int) -> Dict[str, List[float]]:
+    mongo.MONGO_READ_PREFERENCE = mode
+    mongo.READ_PREFERENCE = mongo._read_preference()
+    lat: Dict[str, List[float]] = {name: [] for name, _ in ops}
+    lock = threading.Lock()
+    per_thread = max(1, reads // threads)
+
+    def _worker(i: int) -> None:
+        rng = random.Random(seed + i)
+        local: Dict[str, List[float]] = {name: [] for name, _ in ops}
+        for k in range(per_thread):
+            name, fn = ops[(i + k) % len(ops)]
+            t = time.perf_counter()
+            fn(rng)
+            local[name].append((time.perf_counter() - t) * 1000.0)
+        with lock:
+            for name, values in local.items():
+                lat[name].extend(values)
+
+    workers = [threading.Thread(target=_worker, args=(i,)) for i in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return lat
+
+
+def _pct(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def _report(mode: str, primary: str, before, after, lat: Dict[str, List[float]], elapsed: float) -> None:
+    total = {h: sum(after[h][k] - before[h][k] for k in _COUNTERS) for h in after}
+    all_ops = sum(total.values()) or 1
+    n = sum(len(v) for v in lat.values())
+    print(f"--- lectures {mode}: {n} appels en {elapsed:.1f} s ({n / elapsed:.0f}/s)")
+    for host in sorted(total):
+        role = "primaire" if host == primary else "secondaire"
+        detail = " ".join(f"{k}={after[host][k] - before[host][k]}" for k in _COUNTERS)
+        print(f"  {role:<11}{host:<24}{total[host]:>9} ops ({100.0 * total[host] / all_ops:5.1f} %)  {detail}")
+    print(f"  {'route':<10}{'n':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for name, values in lat.items():
+        print(f"  {name:<10}{len(values):>7}{statistics.median(values):>9.2f}{_pct(values, 0.95):>9.2f}{_pct(values, 0.99):>9.2f}")
+
+
+def _failpoint(direct: Dict[str, MongoClient], hosts: List[str], on: bool) -> None:
+    for h in hosts:
+        direct[h].admin.command("configureFailPoint", "stopReplProducer", mode="alwaysOn" if on else "off")
+
+
+def _causal_check(collectivite_id: str, primary: str, direct: Dict[str, MongoClient], lag_s: float, rng) -> None:
+    secondaries = [h for h in direct if h != primary]
+    # w=1: réplication suspendue, une écriture majority attendrait indéfiniment
+    mongo._client = MongoClient(mongo._MONGO_URI, w=1)
+    mongo.MONGO_READ_PREFERENCE = "secondary"
+    mongo.READ_PREFERENCE = mongo._read_preference()
+    try:
+        _failpoint(direct, secondaries, True)
+    except OperationFailure as e:
+        raise SystemExit(f"failpoint indisponible (enableTestCommands=1 sur les secondaires?): {e}")
+    timer = None
+    try:
+        state, ctx = causal.open_causal(None)
+        try:
+            aid = run_arbitrage(collectivite_id, make_run_payload(rng, 20), triggered_by="bench")["arbitrage_id"]
+            token = causal.outgoing_token(state)
+        finally:
+            causal.close_causal(state, ctx)
+        if not token:
+            raise SystemExit("aucun jeton causal émis (sessions non gérées?)")
+
+        state, ctx = causal.open_causal(None)
+        try:
+            get_arbitrage_by_id(collectivite_id, aid)
+            print("  sans jeton : arbitrage trouvé (secondaire déjà à jour?)")
+        except KeyError:
+            print("  sans jeton : arbitrage absent du secondaire (lecture périmée)")
+        finally:
+            causal.close_causal(state, ctx)
+
+        timer = threading.Timer(lag_s, _failpoint, args=(direct, secondaries, False))
+        timer.start()
+        state, ctx = causal.open_causal(token)
+        t = time.perf_counter()
+        try:
+            get_arbitrage_by_id(collectivite_id, aid)
+            print(f"  avec jeton : arbitrage trouvé après {(time.perf_counter() - t) * 1000.0:.0f} ms "
+                  f"(réplication reprise à {lag_s * 1000.0:.0f} ms)")
+        except KeyError:
+            print("  avec jeton : arbitrage ABSENT (cohérence causale rompue)")
+        finally:
+            causal.close_causal(state, ctx)
+    finally:
+        if timer is not None:
+            timer.join()
+        _failpoint(direct, secondaries, False)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Délestage du primaire par les lectures secondaires")
+    parser.add_argument("--collectivite", default="bench-rs")
+    parser.add_argument("--arbitrages", type=int, default=50, help="arbitrages écrits avant le banc")
+    parser.add_argument("--reads", type=int, default=5000, help="appels de lecture par phase")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--causal", action="store_true", help="vérifier la lecture causale sous retard de réplication")
+    parser.add_argument("--lag-s", type=float, default=1.0, help="durée de suspension de la réplication (--causal)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    client = mongo.get_client()
+    if client is None:
+        raise SystemExit("MONGO_URI manquant")
+    primary, hosts = _members(client)
+    direct = _direct(hosts)
+    rng = random.Random(args.seed)
+    ids = _seed(args.collectivite, args.arbitrages, rng)
+    ops = _read_ops(args.collectivite, ids)
+    print(f"replica set: primaire {primary}, membres {', '.join(hosts)}; "
+          f"max staleness {mongo.MONGO_MAX_STALENESS_S} s; {args.threads} threads")
+
+    configured = mongo.MONGO_READ_PREFERENCE
+    for mode in dict.fromkeys(("primary", configured)):
+        before = _opcounters(direct)
+        t = time.perf_counter()
+        lat = _phase(mode, ops, args.reads, args.threads, args.seed)
+        elapsed = time.perf_counter() - t
+        _report(mode, primary, before, _opcounters(direct), lat, elapsed)
+
+    if args.causal:
+        if not causal.MONGO_CAUSAL_ENABLED:
+            raise SystemExit("cohérence causale désactivée (CAUSAL_SECRET absent ou MONGO_CAUSAL_ENABLED=0)")
+        print("--- cohérence causale")
+        _causal_check(args.collectivite, primary, direct, args.lag_s, rng)
+
+
+if __name__ == "__main__":
+    main()
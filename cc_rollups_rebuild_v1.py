@@ -0,0 +1,25 @@
+"""
+Backfill des rollups jour/mois (db.arbitrages_rollups) depuis db.arbitrages.
+
+  MONGO_URI=... python cc_rollups_rebuild_v1.py                 # toutes les collectivités
+  MONGO_URI=... python cc_rollups_rebuild_v1.py --collectivite lyon
+"""
+import argparse
+
+from database.mongo import ensure_indexes
+from services.rollups import rebuild_rollups
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Reconstruit les rollups d'arbitrages")
+    parser.add_argument("--collectivite", action="append", default=None, help="répétable; toutes si absent")
+    args = parser.parse_args()
+
+    # L'index unique (collectivite_id, bucket, period_start) est requis par $merge
+    ensure_indexes()
+    n = rebuild_rollups(args.collectivite)
+    print(f"OK: {n} rollups reconstruits")
+
+
+if __name__ == "__main__":
+    main()
@@ -39,6 +39,7 @@ docker run -d --restart unless-stopped --name "$NAME" \
   -p ${PORT}:${PORT} \
   -e PORT=${PORT} \
   -e APP_MODULE=${APP_MODULE} \
+  -v /var/lib/colconnect:/var/lib/colconnect \
   "$IMAGE"
 
 echo ""
@@ -1,9 +1,72 @@
+import logging
 import os
 from pymongo import MongoClient, ASCENDING, DESCENDING
 from pymongo.errors import OperationFailure
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
+
+from services.metrics import METRICS_ENABLED, mongo_listener
 
 _MONGO_URI = os.getenv("MONGO_URI", "")
-_client = MongoClient(_MONGO_URI) if _MONGO_URI else None
+# Lectures des routes de consultation (last, by-id, listes, settings, index collectivités)
+# envoyées aux secondaires du replica set via get_read_db(); écritures et lectures du
+# chemin d'écriture (run, baux, single-flight) restent sur le primaire via get_db().
+# Sans replica set (standalone, mongomock), secondaryPreferred lit simplement le primaire.
+MONGO_READ_PREFERENCE = os.getenv("MONGO_READ_PREFERENCE", "secondaryPreferred").strip()
+# Secondaire écarté au-delà de ce retard estimé (minimum imposé par le driver: 90 s; -1 = sans borne)
+MONGO_MAX_STALENESS_S = int(os.getenv("MONGO_MAX_STALENESS_S", "90"))
+
+logger = logging.getLogger("cc.mongo")
+
+_READ_MODES = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+
+def _read_preference():
+    mode = _READ_MODES.get(MONGO_READ_PREFERENCE)
+    if mode is None:
+        logger.warning("MONGO_READ_PREFERENCE inconnue (%s): lectures sur le primaire", MONGO_READ_PREFERENCE)
+        return Primary()
+    if mode is Primary:
+        return Primary()
+    staleness = MONGO_MAX_STALENESS_S
+    if 0 <= staleness < 90:
+        logger.warning("MONGO_MAX_STALENESS_S=%s < 90: relevé à 90 (minimum du driver)", staleness)
+        staleness = 90
+    return mode(max_staleness=staleness)
+
+
+READ_PREFERENCE = _read_preference()
+
+
+def _new_client():
+    # connect=False: aucun thread de monitoring avant la première opération
+    # (import dans le master gunicorn en preload, puis fork)
+    if not _MONGO_URI:
+        return None
+    return MongoClient(
+        _MONGO_URI,
+        connect=False,
+        event_listeners=[mongo_listener] if METRICS_ENABLED else [],
+    )
+
+
+_client = _new_client()
+
+
+def reset_client():
+    """Recrée le client dans un process forké (hook post_fork gunicorn): MongoClient n'est pas fork-safe."""
+    global _client
+    _client = _new_client()
+
+
+def get_client():
+    """Client du process (None sans MONGO_URI), pour les sessions (services.causal)."""
+    return _client
 
 
 def get_db():
@@ -12,6 +75,14 @@ def get_db():
     return _client["colconnect"]
 
 
+def get_read_db():
+    """
+    Base des lectures tolérant un secondaire (retard borné par MONGO_MAX_STALENESS_S).
+    Passer session=causal_session() pour lire au moins ce que l'utilisateur a déjà écrit.
+    """
+    return get_db().with_options(read_preference=READ_PREFERENCE)
+
+
 def _safe_create_index(collection, keys, **kwargs):
     """
     Création d'index idempotente:
@@ -36,5 +107,85 @@ def ensure_indexes():
     # Arbitrages: tri rapide pour :last
     _safe_create_index(db.arbitrages, [("collectivite_id", ASCENDING), ("created_at_dt", DESCENDING)])
 
+    # Pagination keyset: une seule clé de tri normalisée (created_at_dt|arbitrage_id)
+    _safe_create_index(
+        db.arbitrages,
+        [("collectivite_id", ASCENDING), ("engine_version", ASCENDING), ("sort_key", DESCENDING)],
+    )
+
     # Arbitrage ID: accès direct
     _safe_create_index(db.arbitrages, [("arbitrage_id", ASCENDING)], unique=True)
+
+    # Rollups temporels: lecture d'une série en un seul parcours d'index
+    _safe_create_index(
+        db.arbitrages_rollups,
+        [("collectivite_id", ASCENDING), ("bucket", ASCENDING), ("period_start", ASCENDING)],
+        unique=True,
+    )
+
+    # Archive froide: réhydratation par arbitrage_id
+    _safe_create_index(db.arbitrages_archive, [("arbitrage_id", ASCENDING)], unique=True)
+
+    # Runs shadow des moteurs candidats: revue par candidat / collectivité, purge TTL
+    _safe_create_index(db.engine_shadow_runs, [("candidate_version", ASCENDING), ("created_at", DESCENDING)])
+    _safe_create_index(db.engine_shadow_runs, [("collectivite_id", ASCENDING), ("created_at", DESCENDING)])
+    _safe_create_index(
+        db.engine_shadow_runs,
+        [("created_at", ASCENDING)],
+        expireAfterSeconds=int(os.getenv("ENGINE_SHADOW_RETENTION_DAYS", "30")) * 86400,
+    )
+
+    # Portefeuilles de base (dédupliqués par contenu) et scénarios (deltas immuables)
+    _safe_create_index(db.portfolios, [("portfolio_id", ASCENDING)], unique=True)
+    _safe_create_index(db.portfolios, [("collectivite_id", ASCENDING), ("content_hash", ASCENDING)], unique=True)
+    _safe_create_index(db.portfolio_chunks, [("portfolio_id", ASCENDING), ("seq", ASCENDING)], unique=True)
+    _safe_create_index(db.scenarios, [("scenario_id", ASCENDING)], unique=True)
+    _safe_create_index(db.scenarios, [("collectivite_id", ASCENDING), ("created_at", DESCENDING)])
+    _safe_create_index(
+        db.scenarios, [("collectivite_id", ASCENDING), ("portfolio_id", ASCENDING), ("created_at", DESCENDING)]
+    )
+
+    # Réponses pré-compressées: cache reconstructible, purge TTL
+    _safe_create_index(
+        db.arbitrages_blobs,
+        [("created_at", ASCENDING)],
+        expireAfterSeconds=int(os.getenv("PRECOMPRESSED_RETENTION_DAYS", "30")) * 86400,
+    )
+
+    # Single-flight des runs: résultats publiés (fenêtre courte) et Idempotency-Key
+    _safe_create_index(db.run_flights, [("expires_at", ASCENDING)], expireAfterSeconds=0)
+    _safe_create_index(
+        db.idempotency_keys,
+        [("created_at", ASCENDING)],
+        expireAfterSeconds=int(float(os.getenv("IDEMPOTENCY_TTL_H", "24")) * 3600),
+    )
+    # Baux expirés (dont ceux des runs d'un worker tué) purgés après une heure
+    _safe_create_index(db.leases, [("expires_at", ASCENDING)], expireAfterSeconds=3600)
+
+    ensure_collectivites_indexes(db)
+
+
+def ensure_collectivites_indexes(db=None):
+    """Index du référentiel collectivités (chargé par cc_collectivites_import_v1.py)."""
+    db = db if db is not None else get_db()
+
+    # Clé naturelle (code INSEE commune / SIREN EPCI): upserts de l'import
+    _safe_create_index(
+        db.collectivites,
+        [("code", ASCENDING)],
+        unique=True,
+        partialFilterExpression={"code": {"$exists": True}},
+        name="code_unique",
+    )
+
+    # Égalité/tri insensibles à la casse et aux accents (collation fr, strength 1)
+    _safe_create_index(
+        db.collectivites,
+        [("nom", ASCENDING)],
+        collation={"locale": "fr", "strength": 1},
+        name="nom_fr_ci",
+    )
+
+    # Préfixe ancré (^...) sur la clé repliée: utilisable par l'index, contrairement à $regex /i
+    _safe_create_index(db.collectivites, [("nom_folded", ASCENDING)], name="nom_folded_prefix")
+    _safe_create_index(db.collectivites, [("departement", ASCENDING), ("nom_folded", ASCENDING)])
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List
+import heapq
+from typing import Any, Dict, List, Set
 
 
 ENGINE_VERSION = "2.0.0"
@@ -15,59 +16,83 @@ def _map_priorite(p: str) -> float:
     return {"faible": 0.2, "moyenne": 0.6, "elevee": 1.0}.get(p, 0.0)
 
 
-def calculer_arbitrage_2_0(payload: Dict[str, Any], weights: Dict[str, float]) -> Dict[str, Any]:
+def _scorer_projet(p: Dict[str, Any], budget_max: float, poids: Dict[str, float]) -> Dict[str, Any]:
+    cout = float(p["cout_ttc"])
+
+    score_climat = _map_level(p["impact_climat"])
+    score_edu = _map_level(p["impact_education"])
+    score_prio = _map_priorite(p["priorite"])
+
+    # Score financier simple (plus c'est cher, moins bon), borné
+    # (évite les divisions par 0)
+    score_fin = 1.0 / (1.0 + (cout / max(budget_max, 1.0)))
+
+    score = (
+        poids["climat"] * score_climat
+        + poids["education"] * score_edu
+        + poids["financier"] * (0.6 * score_fin + 0.4 * score_prio)
+    )
+
+    return {
+        "id": p["id"],
+        "nom": p["nom"],
+        "cout_ttc": cout,
+        "annee_realisation": int(p["annee_realisation"]),
+        "score": float(round(score, 6)),
+        "details_score": {
+            "score_climat": score_climat,
+            "score_education": score_edu,
+            "score_financier": score_fin,
+            "score_priorite": score_prio,
+            "poids": dict(poids),
+        },
+    }
+
+
+def _poids(weights: Dict[str, float]) -> Dict[str, float]:
+    return {
+        "climat": float(weights.get("poids_climat", 0.4)),
+        "education": float(weights.get("poids_education", 0.3)),
+        "financier": float(weights.get("poids_financier", 0.3)),
+    }
+
+
+def scorer_projets(projets: List[Dict[str, Any]], budget_max: float, weights: Dict[str, float]) -> List[Dict[str, Any]]:
+    """Projets scorés, triés score desc puis coût asc (tri stable: ordre d'entrée à égalité)."""
+    poids = _poids(weights)
+    scored = [_scorer_projet(p, budget_max, poids) for p in projets]
+    scored.sort(key=lambda x: (-x["score"], x["cout_ttc"]))
+    return scored
+
+
+def rescorer_delta(
+    base_scored: List[Dict[str, Any]],
+    projets: List[Dict[str, Any]],
+    changed_ids: Set[str],
+    budget_max: float,
+    weights: Dict[str, float],
+) -> List[Dict[str, Any]]:
     """
-    Calcul pur (sans FastAPI/Mongo).
-    payload: dict (mandat, contraintes, hypotheses, projets...)
-    weights: {"poids_climat":..., "poids_education":..., "poids_financier":...}
+    Équivalent de scorer_projets(projets, ...) à partir des scores triés d'un
+    portefeuille parent (même budget_max, mêmes poids): seuls les projets de
+    changed_ids sont rescorés, les autres sont repris tels quels puis fusionnés.
+    Suppose que projets conserve l'ordre relatif des projets du parent (les
+    ajouts en fin de liste), ce qui garantit le même départage qu'un tri complet.
     """
-    contraintes = payload["contraintes"]
-    budget_max = float(contraintes["budget_investissement_max"])
-
-    w_climat = float(weights.get("poids_climat", 0.4))
-    w_edu = float(weights.get("poids_education", 0.3))
-    w_fin = float(weights.get("poids_financier", 0.3))
-
-    projets_in: List[Dict[str, Any]] = list(payload.get("projets", []))
-
-    scored: List[Dict[str, Any]] = []
-    for p in projets_in:
-        cout = float(p["cout_ttc"])
-
-        score_climat = _map_level(p["impact_climat"])
-        score_edu = _map_level(p["impact_education"])
-        score_prio = _map_priorite(p["priorite"])
-
-        # Score financier simple (plus c'est cher, moins bon), borné
-        # (évite les divisions par 0)
-        score_fin = 1.0 / (1.0 + (cout / max(budget_max, 1.0)))
-
-        score = (
-            w_climat * score_climat
-            + w_edu * score_edu
-            + w_fin * (0.6 * score_fin + 0.4 * score_prio)
-        )
-
-        scored.append(
-            {
-                "id": p["id"],
-                "nom": p["nom"],
-                "cout_ttc": cout,
-                "annee_realisation": int(p["annee_realisation"]),
-                "score": float(round(score, 6)),
-                "details_score": {
-                    "score_climat": score_climat,
-                    "score_education": score_edu,
-                    "score_financier": score_fin,
-                    "score_priorite": score_prio,
-                    "poids": {"climat": w_climat, "education": w_edu, "financier": w_fin},
-                },
-            }
-        )
-
-    # Tri score desc, puis coût asc
-    scored.sort(key=lambda x: (-x["score"], x["cout_ttc"]))
+    pos = {p["id"]: i for i, p in enumerate(projets)}
+    poids = _poids(weights)
 
+    def key(x: Dict[str, Any]):
+        return (-x["score"], x["cout_ttc"], pos[x["id"]])
+
+    kept = [s for s in base_scored if s["id"] in pos and s["id"] not in changed_ids]
+    fresh = [_scorer_projet(p, budget_max, poids) for p in projets if p["id"] in changed_ids]
+    fresh.sort(key=key)
+    return list(heapq.merge(kept, fresh, key=key))
+
+
+def selectionner(mandat: str, scored: List[Dict[str, Any]], budget_max: float) -> Dict[str, Any]:
+    """Sélection gloutonne sous budget sur des projets déjà scorés et triés."""
     budget_retenu = 0.0
     projets_out: List[Dict[str, Any]] = []
     for p in scored:
@@ -87,8 +112,19 @@ def calculer_arbitrage_2_0(payload: Dict[str, Any], weights: Dict[str, float]) -
     }
 
     return {
-        "mandat": payload["mandat"],
+        "mandat": mandat,
         "synthese": synthese,
         "projets": projets_out,
         "engine_version": ENGINE_VERSION,
     }
+
+
+def calculer_arbitrage_2_0(payload: Dict[str, Any], weights: Dict[str, float]) -> Dict[str, Any]:
+    """
+    Calcul pur (sans FastAPI/Mongo).
+    payload: dict (mandat, contraintes, hypotheses, projets...)
+    weights: {"poids_climat":..., "poids_education":..., "poids_financier":...}
+    """
+    budget_max = float(payload["contraintes"]["budget_investissement_max"])
+    scored = scorer_projets(list(payload.get("projets", [])), budget_max, weights)
+    return selectionner(payload["mandat"], scored, budget_max)
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List
+
+import numpy as np
+
+
+ENGINE_VERSION = "2.1.0"
+
+_LEVELS = {"faible": 0.2, "moyen": 0.6, "fort": 1.0}
+_PRIORITES = {"faible": 0.2, "moyenne": 0.6, "elevee": 1.0}
+
+
+def calculer_arbitrage_2_1(payload: Dict[str, Any], weights: Dict[str, float]) -> Dict[str, Any]:
+    """
+    Même modèle que calculer_arbitrage_2_0, scores et tri vectorisés (NumPy).
+    Candidat en shadow: sorties attendues identiques à la 2.0.0 (mêmes opérations
+    flottantes, tri stable sur les mêmes clés), seule la latence doit changer.
+    """
+    contraintes = payload["contraintes"]
+    budget_max = float(contraintes["budget_investissement_max"])
+
+    w_climat = float(weights.get("poids_climat", 0.4))
+    w_edu = float(weights.get("poids_education", 0.3))
+    w_fin = float(weights.get("poids_financier", 0.3))
+
+    projets_in: List[Dict[str, Any]] = list(payload.get("projets", []))
+    n = len(projets_in)
+
+    cout = np.fromiter((float(p["cout_ttc"]) for p in projets_in), dtype=np.float64, count=n)
+    s_climat = np.fromiter((_LEVELS.get(p["impact_climat"], 0.0) for p in projets_in), dtype=np.float64, count=n)
+    s_edu = np.fromiter((_LEVELS.get(p["impact_education"], 0.0) for p in projets_in), dtype=np.float64, count=n)
+    s_prio = np.fromiter((_PRIORITES.get(p["priorite"], 0.0) for p in projets_in), dtype=np.float64, count=n)
+
+    s_fin = 1.0 / (1.0 + (cout / max(budget_max, 1.0)))
+    raw = w_climat * s_climat + w_edu * s_edu + w_fin * (0.6 * s_fin + 0.4 * s_prio)
+    # round() Python (et non np.round): arrondi décimal exact, identique à la 2.0.0
+    score = np.array([round(x, 6) for x in raw.tolist()], dtype=np.float64)
+
+    # Tri score desc, puis coût asc (lexsort: dernière clé = primaire, stable)
+    order = np.lexsort((cout, -score)).tolist()
+
+    cout_l = cout.tolist()
+    score_l = score.tolist()
+    climat_l, edu_l, prio_l, fin_l = s_climat.tolist(), s_edu.tolist(), s_prio.tolist(), s_fin.tolist()
+    poids = {"climat": w_climat, "education": w_edu, "financier": w_fin}
+
+    budget_retenu = 0.0
+    nb_retenus = 0
+    projets_out: List[Dict[str, Any]] = []
+    for i in order:
+        p = projets_in[i]
+        c = cout_l[i]
+        retenu = budget_retenu + c <= budget_max
+        if retenu:
+            budget_retenu += c
+            nb_retenus += 1
+        projets_out.append(
+            {
+                "id": p["id"],
+                "nom": p["nom"],
+                "cout_ttc": c,
+                "annee_realisation": int(p["annee_realisation"]),
+                "score": score_l[i],
+                "details_score": {
+                    "score_climat": climat_l[i],
+                    "score_education": edu_l[i],
+                    "score_financier": fin_l[i],
+                    "score_priorite": prio_l[i],
+                    "poids": dict(poids),
+                },
+                "retenu": retenu,
+            }
+        )
+
+    synthese = {
+        "budget_max": float(round(budget_max, 2)),
+        "budget_retenu": float(round(budget_retenu, 2)),
+        "budget_restant": float(round(budget_max - budget_retenu, 2)),
+        "nb_projets_total": len(projets_out),
+        "nb_projets_retenus": nb_retenus,
+    }
+
+    return {
+        "mandat": payload["mandat"],
+        "synthese": synthese,
+        "projets": projets_out,
+        "engine_version": ENGINE_VERSION,
+    }
@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from engine.arbitrage_v2 import ENGINE_VERSION as V2_0, calculer_arbitrage_2_0
+from engine.arbitrage_v2_1 import ENGINE_VERSION as V2_1, calculer_arbitrage_2_1
+
+
+# Interface commune: run(payload, weights) -> {"mandat", "synthese", "projets", "engine_version"},
+# calcul pur (ni FastAPI ni Mongo), sortie conforme à ArbitrageRunOut.
+# engine/arbitrage.run_engine (legacy) lit les projets dans Mongo et écrit
+# arbitrage_projects: il ne peut pas tourner sur un payload sans effet de bord,
+# il n'est donc pas enregistré.
+EngineFn = Callable[[Dict[str, Any], Dict[str, float]], Dict[str, Any]]
+
+_ENGINES: Dict[str, EngineFn] = {}
+_STATUS: Dict[str, str] = {}
+
+
+def register(version: str, fn: EngineFn, status: str = "stable") -> None:
+    """status: "stable" (épinglable) ou "candidate" (shadow seulement, sauf épinglage explicite)."""
+    _ENGINES[version] = fn
+    _STATUS[version] = status
+
+
+register(V2_0, calculer_arbitrage_2_0)
+register(V2_1, calculer_arbitrage_2_1, status="candidate")
+
+DEFAULT_ENGINE_VERSION = os.getenv("ENGINE_DEFAULT_VERSION", V2_0).strip() or V2_0
+if DEFAULT_ENGINE_VERSION not in _ENGINES:
+    raise RuntimeError(f"ENGINE_DEFAULT_VERSION inconnue: {DEFAULT_ENGINE_VERSION}")
+
+
+def get_engine(version: Optional[str] = None) -> EngineFn:
+    """Moteur d'une version (KeyError si inconnue); défaut: DEFAULT_ENGINE_VERSION."""
+    return _ENGINES[version or DEFAULT_ENGINE_VERSION]
+
+
+def is_registered(version: str) -> bool:
+    return version in _ENGINES
+
+
+def engine_versions() -> List[str]:
+    """Versions dont les documents sont lisibles par l'API (filtres engine_version)."""
+    return sorted(_ENGINES)
+
+
+def list_engines() -> List[Dict[str, Any]]:
+    return [
+        {"version": v, "status": _STATUS[v], "default": v == DEFAULT_ENGINE_VERSION}
+        for v in sorted(_ENGINES)
+    ]
+
+
+def run_timed(version: str, payload: Dict[str, Any], weights: Dict[str, float]) -> Tuple[Dict[str, Any], float]:
+    """(sortie, durée en s). Point d'entrée des workers shadow (picklable, sans état)."""
+    fn = get_engine(version)
+    t = time.perf_counter()
+    out = fn(payload, weights)
+    return out, time.perf_counter() - t
@@ -0,0 +1,154 @@
+"""
+Configuration gunicorn de production (image Dockerfile):
+
+  gunicorn -c gunicorn_conf.py main:app
+
+- preload_app: l'app est importée une fois dans le master puis partagée en
+  copy-on-write par les workers; le client Mongo est recréé après le fork
+  (MongoClient n'est pas fork-safe).
+- Worker uvicorn sur uvloop + httptools quand ils sont installés.
+- Workers / threads dimensionnés sur les limites cgroup (CPU et mémoire) du
+  conteneur, et non sur le nombre de CPU de l'hôte.
+- Keep-alive supérieur à l'idle timeout de l'App Gateway: c'est toujours la
+  gateway qui ferme une connexion inactive (sinon 502 sur connexion réutilisée).
+- max_requests + jitter: recyclage étalé des workers (fragmentation mémoire).
+
+Toutes les valeurs restent surchargeables par variable d'environnement
+(WORKERS, THREADPOOL_SIZE, GUNICORN_KEEPALIVE_S, ...).
+"""
+import math
+import os
+
+from uvicorn.workers import UvicornWorker
+
+
+def _read(path: str) -> str:
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def cgroup_cpu_limit() -> float:
+    """CPU alloués au conteneur (cgroup v2 cpu.max, puis v1 cfs), sinon CPU visibles."""
+    visible = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    quota, period = None, None
+    raw = _read("/sys/fs/cgroup/cpu.max")
+    if raw:
+        q, _, p = raw.partition(" ")
+        if q != "max":
+            quota, period = int(q), int(p or 100000)
+    else:
+        q, p = _read("/sys/fs/cgroup/cpu/cpu.cfs_quota_us"), _read("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+        if q and p and int(q) > 0:
+            quota, period = int(q), int(p)
+    if quota and period:
+        return max(0.1, min(visible, quota / period))
+    return float(visible)
+
+
+def cgroup_memory_limit_mb() -> float:
+    """Limite mémoire du conteneur en Mo (cgroup v2 puis v1); 0 si non bornée."""
+    raw = _read("/sys/fs/cgroup/memory.max") or _read("/sys/fs/cgroup/memory/memory.limit_in_bytes")
+    if not raw or raw == "max":
+        return 0.0
+    value = int(raw)
+    # cgroup v1 "non borné" = valeur géante (PAGE_COUNTER_MAX)
+    return 0.0 if value >= 1 << 60 else value / (1024 * 1024)
+
+
+# Budget mémoire par worker (PSS sous charge): à recaler avec cc_loadtest_v1.py --servers
+WORKER_MEM_MB = float(os.getenv("GUNICORN_WORKER_MEM_MB", "160"))
+MASTER_MEM_MB = float(os.getenv("GUNICORN_MASTER_MEM_MB", "120"))
+WORKERS_PER_CPU = float(os.getenv("GUNICORN_WORKERS_PER_CPU", "2"))
+
+
+def auto_workers() -> int:
+    cpu = cgroup_cpu_limit()
+    # Routes sync + moteur CPU: ~2 workers par CPU alloué, au moins 1
+    by_cpu = max(1, math.ceil(cpu * WORKERS_PER_CPU))
+    mem = cgroup_memory_limit_mb()
+    if mem:
+        by_mem = max(1, int((mem - MASTER_MEM_MB) // WORKER_MEM_MB))
+        return min(by_cpu, by_mem)
+    return by_cpu
+
+
+def auto_threads() -> int:
+    # Threadpool anyio des routes sync: I/O Mongo surtout, le moteur reste borné par le GIL
+    return max(8, min(40, math.ceil(cgroup_cpu_limit() * 16)))
+
+
+class CCUvicornWorker(UvicornWorker):
+    """UvicornWorker sur uvloop/httptools ("auto" retombe sur asyncio/h11 s'ils manquent)."""
+
+    CONFIG_KWARGS = {
+        "loop": "auto",
+        "http": "auto",
+        "proxy_headers": True,
+    }
+
+
+# ---------- Réglages ----------
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+worker_class = "gunicorn_conf.CCUvicornWorker"
+workers = int(os.getenv("WORKERS", "0")) or auto_workers()
+# Lu par main.py au startup (limiteur de threads anyio) de chaque worker
+os.environ.setdefault("THREADPOOL_SIZE", str(auto_threads()))
+
+# X-Forwarded-* de l'App Gateway (seul point d'entrée du conteneur)
+forwarded_allow_ips = os.getenv("FORWARDED_ALLOW_IPS", "*")
+
+preload_app = os.getenv("GUNICORN_PRELOAD", "1").strip() in ("1", "true", "yes")
+
+# App Gateway v2: idle timeout backend ~ 60-120 s selon la config; on reste au-dessus
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE_S", "130"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT_S", "60"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT_S", "30"))
+
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "5000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", str(max_requests // 10)))
+
+# Heartbeat des workers en RAM plutôt que sur l'overlayfs du conteneur
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+accesslog = None
+
+
+
+def _reset_multiproc_dir() -> None:
+    # Avant le preload (qui crée les fichiers des métriques): les fichiers d'un
+    # précédent lancement fausseraient les compteurs
+    multiproc_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR", "").strip()
+    if not multiproc_dir:
+        return
+    os.makedirs(multiproc_dir, exist_ok=True)
+    for name in os.listdir(multiproc_dir):
+        if name.endswith(".db"):
+            os.unlink(os.path.join(multiproc_dir, name))
+
+
+_reset_multiproc_dir()
+
+
+# ---------- Hooks ----------
+def on_starting(server):
+    server.log.info(
+        "[CC] workers=%s threads=%s cpu_limit=%.2f mem_limit_mb=%.0f preload=%s keepalive=%ss",
+        workers, os.environ["THREADPOOL_SIZE"], cgroup_cpu_limit(), cgroup_memory_limit_mb(),
+        preload_app, keepalive,
+    )
+
+
+def post_fork(server, worker):
+    # Le client créé à l'import (master, preload) ne doit pas être utilisé dans le fils
+    import database.mongo as mongo
+
+    mongo.reset_client()
+
+
+def child_exit(server, worker):
+    from services.metrics import mark_worker_dead
+
+    mark_worker_dead(worker.pid)
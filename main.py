@@ -1,4 +1,9 @@
+import logging
+import os
+
+import anyio.to_thread
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 
 def _cc_get_deploy_sha() -> str:
     """
@@ -23,30 +28,95 @@ def _cc_get_deploy_sha() -> str:
     return "unknown"
 from api.routes_system import router as system_router, legacy_root, legacy_api
 from api.routes_arbitrage import router as arbitrage_router
-from database.mongo import ensure_indexes
+from api.routes_engines import router as engines_router
+from api.routes_portfolios import router as portfolios_router
+from api.routes_scenarios import router as scenarios_router
+from api.metrics import PrometheusMiddleware, router as metrics_router
+from api.profiling import PROFILING_ENABLED, ProfilingMiddleware, router as profiling_router
+from api.access_log import AccessLogMiddleware
+from api.compression import COMPRESS_ENABLED, CompressionMiddleware
+from api.causal import CausalConsistencyMiddleware
+from api.body_limit import BodySizeLimitMiddleware
+from services.causal import MONGO_CAUSAL_ENABLED
+from services.logs import setup_logging, shutdown_logging
+from services.metrics import METRICS_ENABLED
+from services.arbitrage_writer import start_writer, stop_writer
+from services.portfolio_service import PORTFOLIO_UPLOAD_MAX_MB
+from services.engine_shadow import stop_shadow
+from services.readiness import readiness, startup_report
 
 app = FastAPI(title="ColConnect API", version="1.0.0", docs_url="/api/docs", openapi_url="/api/openapi.json", redoc_url=None)
 
 
 @app.on_event("startup")
 def startup_event():
-    try:
-        ensure_indexes()
-    except Exception:
-        # Ne jamais bloquer le démarrage pour une histoire d'index
-        pass
-
-
+    startup_report.mark("imports_done")
+    # Logs JSON via QueueHandler/QueueListener (thread listener propre à chaque worker)
+    setup_logging()
+    # Taille du threadpool des routes sync (anyio: 40 par défaut), réglable pour le capacity planning
+    threads = int(os.getenv("THREADPOOL_SIZE", "0") or 0)
+    if threads > 0:
+        anyio.to_thread.current_default_thread_limiter().total_tokens = threads
+    # Ping Mongo, warmup moteur puis ensure_indexes (une instance par déploiement, sous bail)
+    # en arrière-plan: le worker accepte les requêtes tout de suite, /ready décide du trafic
+    readiness.start()
+    # Write-behind des arbitrages (ARBITRAGE_WRITE_BEHIND=1)
+    start_writer()
+    startup_report.mark("startup_done")
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    readiness.stop()
+    # Vide la file d'écriture avant l'arrêt du worker
+    stop_writer()
+    stop_shadow()
+    shutdown_logging()
+
+
+# gzip/brotli selon la taille (ajouté en premier: le plus interne, les métriques voient les octets envoyés)
+if COMPRESS_ENABLED:
+    app.add_middleware(CompressionMiddleware)
+# Prometheus: /metrics + latence/in-flight/tailles par template de route (METRICS_ENABLED)
+if METRICS_ENABLED:
+    app.add_middleware(PrometheusMiddleware)
+# Profilage à la demande: absent de la pile si PROFILING_ENABLED=0 (surcoût nul)
+if PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+# Jeton causal Mongo (X-CC-Causal / cookie): lectures secondaires cohérentes avec les écritures précédentes
+if MONGO_CAUSAL_ENABLED:
+    app.add_middleware(CausalConsistencyMiddleware)
+# Imports multipart: taille bornée avant le parsing (Content-Length ou octets reçus)
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    max_bytes=int(PORTFOLIO_UPLOAD_MAX_MB * 1024 * 1024),
+    path_suffixes=("/portfolios:upload",),
+)
+# Request id + logs d'accès / d'audit (ajouté en dernier: englobe les autres middlewares)
+app.add_middleware(AccessLogMiddleware)
+app.include_router(profiling_router)
+app.include_router(metrics_router)
 app.include_router(system_router)
 app.include_router(legacy_root)
 app.include_router(legacy_api)
 app.include_router(arbitrage_router)
+app.include_router(engines_router)
+app.include_router(portfolios_router)
+app.include_router(scenarios_router)
 
 
 @app.get("/health", include_in_schema=False)
 def health():
+    # Liveness: le process répond (Mongo non vérifié, voir /ready)
     return {"ok": True}
 
+
+@app.get("/ready", include_in_schema=False)
+def ready():
+    # Readiness (sonde App Gateway): ping Mongo en cache + moteur chauffé
+    status = readiness.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
 @app.get("/api/health", include_in_schema=False)
 def api_health_alias():
     return {"ok": True}
@@ -124,7 +194,6 @@ def cc_deploy_v1() -> dict:
 
 # CC_PATCH_SIM_API_LOCAL_V1
 from typing import Any, Dict, Optional
-from datetime import datetime
 from fastapi import Body
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -144,162 +213,43 @@ try:
         )
         app.state._cc_local_cors_v1 = True
 except Exception as e:
-    print("[CC][SIM_LOCAL_V1] CORS middleware non ajouté:", e)
-
-_CC_SIM_FIXTURES: Dict[str, Dict[str, Any]] = {
-    "lyon": {
-        "label": "Ville de Lyon",
-        "ieb": 74,
-        "iep": 69,
-        "ics": 62,
-        "delta_ism": -3,
-        "volatilite": 31,
-        "signaux_faibles": 2,
-        "confidence": "moyenne",
-        "weights": {"b": 0.42, "p": 0.33, "s": 0.25},
-        "risks": [
-            "Tension sur le phasage budgétaire",
-            "Retards multi-lots sur projets structurants",
-            "Charge d'exécution des services élevée",
-        ],
-    },
-    "paris": {
-        "label": "Ville de Paris",
-        "ieb": 78,
-        "iep": 73,
-        "ics": 66,
-        "delta_ism": -1,
-        "volatilite": 27,
-        "signaux_faibles": 2,
-        "confidence": "moyenne",
-        "weights": {"b": 0.40, "p": 0.35, "s": 0.25},
-        "risks": [
-            "Complexité d'exécution sur portefeuille dense",
-            "Sensibilité calendrier",
-            "Arbitrages inter-dépendants",
-        ],
-    },
-    "marseille": {
-        "label": "Ville de Marseille",
-        "ieb": 64,
-        "iep": 58,
-        "ics": 54,
-        "delta_ism": -6,
-        "volatilite": 39,
-        "signaux_faibles": 3,
-        "confidence": "faible",
-        "weights": {"b": 0.43, "p": 0.32, "s": 0.25},
-        "risks": [
-            "Volatilité d'exécution élevée",
-            "Risque de dérive coût/délai",
-            "Capacité de pilotage sous tension",
-        ],
-    },
-}
-
-def _cc_sim_norm(cid: Optional[str]) -> str:
-    cid = (cid or "lyon").strip().lower()
-    return cid if cid else "lyon"
-
-def _cc_zone_ism(score: int) -> str:
-    if score >= 75:
-        return "favorable"
-    if score >= 55:
-        return "sous_controle"
-    return "critique"
-
-def _cc_zone_irm(score: int) -> str:
-    if score < 30:
-        return "faible"
-    if score < 60:
-        return "vigilance"
-    return "eleve"
-
-def _cc_projection_status(ism: int, irm: int, delta_ism: int) -> str:
-    if irm >= 60 or delta_ism <= -5:
-        return "Sous tension"
-    if ism >= 75 and irm < 30:
-        return "Stable"
-    return "Vigilance"
-
-def _cc_sim_payload(collectivite_id: Optional[str] = None) -> Dict[str, Any]:
-    cid = _cc_sim_norm(collectivite_id)
-    cfg = _CC_SIM_FIXTURES.get(cid, _CC_SIM_FIXTURES["lyon"])
+    logging.getLogger("cc.main").warning("CORS middleware non ajouté: %s", e)
 
-    ieb = int(cfg["ieb"])
-    iep = int(cfg["iep"])
-    ics = int(cfg["ics"])
+from fastapi import Depends, HTTPException
+from auth.dependencies import get_current_user, require_collectivite_access
+from services.sim_service import get_executive_payload
 
-    w = cfg["weights"]
-    ism = int(round((w["b"] * ieb) + (w["p"] * iep) + (w["s"] * ics)))
-
-    delta_ism = int(cfg["delta_ism"])
-    volatilite = int(cfg["volatilite"])
-    signaux = int(cfg["signaux_faibles"])
-
-    irm = int(round(max(0, min(100, (max(0, -delta_ism) * 4.0) + (volatilite * 0.55) + (signaux * 9.0)))))
-
-    if delta_ism >= 2:
-        trend = "Hausse"
-    elif delta_ism <= -2:
-        trend = "Baisse"
-    else:
-        trend = "Stable"
-
-    projection_status = _cc_projection_status(ism, irm, delta_ism)
-
-    return {
-        "collectivite_id": cid,
-        "collectivite_label": cfg["label"],
-        "drivers": {
-            "ieb": ieb,
-            "iep": iep,
-            "ics": ics,
-        },
-        "ism": {
-            "score": ism,
-            "trend": trend,
-            "confidence": cfg["confidence"],
-            "zone": _cc_zone_ism(ism),
-        },
-        "irm": {
-            "score": irm,
-            "zone": _cc_zone_irm(irm),
-        },
-        "projection": {
-            "status": projection_status,
-            "delta_ism": delta_ism,
-            "volatilite": volatilite,
-            "signaux_faibles": signaux,
-            "horizon_days": 90,
-        },
-        "risks": {
-            "top": cfg["risks"][:3],
-        },
-        "meta": {
-            "source": "sim_local_v1_fixture",
-            "generated_at": datetime.utcnow().isoformat() + "Z",
-        },
-    }
+def _cc_sim_payload(collectivite_id: Optional[str] = None) -> Dict[str, Any]:
+    # Indicateurs dérivés de l'historique d'arbitrages (mémoïsés par collectivité)
+    try:
+        return get_executive_payload(collectivite_id)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail={"code": "NOT_FOUND", "message": str(e)})
+    except ConnectionError as e:
+        raise HTTPException(status_code=503, detail={"code": "UNAVAILABLE", "message": str(e)})
 
 @app.get("/api/v1/sim/executive")
-def cc_sim_executive_root():
-    return _cc_sim_payload("lyon")
+def cc_sim_executive_root(user=Depends(get_current_user)):
+    # Sans id: première collectivité du token
+    collectivites = user.get("collectivites") or []
+    if not collectivites:
+        raise HTTPException(status_code=403, detail={"code": "FORBIDDEN", "message": "Aucune collectivité dans le token"})
+    return _cc_sim_payload(collectivites[0])
 
 @app.get("/api/v1/sim/executive/{collectivite_id}")
-def cc_sim_executive_by_id(collectivite_id: str):
+def cc_sim_executive_by_id(collectivite_id: str, _user=Depends(require_collectivite_access)):
     return _cc_sim_payload(collectivite_id)
 
 @app.get("/api/v1/collectivites/{collectivite_id}/sim")
-def cc_collectivite_sim(collectivite_id: str):
+def cc_collectivite_sim(collectivite_id: str, _user=Depends(require_collectivite_access)):
     return _cc_sim_payload(collectivite_id)
 
 @app.get("/api/v1/collectivites/{collectivite_id}/sim/executive")
-def cc_collectivite_sim_executive(collectivite_id: str):
+def cc_collectivite_sim_executive(collectivite_id: str, _user=Depends(require_collectivite_access)):
     return _cc_sim_payload(collectivite_id)
 
 @app.get("/api/v1/collectivites/{collectivite_id}/sim/projection")
-def cc_collectivite_sim_projection(collectivite_id: str):
+def cc_collectivite_sim_projection(collectivite_id: str, _user=Depends(require_collectivite_access)):
     payload = _cc_sim_payload(collectivite_id)
     return {
         "collectivite_id": payload["collectivite_id"],
@@ -312,9 +262,10 @@ def cc_collectivite_sim_projection(collectivite_id: str):
 
 @app.post("/api/v1/sim/run")
 @app.post("/api/sim/run")
-def cc_sim_run(body: Optional[Dict[str, Any]] = Body(default=None)):
+def cc_sim_run(body: Optional[Dict[str, Any]] = Body(default=None), user=Depends(get_current_user)):
     body = body or {}
     collectivite_id = body.get("collectivite_id", "lyon")
+    require_collectivite_access(collectivite_id, user)
     return _cc_sim_payload(collectivite_id)
 # END_CC_PATCH_SIM_API_LOCAL_V1
 
@@ -1,7 +1,9 @@
 from __future__ import annotations
 
 from typing import List, Literal, Optional, Dict, Any
-from pydantic import BaseModel, ConfigDict, Field
+from pydantic import BaseModel, ConfigDict, Field, field_validator, model_validator
+
+from engine.registry import is_registered
 
 
 # ---------- INPUT ----------
@@ -39,6 +41,52 @@ class ArbitrageRunIn(BaseModel):
     projets: List[ProjetIn] = Field(default_factory=list)
 
 
+class ArbitrageRunRefIn(BaseModel):
+    """arbitrage:run sur un portefeuille stocké (POST .../portfolios ou .../portfolios:upload)."""
+    model_config = ConfigDict(extra="forbid")
+    portfolio_id: str
+    # Absents: ceux du portefeuille
+    mandat: Optional[str] = None
+    contraintes: Optional[Contraintes] = None
+    hypotheses: Optional[Hypotheses] = None
+
+
+class ScenarioDelta(BaseModel):
+    """Écart à la base: projets ajoutés, retirés (ids) et surchargés (id -> champs de ProjetIn)."""
+    model_config = ConfigDict(extra="forbid")
+    added: List[ProjetIn] = Field(default_factory=list)
+    removed: List[str] = Field(default_factory=list)
+    overrides: Dict[str, Dict[str, Any]] = Field(default_factory=dict)
+
+    @field_validator("overrides")
+    @classmethod
+    def _known_fields(cls, v: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        allowed = set(ProjetIn.model_fields) - {"id"}
+        for pid, fields in v.items():
+            bad = sorted(set(fields) - allowed)
+            if bad:
+                raise ValueError(f"surcharge de {pid}: champs non modifiables {bad}")
+        return v
+
+
+class ScenarioIn(BaseModel):
+    """Scénario "what if": une base (portefeuille ou scénario parent) + un delta. Immuable."""
+    model_config = ConfigDict(extra="forbid")
+    name: str = Field(..., min_length=1, max_length=120)
+    portfolio_id: Optional[str] = None
+    parent_scenario_id: Optional[str] = None
+    delta: ScenarioDelta = Field(default_factory=ScenarioDelta)
+    # Absents: hérités de la base
+    mandat: Optional[str] = None
+    contraintes: Optional[Contraintes] = None
+    hypotheses: Optional[Hypotheses] = None
+
+    @model_validator(mode="after")
+    def _one_base(self) -> "ScenarioIn":
+        if bool(self.portfolio_id) == bool(self.parent_scenario_id):
+            raise ValueError("exactement un de portfolio_id / parent_scenario_id")
+        return self
+
 # ---------- SETTINGS (DB) ----------
 class CollectiviteSettings(BaseModel):
     """
@@ -48,6 +96,23 @@ class CollectiviteSettings(BaseModel):
     poids_climat: float = Field(0.4, ge=0, le=1)
     poids_education: float = Field(0.3, ge=0, le=1)
     poids_financier: float = Field(0.3, ge=0, le=1)
+    # Rétention: nb d'arbitrages gardés "chauds" (les plus anciens sont archivés)
+    retention_keep_last: Optional[int] = Field(None, ge=1, le=10000)
+    # Version du moteur épinglée (défaut: ENGINE_DEFAULT_VERSION) et candidat exécuté en shadow
+    engine_version: Optional[str] = None
+    engine_shadow_version: Optional[str] = None
+
+    @field_validator("engine_version", "engine_shadow_version")
+    @classmethod
+    def _known_engine(cls, v: Optional[str]) -> Optional[str]:
+        if v is not None and not is_registered(v):
+            raise ValueError(f"moteur inconnu: {v}")
+        return v
+
+
+class ArbitrageOfficialIn(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    official: bool = True
 
 
 # ---------- OUTPUT ----------
@@ -111,4 +176,135 @@ class ArbitrageCursorOut(BaseModel):
     model_config = ConfigDict(extra="forbid")
     limit: int
     next_cursor: str | None
+    prev_cursor: str | None = None
     items: List[ArbitrageListItem]
+
+
+class RollupPoint(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    period_start: str  # isoformat
+    nb_arbitrages: int
+    budget_max_avg: float
+    budget_retenu_avg: float
+    budget_retenu_min: float
+    budget_retenu_max: float
+    nb_projets_retenus_avg: float
+    score_avg: float
+
+
+class RollupsOut(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    collectivite_id: str
+    bucket: Literal["day", "month"]
+    items: List[RollupPoint]
+
+
+class ProjetDiffRef(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    id: str
+    nom: str
+    retenu: bool
+
+
+class ProjetDiffChange(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    id: str
+    nom: str
+    score_a: float
+    score_b: float
+    score_delta: float
+    cout_a: float
+    cout_b: float
+    cout_delta: float
+    retenu_a: bool
+    retenu_b: bool
+
+
+class ArbitrageDiffOut(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    collectivite_id: str
+    arbitrage_a: str
+    arbitrage_b: str
+    synthese_delta: Dict[str, float]
+    entered: List[str]  # ids retenus dans b mais pas dans a
+    left: List[str]     # ids retenus dans a mais plus dans b
+    added: List[ProjetDiffRef]
+    removed: List[ProjetDiffRef]
+    changed: List[ProjetDiffChange]
+
+
+class SimRankingItem(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    rank: int
+    collectivite_id: str
+    collectivite_label: str
+    ism: int
+    ism_zone: Literal["favorable", "sous_controle", "critique"]
+    irm: int
+    irm_zone: Literal["faible", "vigilance", "eleve"]
+    status: str
+    source: str
+
+
+class SimRankingOut(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    total: int
+    offset: int
+    limit: int
+    items: List[SimRankingItem]
+
+
+class PortfolioOut(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    portfolio_id: str
+    collectivite_id: str
+    mandat: str
+    n_projets: int
+    content_hash: str
+    source: Literal["json", "csv", "ndjson"]
+    created_at: str  # isoformat
+    created_by: str
+
+
+class ScenarioOut(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    scenario_id: str
+    collectivite_id: str
+    name: str
+    portfolio_id: str
+    parent_scenario_id: Optional[str] = None
+    depth: int
+    delta: ScenarioDelta
+    mandat: Optional[str] = None
+    contraintes: Optional[Contraintes] = None
+    hypotheses: Optional[Hypotheses] = None
+    n_projets: int
+    created_at: str  # isoformat
+    created_by: str
+    # ?materialize=true: portefeuille complet, prêt pour arbitrage:run
+    materialized: Optional[ArbitrageRunIn] = None
+
+
+class ScenarioListOut(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    collectivite_id: str
+    items: List[ScenarioOut]
+
+
+class ScenarioReuse(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    mode: Literal["cache", "delta", "full"]
+    rescored: int
+    reused: int
+
+
+class ScenarioEvalOut(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    scenario_id: str
+    collectivite_id: str
+    portfolio_id: str
+    mandat: str
+    engine_version: str
+    synthese: ArbitrageSynthese
+    projets: List[ProjetOut]
+    reuse: ScenarioReuse
@@ -9,23 +9,39 @@ from fastapi import Query, HTTPException
 from bson import ObjectId
 from typing import List
 
+from services.collectivites_index import get_index, start_refresher, stop_refresher
+
 def serialize_collectivite(doc):
     doc["id"] = str(doc["_id"])
     del doc["_id"]
     return doc
 
+@app.on_event("startup")
+def _cc_collectivites_index_startup():
+    # Snapshot mmap existant chargé tout de suite; reconstruction en arrière-plan
+    start_refresher()
+
+
+@app.on_event("shutdown")
+def _cc_collectivites_index_shutdown():
+    stop_refresher()
+
+
 @app.get("/api/collectivites/search")
-async def search_collectivites(
+def search_collectivites(
     q: str = Query(..., min_length=2),
     limit: int = Query(10, ge=1, le=50)
 ):
-    regex = {"$regex": q, "$options": "i"}
-    cursor = db.collectivites.find(
-        {"nom": regex},
-        {"nom": 1, "departement": 1}
-    ).limit(limit)
+    # Index en mémoire (préfixe + trigrammes, insensible aux accents): pas d'aller-retour Mongo.
+    # Route sync (threadpool): chargement mmap et recherche hors de la boucle d'événements
+    try:
+        index = get_index()
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if index is None:
+        raise HTTPException(status_code=503, detail="Collectivites index not ready")
 
-    results = [serialize_collectivite(doc) async for doc in cursor]
+    results = index.search(q, limit=limit)
     return {"count": len(results), "items": results}
 
 
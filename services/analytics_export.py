@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import pyarrow as pa
+import pyarrow.ipc as pa_ipc
+import pyarrow.parquet as pq
+
+from database.mongo import get_db
+from services.arbitrage_service import EXPORT_BATCH_SIZE, _export_rows
+from services.archive_service import rehydrate
+
+
+# Taille d'un row group Parquet / record batch Arrow (borne la mémoire de l'export)
+ROW_GROUP_SIZE = 50_000
+
+_DICT_STR = pa.dictionary(pa.int32(), pa.string())
+
+PROJETS_SCHEMA = pa.schema([
+    ("arbitrage_id", pa.string()),
+    ("collectivite_id", _DICT_STR),
+    ("mandat", _DICT_STR),
+    ("created_at", pa.timestamp("us", tz="UTC")),
+    ("engine_version", _DICT_STR),
+    ("budget_max", pa.float64()),
+    ("budget_retenu", pa.float64()),
+    ("projet_id", pa.string()),
+    ("nom", _DICT_STR),
+    ("cout_ttc", pa.float64()),
+    ("annee_realisation", pa.int32()),
+    ("score", pa.float64()),
+    ("retenu", pa.bool_()),
+    ("score_climat", pa.float64()),
+    ("score_education", pa.float64()),
+    ("score_financier", pa.float64()),
+    ("score_priorite", pa.float64()),
+])
+
+
+def _parse_ts(value: Any) -> Optional[datetime]:
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    if isinstance(value, str) and value:
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    return None
+
+
+def _iter_docs(
+    collectivite_ids: Optional[Sequence[str]] = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+) -> Iterator[Dict[str, Any]]:
+    db = get_db()
+    filt: Dict[str, Any] = {}
+    if collectivite_ids:
+        filt["collectivite_id"] = {"$in": list(collectivite_ids)}
+    rng: Dict[str, Any] = {}
+    if since is not None:
+        rng["$gte"] = since
+    if until is not None:
+        rng["$lt"] = until
+    if rng:
+        filt["created_at_dt"] = rng
+
+    # Seuls les champs utiles au calcul des lignes projet
+    projection = {
+        "_id": 0, "arbitrage_id": 1, "collectivite_id": 1, "mandat": 1, "synthese": 1, "projets": 1,
+        "audit": 1, "created_at": 1, "created_at_dt": 1, "engine_version": 1, "triggered_by": 1, "payload_hash": 1,
+        "archived": 1,
+    }
+    cursor = (
+        db.arbitrages.find(filt, projection=projection)
+        .sort([("collectivite_id", 1), ("created_at_dt", 1)])
+        .batch_size(EXPORT_BATCH_SIZE)
+    )
+    try:
+        for doc in cursor:
+            yield rehydrate(doc)
+    finally:
+        cursor.close()
+
+
+def iter_projet_batches(
+    collectivite_ids: Optional[Sequence[str]] = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    row_group_size: int = ROW_GROUP_SIZE,
+) -> Iterator[pa.RecordBatch]:
+    """
+    Lignes projet (une par projet et par arbitrage) regroupées en RecordBatch de
+    row_group_size lignes au plus, construites colonne par colonne depuis le curseur.
+    """
+    names = PROJETS_SCHEMA.names
+    cols: Dict[str, List[Any]] = {n: [] for n in names}
+    n_rows = 0
+
+    def _flush() -> pa.RecordBatch:
+        nonlocal cols, n_rows
+        arrays = [pa.array(cols[f.name], type=f.type) for f in PROJETS_SCHEMA]
+        batch = pa.RecordBatch.from_arrays(arrays, schema=PROJETS_SCHEMA)
+        cols = {n: [] for n in names}
+        n_rows = 0
+        return batch
+
+    for doc in _iter_docs(collectivite_ids, since=since, until=until):
+        for row in _export_rows(doc, flatten=True):
+            row["created_at"] = _parse_ts(doc.get("created_at_dt")) or _parse_ts(row.get("created_at"))
+            for n in names:
+                cols[n].append(row.get(n))
+            n_rows += 1
+            if n_rows >= row_group_size:
+                yield _flush()
+
+    if n_rows:
+        yield _flush()
+
+
+def write_projets_parquet(sink: Any, **filters: Any) -> int:
+    """Écrit un fichier Parquet (un row group par batch). Retourne le nombre de lignes."""
+    total = 0
+    with pq.ParquetWriter(
+        sink,
+        PROJETS_SCHEMA,
+        compression="zstd",
+        use_dictionary=["collectivite_id", "mandat", "engine_version", "nom"],
+    ) as writer:
+        for batch in iter_projet_batches(**filters):
+            writer.write_batch(batch)
+            total += batch.num_rows
+    return total
+
+
+def write_projets_arrow(sink: Any, **filters: Any) -> int:
+    """Écrit un fichier Arrow IPC (format fichier, lisible par pyarrow/polars/duckdb)."""
+    total = 0
+    with pa_ipc.new_file(sink, PROJETS_SCHEMA) as writer:
+        for batch in iter_projet_batches(**filters):
+            writer.write_batch(batch)
+            total += batch.num_rows
+    return total
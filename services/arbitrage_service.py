@@ -1,16 +1,35 @@
 from __future__ import annotations
 
 from datetime import datetime, timezone
+import base64
+import csv
 import hashlib
+import hmac
+import io
 import json
+import logging
+import os
+import time
 import uuid
-from typing import Any, Dict
-
-from database.mongo import get_db
-from engine.arbitrage_v2 import calculer_arbitrage_2_0, ENGINE_VERSION
+from typing import Any, Callable, Dict, Iterator, List
+
+from database.mongo import get_db, get_read_db
+from engine.arbitrage_v2 import ENGINE_VERSION
+from engine.registry import DEFAULT_ENGINE_VERSION, engine_versions, get_engine, is_registered
+from services.archive_service import rehydrate
+from services.arbitrage_writer import get_writer
+from services.causal import causal_session
+from services.rollups import apply_rollups
+from services.sort_keys import make_sort_key
+from services import sim_service
+from services.metrics import ENGINE_DURATION, ENGINE_PORTFOLIO_SIZE
+from services.logs import bind
+from services.engine_shadow import ENGINE_SHADOW_VERSION, submit_shadow
 
 from schemas.arbitrage import ArbitrageRunOut
 
+logger = logging.getLogger("cc.arbitrage")
+
 
 def _utc_now_dt() -> datetime:
     return datetime.now(timezone.utc)
@@ -21,6 +40,11 @@ def _utc_iso(dt: datetime | None = None) -> str:
     return dt.isoformat().replace("+00:00", "Z")
 
 
+def _as_utc(dt: datetime) -> datetime:
+    # PyMongo rend des datetimes naïfs (UTC implicite)
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
 def _payload_hash(payload: Dict[str, Any]) -> str:
     raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
     return hashlib.sha256(raw.encode("utf-8")).hexdigest()
@@ -30,9 +54,7 @@ def _default_settings() -> Dict[str, float]:
     return {"poids_climat": 0.4, "poids_education": 0.3, "poids_financier": 0.3}
 
 
-def get_settings_for_collectivite(collectivite_id: str) -> Dict[str, float]:
-    db = get_db()
-    doc = db.collectivites_settings.find_one({"collectivite_id": collectivite_id}, projection={"_id": 0})
+def _weights_from_doc(doc: Dict[str, Any] | None) -> Dict[str, float]:
     if not doc:
         return _default_settings()
     return {
@@ -42,6 +64,28 @@ def get_settings_for_collectivite(collectivite_id: str) -> Dict[str, float]:
     }
 
 
+def get_settings_for_collectivite(collectivite_id: str) -> Dict[str, float]:
+    db = get_db()
+    doc = db.collectivites_settings.find_one({"collectivite_id": collectivite_id}, projection={"_id": 0})
+    return _weights_from_doc(doc)
+
+
+def _engine_version_for(doc: Dict[str, Any] | None) -> str:
+    """Version épinglée par la collectivité (settings.engine_version), sinon défaut du registre."""
+    pinned = (doc or {}).get("engine_version")
+    if pinned and is_registered(pinned):
+        return pinned
+    if pinned:
+        logger.warning("moteur épinglé inconnu (%s): repli sur %s", pinned, DEFAULT_ENGINE_VERSION)
+    return DEFAULT_ENGINE_VERSION
+
+
+def get_run_settings(collectivite_id: str) -> tuple:
+    """(poids, version moteur) appliqués à un run de la collectivité."""
+    doc = get_db().collectivites_settings.find_one({"collectivite_id": collectivite_id}, projection={"_id": 0})
+    return _weights_from_doc(doc), _engine_version_for(doc)
+
+
 def upsert_settings(collectivite_id: str, settings: Dict[str, Any]) -> Dict[str, Any]:
     db = get_db()
     doc = {
@@ -51,11 +95,25 @@ def upsert_settings(collectivite_id: str, settings: Dict[str, Any]) -> Dict[str,
         "poids_financier": float(settings["poids_financier"]),
         "updated_at": _utc_iso(),
     }
+    if settings.get("retention_keep_last") is not None:
+        doc["retention_keep_last"] = int(settings["retention_keep_last"])
+    # Épinglage moteur / candidat shadow: absents du PUT = retour au défaut
+    unset = {}
+    for field in ("engine_version", "engine_shadow_version"):
+        if settings.get(field):
+            doc[field] = settings[field]
+        else:
+            unset[field] = ""
+    update: Dict[str, Any] = {"$set": doc}
+    if unset:
+        update["$unset"] = unset
     db.collectivites_settings.update_one(
         {"collectivite_id": collectivite_id},
-        {"$set": doc},
+        update,
         upsert=True,
+        session=causal_session(),
     )
+    sim_service.invalidate(collectivite_id)
     return doc
 
 
@@ -106,7 +164,14 @@ def run_arbitrage(
     collectivite_id: str,
     payload_dict: Dict[str, Any],
     triggered_by: str,
+    source: Dict[str, Any] | None = None,
+    calc_fn: Callable[[Dict[str, float], str], Dict[str, Any]] | None = None,
 ) -> Dict[str, Any]:
+    """
+    source: origine du portefeuille (ex. {"scenario_id", "portfolio_id"}), gardée sur le document.
+    calc_fn(weights, engine_version): calcul à la place du moteur (scénario: scores du parent
+    repris), même sortie que get_engine(engine_version)(payload_dict, weights).
+    """
     db = get_db()
 
     arbitrage_id = f"arb-{datetime.utcnow().year}-{uuid.uuid4().hex[:8]}"
@@ -114,9 +179,19 @@ def run_arbitrage(
     created_at = _utc_iso(now_dt)
 
     payload_hash = _payload_hash(payload_dict)
-    weights = get_settings_for_collectivite(collectivite_id)
-
-    calc = calculer_arbitrage_2_0(payload_dict, weights=weights)
+    settings_doc = db.collectivites_settings.find_one({"collectivite_id": collectivite_id}, projection={"_id": 0})
+    weights = _weights_from_doc(settings_doc)
+    engine_version = _engine_version_for(settings_doc)
+    bind(arbitrage_id=arbitrage_id, collectivite_id=collectivite_id, engine_version=engine_version)
+
+    ENGINE_PORTFOLIO_SIZE.observe(len(payload_dict.get("projets") or []))
+    t = time.perf_counter()
+    if calc_fn is not None:
+        calc = calc_fn(weights, engine_version)
+    else:
+        calc = get_engine(engine_version)(payload_dict, weights)
+    engine_s = time.perf_counter() - t
+    ENGINE_DURATION.labels(engine_version).observe(engine_s)
 
     out = {
         "arbitrage_id": arbitrage_id,
@@ -125,7 +200,7 @@ def run_arbitrage(
         "synthese": calc["synthese"],
         "projets": calc["projets"],
         "audit": {
-            "engine_version": ENGINE_VERSION,
+            "engine_version": engine_version,
             "triggered_by": triggered_by,
             "payload_hash": payload_hash,
             "timestamp_utc": created_at,
@@ -133,16 +208,47 @@ def run_arbitrage(
         # DB fields
         "created_at": created_at,      # string ISO
         "created_at_dt": now_dt,       # BSON datetime (tri fiable)
-        "engine_version": ENGINE_VERSION,
+        "engine_version": engine_version,
         "triggered_by": triggered_by,
         "payload_hash": payload_hash,
         "weights": weights,
+        "sort_key": make_sort_key(now_dt, arbitrage_id),  # clé keyset unique et indexée
     }
+    if source:
+        out["source"] = dict(source)
 
-    db.arbitrages.insert_one(out)
+    writer = get_writer()
+    if writer is not None:
+        # Write-behind: WAL + file, l'insert_many se fait en arrière-plan
+        writer.submit(out)
+    else:
+        # En session: le jeton causal de la réponse couvre l'insert (:last lu ensuite sur un secondaire)
+        db.arbitrages.insert_one(out, session=causal_session())
+        _apply_rollups_safe([out])
+    sim_service.invalidate(collectivite_id)
+
+    # Candidat en shadow (pool dédié): la requête n'attend pas son résultat
+    submit_shadow(
+        candidate=(settings_doc or {}).get("engine_shadow_version") or ENGINE_SHADOW_VERSION,
+        arbitrage_id=arbitrage_id,
+        collectivite_id=collectivite_id,
+        primary_version=engine_version,
+        primary_out=calc,
+        primary_s=engine_s,
+        payload=payload_dict,
+        weights=weights,
+    )
     return out
 
 
+def _apply_rollups_safe(docs) -> None:
+    # Les rollups sont reconstructibles (cc_rollups_rebuild_v1.py): ne jamais faire échouer un run
+    try:
+        apply_rollups(docs)
+    except Exception:
+        logger.exception("rollups non appliqués")
+
+
 
 def _to_api_out(doc: Dict[str, Any]) -> Dict[str, Any]:
     """Construit le dict conforme à ArbitrageRunOut (ou le plus proche possible)."""
@@ -205,28 +311,39 @@ def get_last_arbitrage_out(collectivite_id: str) -> Dict[str, Any]:
     Retourne un arbitrage *conforme* au schéma ArbitrageRunOut.
     On scanne les 20 derniers docs et on garde le premier qui valide.
     """
-    db = get_db()
+    db = get_read_db()
     cursor = db.arbitrages.find(
-        {"collectivite_id": collectivite_id, "engine_version": "2.0.0"},
+        {"collectivite_id": collectivite_id, "engine_version": {"$in": engine_versions()}},
         projection={"_id": 0},
+        session=causal_session(),
     ).sort([("created_at_dt", -1), ("created_at", -1)]).limit(20)
 
+    # Read-your-writes: un doc encore en file d'écriture est forcément le plus récent de ce worker
+    writer = get_writer()
+    pending = writer.pending_last(collectivite_id) if writer is not None else None
+
     last_seen = None
     for doc in cursor:
         last_seen = doc
+        doc_dt = doc.get("created_at_dt")
+        if pending is not None and (not isinstance(doc_dt, datetime) or pending["created_at_dt"] > _as_utc(doc_dt)):
+            break
         try:
-            out = _to_api_out(doc)
+            out = _to_api_out(rehydrate(doc))
             # Validation stricte de la réponse
             ArbitrageRunOut.model_validate(out)
             return out
         except Exception:
             continue
 
+    if pending is not None:
+        return _to_api_out(pending)
+
     if not last_seen:
         raise KeyError("Aucun arbitrage trouvé pour cette collectivité")
 
     # fallback ultime: normaliser + retourner (peut encore échouer si doc vraiment incohérent)
-    out = _to_api_out(last_seen)
+    out = _to_api_out(rehydrate(last_seen))
     ArbitrageRunOut.model_validate(out)
     return out
 
@@ -244,7 +361,7 @@ def get_last_arbitrage(collectivite_id: str) -> Dict[str, Any]:
     for doc in cursor:
         last = doc
         try:
-            return _normalize_arbitrage_doc(doc)
+            return _normalize_arbitrage_doc(rehydrate(doc))
         except Exception:
             # si un doc est vraiment corrompu, on tente le suivant
             continue
@@ -253,14 +370,15 @@ def get_last_arbitrage(collectivite_id: str) -> Dict[str, Any]:
         raise KeyError("Aucun arbitrage trouvé pour cette collectivité")
 
     # fallback ultime: normalise ce qu'on a
-    return _normalize_arbitrage_doc(last)
+    return _normalize_arbitrage_doc(rehydrate(last))
 
 
 def get_settings(collectivite_id: str) -> Dict[str, Any]:
-    db = get_db()
+    db = get_read_db()
     doc = db.collectivites_settings.find_one(
         {"collectivite_id": collectivite_id},
         projection={"_id": 0},
+        session=causal_session(),
     )
     if not doc:
         # valeurs par défaut si rien en base
@@ -273,10 +391,11 @@ def get_settings(collectivite_id: str) -> Dict[str, Any]:
     return doc
 
 def get_settings(collectivite_id: str) -> Dict[str, Any]:
-    db = get_db()
+    db = get_read_db()
     doc = db.collectivites_settings.find_one(
         {"collectivite_id": collectivite_id},
         projection={"_id": 0},
+        session=causal_session(),
     )
     if not doc:
         return {
@@ -288,18 +407,125 @@ def get_settings(collectivite_id: str) -> Dict[str, Any]:
     return doc
 
 def get_arbitrage_by_id(collectivite_id: str, arbitrage_id: str) -> Dict[str, Any]:
-    db = get_db()
+    writer = get_writer()
+    pending = writer.pending_by_id(collectivite_id, arbitrage_id) if writer is not None else None
+    if pending is not None:
+        return _to_api_out(pending)
+
+    db = get_read_db()
     doc = db.arbitrages.find_one(
         {
             "collectivite_id": collectivite_id,
             "arbitrage_id": arbitrage_id,
         },
         projection={"_id": 0},
+        session=causal_session(),
     )
     if not doc:
         raise KeyError("Arbitrage introuvable")
 
-    return _to_api_out(doc)
+    # Stub archivé -> réhydratation à la demande
+    return _to_api_out(rehydrate(doc))
+
+
+_DIFF_PROJECTION = {
+    "_id": 0,
+    "arbitrage_id": 1,
+    "synthese": 1,
+    "projets.id": 1,
+    "projets.nom": 1,
+    "projets.score": 1,
+    "projets.cout_ttc": 1,
+    "projets.retenu": 1,
+    "archived": 1,
+}
+_DIFF_EPS = 1e-9
+
+
+def _get_for_diff(collectivite_id: str, arbitrage_id: str) -> Dict[str, Any]:
+    writer = get_writer()
+    pending = writer.pending_by_id(collectivite_id, arbitrage_id) if writer is not None else None
+    if pending is not None:
+        return pending
+    doc = get_db().arbitrages.find_one(
+        {"collectivite_id": collectivite_id, "arbitrage_id": arbitrage_id},
+        projection=_DIFF_PROJECTION,
+    )
+    if not doc:
+        raise KeyError(f"Arbitrage introuvable: {arbitrage_id}")
+    return rehydrate(doc)
+
+
+def diff_arbitrages(collectivite_id: str, arbitrage_a: str, arbitrage_b: str) -> Dict[str, Any]:
+    """
+    Diff a -> b en O(n): jointure par hash sur projet.id, sans details_score.
+    Ne renvoie que ce qui change.
+    """
+    doc_a = _get_for_diff(collectivite_id, arbitrage_a)
+    doc_b = _get_for_diff(collectivite_id, arbitrage_b)
+
+    by_id_a = {p.get("id"): p for p in doc_a.get("projets") or [] if isinstance(p, dict)}
+
+    entered, left, added, changed = [], [], [], []
+    for pb in doc_b.get("projets") or []:
+        if not isinstance(pb, dict):
+            continue
+        pid = pb.get("id")
+        pa = by_id_a.pop(pid, None)
+        retenu_b = bool(pb.get("retenu", False))
+        if pa is None:
+            added.append({"id": pid, "nom": pb.get("nom", "unknown"), "retenu": retenu_b})
+            if retenu_b:
+                entered.append(pid)
+            continue
+
+        retenu_a = bool(pa.get("retenu", False))
+        score_a, score_b = float(pa.get("score", 0.0) or 0.0), float(pb.get("score", 0.0) or 0.0)
+        cout_a, cout_b = float(pa.get("cout_ttc", 0.0) or 0.0), float(pb.get("cout_ttc", 0.0) or 0.0)
+        if retenu_b and not retenu_a:
+            entered.append(pid)
+        elif retenu_a and not retenu_b:
+            left.append(pid)
+        if abs(score_b - score_a) > _DIFF_EPS or abs(cout_b - cout_a) > _DIFF_EPS or retenu_a != retenu_b:
+            changed.append({
+                "id": pid,
+                "nom": pb.get("nom", "unknown"),
+                "score_a": score_a,
+                "score_b": score_b,
+                "score_delta": score_b - score_a,
+                "cout_a": cout_a,
+                "cout_b": cout_b,
+                "cout_delta": cout_b - cout_a,
+                "retenu_a": retenu_a,
+                "retenu_b": retenu_b,
+            })
+
+    # Reste de a: projets retirés dans b
+    removed = []
+    for pid, pa in by_id_a.items():
+        retenu_a = bool(pa.get("retenu", False))
+        removed.append({"id": pid, "nom": pa.get("nom", "unknown"), "retenu": retenu_a})
+        if retenu_a:
+            left.append(pid)
+
+    syn_a = doc_a.get("synthese") or {}
+    syn_b = doc_b.get("synthese") or {}
+    synthese_delta = {
+        k: float(syn_b.get(k, 0) or 0) - float(syn_a.get(k, 0) or 0)
+        for k in ("budget_max", "budget_retenu", "budget_restant", "nb_projets_total", "nb_projets_retenus")
+    }
+
+    return {
+        "collectivite_id": collectivite_id,
+        "arbitrage_a": arbitrage_a,
+        "arbitrage_b": arbitrage_b,
+        "synthese_delta": synthese_delta,
+        "entered": entered,
+        "left": left,
+        "added": added,
+        "removed": removed,
+        "changed": changed,
+    }
 
 
 def list_arbitrages(collectivite_id: str, page: int = 1, limit: int = 10) -> Dict[str, Any]:
@@ -314,14 +540,15 @@ def list_arbitrages(collectivite_id: str, page: int = 1, limit: int = 10) -> Dic
     if limit > 50:
         limit = 50
 
-    db = get_db()
-    filt = {"collectivite_id": collectivite_id, "engine_version": ENGINE_VERSION}
+    db = get_read_db()
+    session = causal_session()
+    filt = {"collectivite_id": collectivite_id, "engine_version": {"$in": engine_versions()}}
 
-    total = db.arbitrages.count_documents(filt)
+    total = db.arbitrages.count_documents(filt, session=session)
     skip = (page - 1) * limit
 
     cursor = (
-        db.arbitrages.find(filt, projection={"_id": 0})
+        db.arbitrages.find(filt, projection={"_id": 0}, session=session)
         .sort([("created_at_dt", -1), ("created_at", -1)])
         .skip(skip)
         .limit(limit + 1)
@@ -352,56 +579,91 @@ def list_arbitrages(collectivite_id: str, page: int = 1, limit: int = 10) -> Dic
         "items": items,
     }
 
-import base64
-import json
+# --- Pagination par curseur (keyset sur sort_key) ---
+# sort_key = "<created_at_dt UTC, largeur fixe>|<arbitrage_id>", écrit à l'insert:
+# une seule clé monotone, couverte par l'index (collectivite_id, engine_version, sort_key).
+# Chaque page coûte un seul parcours d'index borné, quelle que soit la profondeur.
+_CURSOR_VERSION = "v2"
+_CURSOR_SECRET = (os.getenv("CURSOR_SECRET") or os.getenv("JWT_SECRET") or "").strip().encode("utf-8")
+_LIST_PROJECTION = {"_id": 0, "projets": 0}
 
 
-def _encode_cursor(created_at_dt, arbitrage_id):
-    payload = {
-        "created_at_dt": created_at_dt.isoformat(),
-        "arbitrage_id": arbitrage_id,
-    }
-    raw = json.dumps(payload).encode()
-    return base64.urlsafe_b64encode(raw).decode()
+def _sign(raw: bytes) -> str:
+    if not _CURSOR_SECRET:
+        # Curseurs signés avec un secret vide = curseurs forgeables: pagination refusée
+        raise RuntimeError("CURSOR_SECRET ou JWT_SECRET requis (signature des curseurs de pagination)")
+    mac = hmac.new(_CURSOR_SECRET, raw, hashlib.sha256).digest()[:16]
+    return base64.urlsafe_b64encode(mac).decode().rstrip("=")
+
 
+def _b64decode(s: str) -> bytes:
+    return base64.urlsafe_b64decode(s + "=" * (-len(s) % 4))
 
-def _decode_cursor(cursor: str):
-    raw = base64.urlsafe_b64decode(cursor.encode())
-    return json.loads(raw.decode())
 
+def _encode_cursor(sort_key: str, direction: str) -> str:
+    raw = json.dumps({"k": sort_key, "d": direction}, separators=(",", ":")).encode("utf-8")
+    body = base64.urlsafe_b64encode(raw).decode().rstrip("=")
+    return f"{_CURSOR_VERSION}.{body}.{_sign(raw)}"
 
-def list_arbitrages_cursor(collectivite_id: str, limit: int = 10, cursor: str | None = None):
+
+def _decode_cursor(cursor: str) -> tuple[str, str]:
+    """
+    Retourne (sort_key, direction). ValueError si curseur invalide/altéré, y compris
+    les anciens curseurs non signés (le client repart de la première page).
+    """
+    try:
+        version, body, sig = cursor.split(".", 2)
+        if version != _CURSOR_VERSION:
+            raise ValueError("version")
+        raw = _b64decode(body)
+        if not hmac.compare_digest(sig, _sign(raw)):
+            raise ValueError("signature")
+        data = json.loads(raw.decode("utf-8"))
+        if data.get("d") not in ("next", "prev") or not isinstance(data.get("k"), str):
+            raise ValueError("contenu")
+        return data["k"], data["d"]
+    except RuntimeError:
+        raise
+    except Exception:
+        raise ValueError("Curseur invalide")
+
+
+def list_arbitrages_cursor(collectivite_id: str, limit: int = 10, cursor: str | None = None) -> Dict[str, Any]:
+    """
+    Pagination keyset (engine v2), du plus récent au plus ancien.
+    next_cursor avance vers les plus anciens, prev_cursor revient vers les plus récents.
+    """
     if limit < 1:
         limit = 1
     if limit > 50:
         limit = 50
 
-    db = get_db()
-    filt = {"collectivite_id": collectivite_id, "engine_version": ENGINE_VERSION}
+    db = get_read_db()
+    filt: Dict[str, Any] = {"collectivite_id": collectivite_id, "engine_version": {"$in": engine_versions()}}
 
+    key, direction = (None, "next")
     if cursor:
-        data = _decode_cursor(cursor)
-        filt["$or"] = [
-            {"created_at_dt": {"$lt": data["created_at_dt"]}},
-            {
-                "created_at_dt": data["created_at_dt"],
-                "arbitrage_id": {"$lt": data["arbitrage_id"]},
-            },
-        ]
+        key, direction = _decode_cursor(cursor)
 
-    cursor_db = (
-        db.arbitrages.find(filt, projection={"_id": 0})
-        .sort([("created_at_dt", -1), ("arbitrage_id", -1)])
+    if direction == "next":
+        # Doc sans sort_key (backfill au démarrage pas encore passé): exclu plutôt qu'un curseur impossible
+        filt["sort_key"] = {"$lt": key} if key is not None else {"$exists": True}
+        order = -1
+    else:
+        filt["sort_key"] = {"$gt": key}
+        order = 1
+
+    docs = list(
+        db.arbitrages.find(filt, projection=_LIST_PROJECTION, session=causal_session())
+        .sort([("sort_key", order)])
         .limit(limit + 1)
     )
-
-    docs = list(cursor_db)
-    has_next = len(docs) > limit
+    has_more = len(docs) > limit
     docs = docs[:limit]
+    if direction == "prev":
+        docs.reverse()
 
     items = []
-    next_cursor = None
-
     for doc in docs:
         out = _to_api_out(doc)
         items.append(
@@ -414,93 +676,134 @@ def list_arbitrages_cursor(collectivite_id: str, limit: int = 10, cursor: str |
             }
         )
 
-    if has_next and docs:
-        last = docs[-1]
-        next_cursor = _encode_cursor(last["created_at_dt"], last["arbitrage_id"])
+    next_cursor = None
+    prev_cursor = None
+    if docs:
+        # En arrière, il existe forcément des docs plus anciens (la clé du curseur)
+        if (direction == "next" and has_more) or (direction == "prev" and key is not None):
+            next_cursor = _encode_cursor(docs[-1]["sort_key"], "next")
+        if (direction == "next" and key is not None) or (direction == "prev" and has_more):
+            prev_cursor = _encode_cursor(docs[0]["sort_key"], "prev")
 
     return {
         "limit": limit,
         "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor,
         "items": items,
     }
 
 
-# --- Override robuste cursor pagination (support docs legacy sans created_at_dt) ---
-def list_arbitrages_cursor(collectivite_id: str, limit: int = 10, cursor: str | None = None):
+# --- Export streaming (NDJSON / CSV), mémoire constante ---
+EXPORT_BATCH_SIZE = 100
+
+_EXPORT_ARBITRAGE_COLS = [
+    "arbitrage_id", "collectivite_id", "mandat", "created_at", "engine_version", "triggered_by",
+    "payload_hash", "budget_max", "budget_retenu", "budget_restant", "nb_projets_total", "nb_projets_retenus",
+]
+_EXPORT_PROJET_COLS = [
+    "projet_id", "nom", "cout_ttc", "annee_realisation", "score", "retenu",
+    "score_climat", "score_education", "score_financier", "score_priorite",
+]
+
+
+def _iter_export_docs(
+    collectivite_id: str,
+    since: datetime | None = None,
+    until: datetime | None = None,
+) -> Iterator[Dict[str, Any]]:
     """
-    Pagination par curseur, robuste sur historique hétérogène.
-    Tri: (created_at_dt DESC) fallback (created_at DESC) puis arbitrage_id DESC.
-    Curseur: timestamp ISO + arbitrage_id.
+    Curseur serveur trié par created_at_dt (index collectivite_id_1_created_at_dt_-1),
+    lu par lots de EXPORT_BATCH_SIZE: jamais tout l'historique en mémoire.
     """
-    if limit < 1:
-        limit = 1
-    if limit > 50:
-        limit = 50
-
     db = get_db()
-    filt = {"collectivite_id": collectivite_id, "engine_version": ENGINE_VERSION}
+    filt: Dict[str, Any] = {"collectivite_id": collectivite_id}
+    rng: Dict[str, Any] = {}
+    if since is not None:
+        rng["$gte"] = since
+    if until is not None:
+        rng["$lt"] = until
+    if rng:
+        filt["created_at_dt"] = rng
 
-    # decode cursor -> {"ts": "...", "arbitrage_id": "..."}
-    if cursor:
-        data = _decode_cursor(cursor)
-        ts = data.get("created_at_dt") or data.get("ts") or data.get("created_at")  # compat
-        arb_id = data.get("arbitrage_id")
-
-        # On filtre "strictly older"
-        # Note: created_at_dt peut être absent -> on s'appuie sur created_at string ISO.
-        filt["$or"] = [
-            {"created_at_dt": {"$lt": ts}},
-            {"created_at_dt": {"$exists": False}, "created_at": {"$lt": ts}},
-            {"created_at_dt": ts, "arbitrage_id": {"$lt": arb_id}},
-            {"created_at_dt": {"$exists": False}, "created_at": ts, "arbitrage_id": {"$lt": arb_id}},
-        ]
-
-    # On trie en priorité par created_at_dt, sinon created_at
-    cursor_db = (
+    cursor = (
         db.arbitrages.find(filt, projection={"_id": 0})
-        .sort([("created_at_dt", -1), ("created_at", -1), ("arbitrage_id", -1)])
-        .limit(limit + 1)
+        .sort([("collectivite_id", 1), ("created_at_dt", 1)])
+        .batch_size(EXPORT_BATCH_SIZE)
     )
+    try:
+        for doc in cursor:
+            yield rehydrate(doc)
+    finally:
+        cursor.close()
+
+
+def _export_rows(doc: Dict[str, Any], flatten: bool) -> Iterator[Dict[str, Any]]:
+    out = _to_api_out(doc)
+    audit = out["audit"]
+    base = {
+        "arbitrage_id": out["arbitrage_id"],
+        "collectivite_id": out["collectivite_id"],
+        "mandat": out["mandat"],
+        "created_at": audit["timestamp_utc"],
+        "engine_version": audit["engine_version"],
+        "triggered_by": audit["triggered_by"],
+        "payload_hash": audit["payload_hash"],
+        **out["synthese"],
+    }
+    if not flatten:
+        yield {**base, "projets": out["projets"]}
+        return
+    for p in out["projets"]:
+        details = p["details_score"]
+        yield {
+            **base,
+            "projet_id": p["id"],
+            "nom": p["nom"],
+            "cout_ttc": p["cout_ttc"],
+            "annee_realisation": p["annee_realisation"],
+            "score": p["score"],
+            "retenu": p["retenu"],
+            "score_climat": details.get("score_climat"),
+            "score_education": details.get("score_education"),
+            "score_financier": details.get("score_financier"),
+            "score_priorite": details.get("score_priorite"),
+        }
 
-    docs = list(cursor_db)
-    has_next = len(docs) > limit
-    docs = docs[:limit]
-
-    items = []
-    next_cursor = None
-
-    for doc in docs:
-        out = _to_api_out(doc)
-        items.append(
-            {
-                "arbitrage_id": out["arbitrage_id"],
-                "collectivite_id": out["collectivite_id"],
-                "mandat": out["mandat"],
-                "synthese": out["synthese"],
-                "audit": out["audit"],
-            }
-        )
 
-    if has_next and docs:
-        last = docs[-1]
-
-        # curseur timestamp: created_at_dt (datetime) -> iso ; sinon created_at (string) -> used
-        ts = None
-        if isinstance(last.get("created_at_dt"), datetime):
-            ts = last["created_at_dt"].isoformat()
-        elif isinstance(last.get("created_at_dt"), str):
-            ts = last["created_at_dt"]
-        elif isinstance(last.get("created_at"), str):
-            ts = last["created_at"]
-        else:
-            ts = "1970-01-01T00:00:00Z"
+def export_arbitrages_ndjson(
+    collectivite_id: str,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    flatten: bool = False,
+) -> Iterator[bytes]:
+    for doc in _iter_export_docs(collectivite_id, since=since, until=until):
+        for row in _export_rows(doc, flatten):
+            yield (json.dumps(row, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
 
-        payload = {"created_at_dt": ts, "arbitrage_id": last.get("arbitrage_id", "")}
-        raw = json.dumps(payload).encode()
-        next_cursor = base64.urlsafe_b64encode(raw).decode()
 
-    return {
-        "limit": limit,
-        "next_cursor": next_cursor,
-        "items": items,
-    }
+def export_arbitrages_csv(
+    collectivite_id: str,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    flatten: bool = False,
+) -> Iterator[bytes]:
+    """
+    CSV: une ligne par arbitrage (synthèse) ou, si flatten, une ligne par projet.
+    Le détail des projets n'est pas exporté en mode non aplati (utiliser NDJSON).
+    """
+    cols: List[str] = _EXPORT_ARBITRAGE_COLS + (_EXPORT_PROJET_COLS if flatten else [])
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=cols, extrasaction="ignore")
+
+    def _take() -> bytes:
+        data = buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate(0)
+        return data
+
+    writer.writeheader()
+    yield _take()
+    for doc in _iter_export_docs(collectivite_id, since=since, until=until):
+        for row in _export_rows(doc, flatten):
+            writer.writerow(row)
+        yield _take()
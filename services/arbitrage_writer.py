@@ -0,0 +1,303 @@
+from __future__ import annotations
+
+import fcntl
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from bson import json_util
+from pymongo.errors import BulkWriteError
+
+from database.mongo import get_db
+from services.rollups import apply_rollups
+
+logger = logging.getLogger("cc.arbitrage_writer")
+
+
+# Write-behind (optionnel): ARBITRAGE_WRITE_BEHIND=1 active la file d'écriture.
+WRITE_BEHIND_ENABLED = os.getenv("ARBITRAGE_WRITE_BEHIND", "0").strip() in ("1", "true", "yes")
+QUEUE_MAXSIZE = int(os.getenv("ARBITRAGE_WRITE_QUEUE_MAX", "256"))
+BATCH_SIZE = int(os.getenv("ARBITRAGE_WRITE_BATCH", "32"))
+FLUSH_INTERVAL_S = float(os.getenv("ARBITRAGE_WRITE_FLUSH_S", "0.2"))
+ENQUEUE_TIMEOUT_S = float(os.getenv("ARBITRAGE_WRITE_ENQUEUE_TIMEOUT_S", "2.0"))
+# Volume monté (Dockerfile, Dockerfile.api, docker run -v): le WAL doit survivre au remplacement du conteneur
+WAL_DIR = Path(os.getenv("ARBITRAGE_WAL_DIR", "/var/lib/colconnect/wal"))
+# Lot en échec: nouvel essai après 0.5 s, 1 s, 2 s... plafonné
+WRITE_RETRY_MAX_S = float(os.getenv("ARBITRAGE_WRITE_RETRY_MAX_S", "30"))
+
+
+class ArbitrageWriter:
+    """
+    File bornée + thread d'écriture groupée (insert_many) vers db.arbitrages.
+
+    Durabilité: chaque doc est ajouté (fsync) au journal WAL du worker *avant*
+    d'être mis en file; une ligne "ack" est écrite après l'insert. Chaque worker
+    garde un flock exclusif sur son WAL: au démarrage, les WAL non verrouillés
+    (worker mort) sont rejoués puis supprimés (l'index unique arbitrage_id rend
+    le rejeu idempotent).
+
+    Backpressure: si la file est pleine, l'appelant attend ENQUEUE_TIMEOUT_S
+    puis bascule sur un insert synchrone.
+
+    Read-your-writes: les docs en attente restent visibles via pending_*().
+    """
+
+    def __init__(
+        self,
+        wal_dir: Path = WAL_DIR,
+        maxsize: int = QUEUE_MAXSIZE,
+        batch_size: int = BATCH_SIZE,
+        flush_interval_s: float = FLUSH_INTERVAL_S,
+    ):
+        self.wal_dir = wal_dir
+        # Suffixe aléatoire: un pid recyclé (conteneurs) ne reprend jamais le WAL d'un worker mort
+        self.wal_path = wal_dir / f"arbitrages-{os.getpid()}-{uuid.uuid4().hex[:8]}.wal"
+        self._wal_lock_fd: Optional[int] = None
+        self.batch_size = max(1, batch_size)
+        self.flush_interval_s = flush_interval_s
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max(1, maxsize))
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._pending_lock = threading.Lock()
+        self._wal_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"enqueued": 0, "written": 0, "batches": 0, "sync_fallbacks": 0, "errors": 0, "retries": 0}
+
+    # ---------- WAL ----------
+    def _wal_open(self) -> None:
+        self.wal_dir.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.wal_path, os.O_CREAT | os.O_RDWR, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._wal_lock_fd = fd
+
+    def _wal_append(self, lines: List[str]) -> None:
+        with self._wal_lock:
+            with open(self.wal_path, "a", encoding="utf-8") as f:
+                f.write("".join(line + "\n" for line in lines))
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _wal_compact_if_idle(self) -> None:
+        """Tronque le WAL quand plus rien n'est en attente."""
+        with self._wal_lock:
+            with self._pending_lock:
+                if self._pending:
+                    return
+            try:
+                with open(self.wal_path, "w", encoding="utf-8"):
+                    pass
+            except OSError:
+                pass
+
+    @staticmethod
+    def _wal_unacked(path: Path) -> List[Dict[str, Any]]:
+        docs: Dict[str, Dict[str, Any]] = {}
+        acked = set()
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rec = json_util.loads(line)
+                except Exception:
+                    # ligne tronquée (crash pendant l'écriture) -> ignorée
+                    continue
+                if rec.get("op") == "put":
+                    doc = rec.get("doc") or {}
+                    docs[doc.get("arbitrage_id", "")] = doc
+                elif rec.get("op") == "ack":
+                    acked.update(rec.get("ids") or [])
+        return [d for k, d in docs.items() if k and k not in acked]
+
+    # ---------- Mongo ----------
+    def _insert_batch(self, docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Docs réellement insérés (sans les doublons d'un rejeu), pour les rollups."""
+        db = get_db()
+        # insert_many ajoute _id -> on insère des copies pour garder le cache propre
+        try:
+            db.arbitrages.insert_many([dict(d) for d in docs], ordered=False)
+        except BulkWriteError as e:
+            # 11000 = déjà inséré (rejeu WAL, lot réessayé) -> OK; le reste remonte
+            errors = e.details.get("writeErrors", [])
+            if any(w.get("code") != 11000 for w in errors):
+                raise
+            dup = {w["index"] for w in errors}
+            return [d for i, d in enumerate(docs) if i not in dup]
+        return docs
+
+    def _apply_rollups(self, docs: List[Dict[str, Any]]) -> None:
+        if not docs:
+            return
+        try:
+            apply_rollups(docs)
+        except Exception:
+            # rollups reconstructibles (cc_rollups_rebuild_v1.py)
+            self.stats["errors"] += 1
+
+    def _commit(self, docs: List[Dict[str, Any]]) -> None:
+        ids = [d["arbitrage_id"] for d in docs]
+        inserted = self._insert_batch(docs)
+        # Rollups avant l'ack: un lot inséré n'est jamais réessayé (tout y serait doublon,
+        # donc jamais compté); $inc jamais deux fois pour un doc déjà compté
+        self._apply_rollups(inserted)
+        try:
+            self._wal_append([json_util.dumps({"op": "ack", "ids": ids})])
+        except Exception:
+            # Lot en base: un rejeu de ce WAL n'y trouvera que des doublons (sans effet)
+            self.stats["errors"] += 1
+            logger.warning("ack WAL de %d arbitrages insérés échoué", len(ids), exc_info=True)
+        with self._pending_lock:
+            for i in ids:
+                self._pending.pop(i, None)
+        self.stats["written"] += len(docs)
+        self.stats["batches"] += 1
+
+    # ---------- API ----------
+    def submit(self, doc: Dict[str, Any]) -> None:
+        arbitrage_id = doc["arbitrage_id"]
+        # pending d'abord: la compaction ne tronque jamais un WAL non vide
+        with self._pending_lock:
+            self._pending[arbitrage_id] = doc
+        self._wal_append([json_util.dumps({"op": "put", "doc": doc})])
+        try:
+            self._queue.put(doc, timeout=ENQUEUE_TIMEOUT_S)
+            self.stats["enqueued"] += 1
+        except queue.Full:
+            # Backpressure: file saturée -> écriture synchrone (le doc est déjà dans le WAL)
+            self.stats["sync_fallbacks"] += 1
+            self._commit([doc])
+
+    def pending_by_id(self, collectivite_id: str, arbitrage_id: str) -> Optional[Dict[str, Any]]:
+        with self._pending_lock:
+            doc = self._pending.get(arbitrage_id)
+        if doc and doc.get("collectivite_id") == collectivite_id:
+            return dict(doc)
+        return None
+
+    def pending_last(self, collectivite_id: str) -> Optional[Dict[str, Any]]:
+        with self._pending_lock:
+            docs = [d for d in self._pending.values() if d.get("collectivite_id") == collectivite_id]
+        if not docs:
+            return None
+        return dict(max(docs, key=lambda d: d.get("created_at", "")))
+
+    def replay_orphan_wals(self) -> int:
+        """Rejoue les WAL des workers morts (fichiers dont le flock est libre)."""
+        replayed = 0
+        for path in sorted(self.wal_dir.glob("arbitrages-*.wal")):
+            if path == self.wal_path:
+                continue
+            fd = os.open(path, os.O_RDWR)
+            try:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # worker vivant
+                docs = self._wal_unacked(path)
+                for i in range(0, len(docs), self.batch_size):
+                    chunk = docs[i:i + self.batch_size]
+                    self._apply_rollups(self._insert_batch(chunk))
+                    replayed += len(chunk)
+                path.unlink()
+            finally:
+                os.close(fd)
+        return replayed
+
+    def _drain(self, block: bool) -> List[Dict[str, Any]]:
+        batch: List[Dict[str, Any]] = []
+        try:
+            if block:
+                batch.append(self._queue.get(timeout=self.flush_interval_s))
+            while len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _run(self) -> None:
+        # Lots en échec remis en attente avec backoff; la file continue d'être servie entre-temps
+        retry: List[Dict[str, Any]] = []
+        retry_at = 0.0
+        failures = 0
+        while not self._stop.is_set() or not self._queue.empty():
+            if retry and time.monotonic() >= retry_at:
+                batch, retry = retry, []
+                self.stats["retries"] += 1
+            else:
+                batch = self._drain(block=True)
+            if not batch:
+                continue
+            try:
+                self._commit(batch)
+                failures = 0
+            except Exception:
+                failures += 1
+                self.stats["errors"] += 1
+                logger.warning("insertion d'un lot de %d arbitrages échouée (échec %d)",
+                               len(batch), failures, exc_info=True)
+                retry.extend(batch)
+                retry_at = time.monotonic() + min(WRITE_RETRY_MAX_S, 0.5 * 2 ** (failures - 1))
+                continue
+            if self._queue.empty() and not retry:
+                self._wal_compact_if_idle()
+        if retry:
+            try:
+                self._commit(retry)
+            except Exception:
+                # Restent dans le WAL (non supprimé à l'arrêt): rejoués au prochain démarrage
+                logger.warning("arrêt: %d arbitrages non insérés, laissés dans le WAL", len(retry), exc_info=True)
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        if self._wal_lock_fd is None:
+            self._wal_open()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="arbitrage-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+        with self._pending_lock:
+            drained = not self._pending
+        if drained and self._wal_lock_fd is not None:
+            # Arrêt propre: tout est en base -> WAL inutile
+            self.wal_path.unlink(missing_ok=True)
+            os.close(self._wal_lock_fd)
+            self._wal_lock_fd = None
+
+
+_writer: Optional[ArbitrageWriter] = None
+
+
+def get_writer() -> Optional[ArbitrageWriter]:
+    """Retourne le writer actif (None si write-behind désactivé ou non démarré)."""
+    return _writer
+
+
+def start_writer() -> Optional[ArbitrageWriter]:
+    global _writer
+    if not WRITE_BEHIND_ENABLED:
+        return None
+    if _writer is None:
+        _writer = ArbitrageWriter()
+        _writer.start()
+        try:
+            _writer.replay_orphan_wals()
+        except Exception:
+            # Mongo indisponible: les WAL orphelins seront rejoués au prochain démarrage
+            logger.warning("rejeu des WAL orphelins échoué, reporté au prochain démarrage", exc_info=True)
+    return _writer
+
+
+def stop_writer() -> None:
+    if _writer is not None:
+        _writer.stop()
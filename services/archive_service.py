@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import os
+import zlib
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import bson
+from pymongo import ReplaceOne, UpdateOne
+
+from database.mongo import get_db
+from services.precompressed import delete_blobs
+from services.sort_keys import backfill_sort_keys
+
+
+# Rétention par défaut (surchargée par collectivites_settings.retention_keep_last)
+DEFAULT_KEEP_LAST = int(os.getenv("ARBITRAGE_RETENTION_KEEP_LAST", "50"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARBITRAGE_ARCHIVE_BATCH", "100"))
+_CODEC = "zlib+bson"
+
+# Champs conservés dans le stub "chaud" (listes, :last, rollups, pagination)
+_STUB_FIELDS = (
+    "arbitrage_id", "collectivite_id", "mandat", "synthese", "audit", "created_at", "created_at_dt",
+    "engine_version", "triggered_by", "payload_hash", "weights", "sort_key", "official",
+)
+
+
+def _utc_now_dt() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _keep_last_for(collectivite_id: str) -> int:
+    doc = get_db().collectivites_settings.find_one(
+        {"collectivite_id": collectivite_id},
+        projection={"_id": 0, "retention_keep_last": 1},
+    )
+    value = (doc or {}).get("retention_keep_last")
+    return max(1, int(value)) if value else DEFAULT_KEEP_LAST
+
+
+def _compress(doc: Dict[str, Any]) -> bytes:
+    return zlib.compress(bson.encode(doc), 6)
+
+
+def _decompress(data: bytes) -> Dict[str, Any]:
+    return bson.decode(zlib.decompress(data))
+
+
+def rehydrate(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Si doc est un stub archivé, retourne le document complet depuis
+    arbitrages_archive (décompressé). Sinon retourne doc tel quel.
+    """
+    if not doc.get("archived"):
+        return doc
+    arc = get_db().arbitrages_archive.find_one(
+        {"arbitrage_id": doc["arbitrage_id"]},
+        projection={"_id": 0, "data": 1},
+    )
+    if not arc:
+        # Archive absente: on sert le stub (projets vides) plutôt qu'une 500
+        return doc
+    full = _decompress(arc["data"])
+    full.pop("_id", None)
+    # Les champs chauds (ex: official) font foi
+    for k in _STUB_FIELDS:
+        if k in doc:
+            full[k] = doc[k]
+    return full
+
+
+def _archive_batch(docs: List[Dict[str, Any]]) -> None:
+    db = get_db()
+    now = _utc_now_dt()
+    # 1) archive (idempotent) puis 2) stub: un crash entre les deux est sans perte
+    db.arbitrages_archive.bulk_write(
+        [
+            ReplaceOne(
+                {"arbitrage_id": d["arbitrage_id"]},
+                {
+                    "arbitrage_id": d["arbitrage_id"],
+                    "collectivite_id": d.get("collectivite_id"),
+                    "created_at_dt": d.get("created_at_dt"),
+                    "codec": _CODEC,
+                    "archived_at": now,
+                    "data": bson.Binary(_compress(d)),
+                },
+                upsert=True,
+            )
+            for d in docs
+        ],
+        ordered=False,
+    )
+
+    ops = []
+    for d in docs:
+        scores = [float(p.get("score", 0.0) or 0.0) for p in d.get("projets") or [] if isinstance(p, dict)]
+        ops.append(UpdateOne(
+            {"_id": d["_id"], "archived": {"$ne": True}},
+            {
+                "$set": {
+                    "archived": True,
+                    "archived_at": now,
+                    # Conservé pour la reconstruction des rollups
+                    "projets_stats": {"score_sum": float(sum(scores)), "score_n": len(scores)},
+                },
+                "$unset": {"projets": ""},
+            },
+        ))
+    if ops:
+        db.arbitrages.bulk_write(ops, ordered=False)
+    # 3) réponses pré-compressées: place reprise, reconstruites depuis l'archive si relues
+    delete_blobs(docs)
+
+
+def archive_collectivite(
+    collectivite_id: str,
+    keep_last: Optional[int] = None,
+    batch_size: int = ARCHIVE_BATCH_SIZE,
+    dry_run: bool = False,
+) -> int:
+    """
+    Archive les arbitrages au-delà des keep_last plus récents (hors officiels).
+    Traite par lots de batch_size. Retourne le nombre de docs archivés (dry_run:
+    candidats ayant déjà un sort_key).
+    """
+    db = get_db()
+    keep = keep_last if keep_last is not None else _keep_last_for(collectivite_id)
+    if not dry_run:
+        # Docs legacy sans sort_key: hors borne et hors filtre, jamais archivés sinon
+        backfill_sort_keys(collectivite_id)
+
+    # Borne: sort_key du keep-ième plus récent; tout ce qui est strictement plus ancien est candidat
+    boundary = list(
+        db.arbitrages.find({"collectivite_id": collectivite_id}, projection={"_id": 0, "sort_key": 1})
+        .sort([("sort_key", -1)])
+        .skip(keep - 1)
+        .limit(1)
+    )
+    if not boundary or "sort_key" not in boundary[0]:
+        return 0
+
+    filt = {
+        "collectivite_id": collectivite_id,
+        "sort_key": {"$lt": boundary[0]["sort_key"]},
+        "archived": {"$ne": True},
+        "official": {"$ne": True},
+    }
+    if dry_run:
+        return db.arbitrages.count_documents(filt)
+
+    total = 0
+    while True:
+        docs = list(db.arbitrages.find(filt).sort([("sort_key", 1)]).limit(batch_size))
+        if not docs:
+            break
+        _archive_batch(docs)
+        total += len(docs)
+    return total
+
+
+def archive_all(batch_size: int = ARCHIVE_BATCH_SIZE, dry_run: bool = False) -> Dict[str, int]:
+    out: Dict[str, int] = {}
+    for cid in get_db().arbitrages.distinct("collectivite_id"):
+        n = archive_collectivite(cid, batch_size=batch_size, dry_run=dry_run)
+        if n:
+            out[cid] = n
+    return out
+
+
+def set_official(collectivite_id: str, arbitrage_id: str, official: bool) -> Dict[str, Any]:
+    res = get_db().arbitrages.update_one(
+        {"collectivite_id": collectivite_id, "arbitrage_id": arbitrage_id},
+        {"$set": {"official": bool(official)}},
+    )
+    if res.matched_count == 0:
+        raise KeyError("Arbitrage introuvable")
+    return {"collectivite_id": collectivite_id, "arbitrage_id": arbitrage_id, "official": bool(official)}
@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import base64
+import hashlib
+import hmac
+import logging
+import os
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+import bson
+from bson.errors import BSONError
+from bson.timestamp import Timestamp
+from pymongo.errors import ConfigurationError, InvalidOperation, PyMongoError
+
+from database.mongo import get_client
+from services.metrics import CAUSAL_TOKENS
+
+
+# Cohérence causale d'une requête à l'autre: la réponse porte un jeton signé (en-tête
+# X-CC-Causal + cookie cc_causal) avec l'operationTime et le $clusterTime de la session
+# Mongo de la requête. La requête suivante qui le présente repart d'une session avancée
+# à ce point: ses lectures sur un secondaire attendent qu'il l'ait rattrapé
+# (readConcern afterClusterTime). Un utilisateur qui vient de lancer un arbitrage le
+# voit donc sur :last, quel que soit le worker, l'instance ou le secondaire servi.
+# Jetons signés avec CAUSAL_SECRET (propre à la cohérence causale, partagé par toutes les
+# instances): un jeton forgé dans le futur ferait attendre les lectures jusqu'au timeout.
+# Sans CAUSAL_SECRET, la cohérence causale est désactivée (avertissement au démarrage).
+_SECRET = os.getenv("CAUSAL_SECRET", "").strip().encode("utf-8")
+MONGO_CAUSAL_ENABLED = os.getenv("MONGO_CAUSAL_ENABLED", "1").strip() in ("1", "true", "yes")
+CAUSAL_HEADER = "X-CC-Causal"
+CAUSAL_COOKIE = "cc_causal"
+CAUSAL_COOKIE_MAX_AGE_S = int(os.getenv("CAUSAL_COOKIE_MAX_AGE_S", "3600"))
+CAUSAL_COOKIE_SECURE = os.getenv("CAUSAL_COOKIE_SECURE", "1").strip() in ("1", "true", "yes")
+_VERSION = "c1"
+_MAX_TOKEN_LEN = 1024
+
+logger = logging.getLogger("cc.causal")
+
+if MONGO_CAUSAL_ENABLED and not _SECRET:
+    MONGO_CAUSAL_ENABLED = False
+    logger.warning("CAUSAL_SECRET absent: cohérence causale (X-CC-Causal) désactivée")
+
+# Sessions non gérées (mongomock, vieux serveur): constaté une fois, plus retenté
+_unsupported = False
+
+
+class CausalState:
+    """Point causal reçu + session de la requête (démarrée au premier usage seulement)."""
+
+    __slots__ = ("operation_time", "cluster_time", "session", "failed")
+
+    def __init__(self, operation_time: Optional[Timestamp] = None, cluster_time: Optional[Dict[str, Any]] = None):
+        self.operation_time = operation_time
+        self.cluster_time = cluster_time
+        self.session = None
+        self.failed = False
+
+
+# Objet partagé (et non copié) avec le thread de la route: la session qui y est démarrée
+# est visible du middleware pour émettre le jeton de réponse
+_state: ContextVar[Optional[CausalState]] = ContextVar("cc_causal_state", default=None)
+
+
+def _sign(raw: bytes) -> str:
+    mac = hmac.new(_SECRET, raw, hashlib.sha256).digest()[:16]
+    return base64.urlsafe_b64encode(mac).decode().rstrip("=")
+
+
+def _b64decode(s: str) -> bytes:
+    return base64.urlsafe_b64decode(s + "=" * (-len(s) % 4))
+
+
+def encode_token(operation_time: Timestamp, cluster_time: Optional[Dict[str, Any]]) -> str:
+    doc: Dict[str, Any] = {"ot": operation_time}
+    if cluster_time:
+        doc["ct"] = cluster_time
+    raw = bson.encode(doc)
+    body = base64.urlsafe_b64encode(raw).decode().rstrip("=")
+    return f"{_VERSION}.{body}.{_sign(raw)}"
+
+
+def decode_token(token: str) -> tuple:
+    """(operation_time, cluster_time ou None). ValueError si jeton invalide ou altéré."""
+    try:
+        if len(token) > _MAX_TOKEN_LEN:
+            raise ValueError("taille")
+        version, body, sig = token.split(".", 2)
+        if version != _VERSION:
+            raise ValueError("version")
+        raw = _b64decode(body)
+        if not hmac.compare_digest(sig, _sign(raw)):
+            raise ValueError("signature")
+        doc = bson.decode(raw)
+        ot = doc["ot"]
+        if not isinstance(ot, Timestamp):
+            raise ValueError("operationTime")
+        return ot, doc.get("ct")
+    except (ValueError, KeyError, BSONError, TypeError):
+        raise ValueError("Jeton causal invalide")
+
+
+def open_causal(token: Optional[str]):
+    """Ouvre l'état causal de la requête; retourne (state, token ContextVar) pour close_causal()."""
+    state = CausalState()
+    if token:
+        try:
+            state.operation_time, state.cluster_time = decode_token(token)
+            CAUSAL_TOKENS.labels("received").inc()
+        except ValueError:
+            # Jeton périmé (secret changé) ou altéré: lectures sans garantie causale, pas d'erreur
+            CAUSAL_TOKENS.labels("invalid").inc()
+    return state, _state.set(state)
+
+
+def close_causal(state: CausalState, token) -> None:
+    _state.reset(token)
+    if state.session is not None:
+        try:
+            state.session.end_session()
+        except PyMongoError:
+            pass
+        state.session = None
+
+
+def causal_session():
+    """
+    Session causale de la requête en cours, à passer en session= des lectures (get_read_db)
+    et des écritures dont la requête suivante doit voir l'effet. None hors requête, sans
+    Mongo ou si les sessions ne sont pas gérées (l'opération se fait alors sans session).
+    """
+    global _unsupported
+    state = _state.get()
+    if state is None or state.failed or _unsupported:
+        return None
+    if state.session is not None:
+        return state.session
+    client = get_client()
+    if client is None:
+        state.failed = True
+        return None
+    try:
+        session = client.start_session(causal_consistency=True)
+    except (NotImplementedError, ConfigurationError, InvalidOperation) as e:
+        _unsupported = True
+        logger.warning("sessions Mongo non disponibles: lectures sans cohérence causale (%s)", e)
+        return None
+    if state.cluster_time:
+        session.advance_cluster_time(state.cluster_time)
+    if state.operation_time is not None:
+        session.advance_operation_time(state.operation_time)
+    state.session = session
+    return session
+
+
+def outgoing_token(state: CausalState) -> Optional[str]:
+    """Jeton à renvoyer si la requête a fait avancer le point causal (écriture ou lecture plus récente)."""
+    session = state.session
+    if session is None:
+        return None
+    ot = session.operation_time
+    if ot is None or (state.operation_time is not None and ot <= state.operation_time):
+        return None
+    CAUSAL_TOKENS.labels("issued").inc()
+    return encode_token(ot, session.cluster_time)
@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import csv
+import hashlib
+import io
+import json
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, TextIO
+
+from pymongo import UpdateOne
+
+from database.mongo import get_db
+from services.collectivites_index import fold
+
+
+IMPORT_BATCH_SIZE = 1000
+
+# Colonnes acceptées (COG INSEE communes, BANATIC/SIREN EPCI, exports maison)
+_ALIASES: Dict[str, tuple] = {
+    "code": ("code", "code_insee", "COM", "codgeo", "CODGEO", "siren", "SIREN", "siren_epci"),
+    "nom": ("nom", "LIBELLE", "libelle", "NCCENR", "nom_complet", "raison_sociale", "nom_epci"),
+    "departement": ("departement", "DEP", "dep", "code_departement", "dept"),
+    "region": ("region", "REG", "reg", "code_region"),
+    "population": ("population", "PMUN", "ptot", "PTOT", "pop", "total_pop_mun"),
+    "type": ("type", "TYPECOM", "nature_juridique", "nj_epci"),
+}
+
+# Champs qui entrent dans l'empreinte (delta): une modification ailleurs ne réécrit rien
+_HASHED = ("code", "nom", "departement", "region", "population", "type")
+
+
+def _utc_now_dt() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _pick(row: Dict[str, Any], field: str) -> Any:
+    for k in _ALIASES[field]:
+        v = row.get(k)
+        if v not in (None, ""):
+            return v
+    return None
+
+
+def normalize_row(row: Dict[str, Any], default_type: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Ligne brute -> document normalisé (+ clés de recherche). None si code/nom absent."""
+    code = _pick(row, "code")
+    nom = _pick(row, "nom")
+    if code is None or nom is None:
+        return None
+    nom = " ".join(str(nom).split())
+
+    pop = _pick(row, "population")
+    try:
+        pop = int(float(str(pop).replace(" ", "").replace(",", "."))) if pop is not None else None
+    except ValueError:
+        pop = None
+
+    doc: Dict[str, Any] = {
+        "code": str(code).strip(),
+        "nom": nom,
+        "departement": str(_pick(row, "departement") or "").strip() or None,
+        "region": str(_pick(row, "region") or "").strip() or None,
+        "population": pop,
+        # type imposé (commune, epci...) prioritaire: c'est lui qui délimite --prune
+        "type": str(default_type or _pick(row, "type") or "").strip() or None,
+        # Clés de recherche précalculées (même repli que l'index en mémoire)
+        "nom_folded": fold(nom),
+        "nom_lower": nom.lower(),
+    }
+    raw = json.dumps([doc[k] for k in _HASHED], ensure_ascii=False, separators=(",", ":"))
+    doc["row_hash"] = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+    return doc
+
+
+# ---------- Lecture en flux ----------
+def iter_csv(f: TextIO) -> Iterator[Dict[str, Any]]:
+    sample = f.read(64 * 1024)
+    f.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t|")
+    except csv.Error:
+        dialect = csv.excel
+    yield from csv.DictReader(f, dialect=dialect)
+
+
+def iter_json(f: TextIO, chunk_size: int = 1 << 16) -> Iterator[Dict[str, Any]]:
+    """Tableau JSON (décodé élément par élément, sans tout charger) ou NDJSON."""
+    head = f.read(1)
+    while head and head.isspace():
+        head = f.read(1)
+    if head != "[":
+        # NDJSON
+        first = head + f.readline()
+        if first.strip():
+            yield json.loads(first)
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+        return
+
+    decoder = json.JSONDecoder()
+    buf = ""
+    eof = False
+    while True:
+        buf = buf.lstrip().lstrip(",").lstrip()
+        if buf.startswith("]"):
+            return
+        try:
+            obj, end = decoder.raw_decode(buf)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            more = f.read(chunk_size)
+            eof = not more
+            buf += more
+            continue
+        yield obj
+        buf = buf[end:]
+
+
+def iter_rows(path: str, fmt: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    fmt = fmt or ("json" if path.lower().endswith((".json", ".ndjson", ".jsonl")) else "csv")
+    with io.open(path, "r", encoding="utf-8-sig", newline="") as f:
+        yield from (iter_json(f) if fmt == "json" else iter_csv(f))
+
+
+# ---------- Import ----------
+def _flush(batch: List[Dict[str, Any]], stats: Dict[str, int], dry_run: bool) -> None:
+    db = get_db()
+    # Delta: empreintes existantes du lot en une requête
+    codes = [d["code"] for d in batch]
+    existing = {
+        d["code"]: d.get("row_hash")
+        for d in db.collectivites.find({"code": {"$in": codes}}, {"_id": 0, "code": 1, "row_hash": 1})
+    }
+    now = _utc_now_dt()
+    ops = []
+    for d in batch:
+        prev = existing.get(d["code"], False)
+        if prev == d["row_hash"]:
+            stats["unchanged"] += 1
+            continue
+        stats["inserted" if prev is False else "updated"] += 1
+        ops.append(UpdateOne(
+            {"code": d["code"]},
+            {"$set": {**d, "updated_at": now}, "$setOnInsert": {"created_at": now}},
+            upsert=True,
+        ))
+    if ops and not dry_run:
+        db.collectivites.bulk_write(ops, ordered=False)
+
+
+def import_collectivites(
+    rows: Iterable[Dict[str, Any]],
+    default_type: Optional[str] = None,
+    batch_size: int = IMPORT_BATCH_SIZE,
+    prune: bool = False,
+    dry_run: bool = False,
+) -> Dict[str, int]:
+    """
+    Upsert idempotent par lots non ordonnés: seules les lignes nouvelles ou dont
+    l'empreinte a changé sont écrites. prune supprime les codes absents du fichier
+    (limité au type imposé s'il est fourni).
+    """
+    stats = {"read": 0, "invalid": 0, "duplicates": 0, "inserted": 0, "updated": 0, "unchanged": 0, "pruned": 0}
+    seen: Set[str] = set()
+    batch: List[Dict[str, Any]] = []
+    for row in rows:
+        stats["read"] += 1
+        doc = normalize_row(row, default_type=default_type)
+        if doc is None:
+            stats["invalid"] += 1
+            continue
+        if doc["code"] in seen:
+            stats["duplicates"] += 1
+            continue
+        seen.add(doc["code"])
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            _flush(batch, stats, dry_run)
+            batch = []
+    if batch:
+        _flush(batch, stats, dry_run)
+
+    if prune and seen:
+        filt: Dict[str, Any] = {"code": {"$exists": True, "$nin": list(seen)}}
+        if default_type:
+            filt["type"] = default_type
+        coll = get_db().collectivites
+        stats["pruned"] = coll.count_documents(filt) if dry_run else coll.delete_many(filt).deleted_count
+    return stats
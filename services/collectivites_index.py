@@ -0,0 +1,388 @@
+from __future__ import annotations
+
+import fcntl
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+import unicodedata
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from database.mongo import get_read_db
+
+logger = logging.getLogger("cc.collectivites_index")
+
+
+# Snapshot binaire partagé entre workers (mmap lecture seule -> pages communes)
+INDEX_PATH = os.getenv("COLLECTIVITES_INDEX_PATH", os.path.join(tempfile.gettempdir(), "cc_collectivites_index.bin"))
+REFRESH_S = float(os.getenv("COLLECTIVITES_INDEX_REFRESH_S", "60"))
+
+_MAGIC = b"CCIDX001"
+_SEP = "\x1f"
+_LIGATURES = str.maketrans({"œ": "oe", "Œ": "oe", "æ": "ae", "Æ": "ae", "ß": "ss"})
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+
+def fold(text: Optional[str]) -> str:
+    """Minuscules, sans accents ni ponctuation: 'Saint-Étienne' -> 'saint etienne'."""
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKD", str(text).translate(_LIGATURES))
+    text = "".join(ch for ch in text if not unicodedata.combining(ch)).lower()
+    return _NON_ALNUM.sub(" ", text).strip()
+
+
+def _trigrams(folded: str) -> Iterable[int]:
+    data = folded.encode("ascii")
+    for i in range(len(data) - 2):
+        yield (data[i] << 16) | (data[i + 1] << 8) | data[i + 2]
+
+
+# ---------- Construction du snapshot ----------
+def build_snapshot(docs: Iterable[Dict[str, Any]], path: str = INDEX_PATH, fingerprint: str = "") -> int:
+    """
+    Écrit le snapshot (fichier temporaire puis os.replace: les workers qui ont
+    mappé l'ancien fichier continuent de le lire). Retourne le nombre d'entrées.
+    """
+    rows: List[Tuple[str, str, str, str, int]] = []
+    for d in docs:
+        nom = str(d.get("nom") or "")
+        folded = fold(nom)
+        if not folded:
+            continue
+        pop = d.get("population") or 0
+        try:
+            pop = int(pop)
+        except (TypeError, ValueError):
+            pop = 0
+        rows.append((folded, str(d["_id"]), nom, str(d.get("departement") or ""), pop))
+    rows.sort()
+
+    blob = bytearray()
+    rec_off = [0]
+    pops: List[int] = []
+    keys: List[Tuple[bytes, int, int]] = []  # (clé ancrée sur un mot, rec, début de nom)
+    postings: Dict[int, set] = {}
+    for i, (folded, _id, nom, dep, pop) in enumerate(rows):
+        blob += _SEP.join((_id, nom, dep, folded)).encode("utf-8")
+        rec_off.append(len(blob))
+        pops.append(pop)
+        fb = folded.encode("ascii")
+        for m in re.finditer(r"(?:^| )(?=\S)", folded):
+            start = m.end()
+            keys.append((fb[start:], i, 1 if start == 0 else 0))
+        for t in _trigrams(folded):
+            postings.setdefault(t, set()).add(i)
+    keys.sort()
+
+    key_blob = bytearray()
+    key_off = [0]
+    for k, _, _ in keys:
+        key_blob += k
+        key_off.append(len(key_blob))
+
+    tri_codes = sorted(postings)
+    tri_ptr = [0]
+    tri_post: List[int] = []
+    for t in tri_codes:
+        tri_post.extend(sorted(postings[t]))
+        tri_ptr.append(len(tri_post))
+
+    sections = {
+        "rec_blob": np.frombuffer(bytes(blob), dtype=np.uint8),
+        "rec_off": np.asarray(rec_off, dtype=np.uint32),
+        "pop": np.asarray(pops, dtype=np.int64),
+        "key_blob": np.frombuffer(bytes(key_blob), dtype=np.uint8),
+        "key_off": np.asarray(key_off, dtype=np.uint32),
+        "key_rec": np.asarray([r for _, r, _ in keys], dtype=np.uint32),
+        "key_start": np.asarray([s for _, _, s in keys], dtype=np.uint8),
+        "tri_code": np.asarray(tri_codes, dtype=np.uint32),
+        "tri_ptr": np.asarray(tri_ptr, dtype=np.uint32),
+        "tri_post": np.asarray(tri_post, dtype=np.uint32),
+    }
+
+    # En-tête JSON (offsets de sections alignés sur 8 octets)
+    layout: Dict[str, List[Any]] = {}
+    offset = 0
+    for name, arr in sections.items():
+        offset = (offset + 7) & ~7
+        layout[name] = [offset, int(arr.nbytes), arr.dtype.str]
+        offset += arr.nbytes
+    header = json.dumps({
+        "n": len(rows),
+        "fingerprint": fingerprint,
+        "built_at": datetime.now(timezone.utc).isoformat(),
+        "sections": layout,
+    }).encode("utf-8")
+    base = (len(_MAGIC) + 4 + len(header) + 7) & ~7
+
+    d = os.path.dirname(path) or "."
+    fd, tmp = tempfile.mkstemp(prefix=".cc_collectivites_index.", dir=d)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_MAGIC + struct.pack("<I", len(header)) + header)
+            for name, arr in sections.items():
+                f.seek(base + layout[name][0])
+                f.write(arr.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    return len(rows)
+
+
+# ---------- Lecture (mmap) ----------
+class CollectivitesIndex:
+    def __init__(self, path: str = INDEX_PATH):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.inode = os.fstat(f.fileno()).st_ino
+        if self._mm[: len(_MAGIC)] != _MAGIC:
+            raise ValueError(f"Snapshot invalide: {path}")
+        (hlen,) = struct.unpack_from("<I", self._mm, len(_MAGIC))
+        h0 = len(_MAGIC) + 4
+        header = json.loads(self._mm[h0: h0 + hlen].decode("utf-8"))
+        base = (h0 + hlen + 7) & ~7
+        self.n: int = header["n"]
+        self.fingerprint: str = header.get("fingerprint", "")
+        self.built_at: str = header.get("built_at", "")
+
+        s: Dict[str, np.ndarray] = {}
+        for name, (off, nbytes, dtype) in header["sections"].items():
+            dt = np.dtype(dtype)
+            s[name] = np.frombuffer(self._mm, dtype=dt, count=nbytes // dt.itemsize, offset=base + off)
+        self._rec_blob, self._rec_off, self._pop = s["rec_blob"], s["rec_off"], s["pop"]
+        self._key_blob, self._key_off = s["key_blob"], s["key_off"]
+        self._key_rec, self._key_start = s["key_rec"], s["key_start"]
+        self._tri_code, self._tri_ptr, self._tri_post = s["tri_code"], s["tri_ptr"], s["tri_post"]
+        self._key_len = np.diff(self._key_off.astype(np.int64))
+
+    def _record(self, i: int) -> List[str]:
+        return bytes(self._rec_blob[self._rec_off[i]: self._rec_off[i + 1]]).decode("utf-8").split(_SEP)
+
+    def _key(self, i: int) -> bytes:
+        return bytes(self._key_blob[self._key_off[i]: self._key_off[i + 1]])
+
+    def _lower_bound(self, target: bytes) -> int:
+        lo, hi = 0, len(self._key_rec)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _prefix_hits(self, q: bytes) -> Tuple[np.ndarray, np.ndarray]:
+        """(recs, tier) des clés commençant par q: 3 exact, 2 début de nom, 1 début de mot."""
+        lo = self._lower_bound(q)
+        hi = self._lower_bound(q + b"\xff")
+        if lo >= hi:
+            return np.empty(0, np.uint32), np.empty(0, np.int8)
+        recs = self._key_rec[lo:hi]
+        start = self._key_start[lo:hi].astype(np.int8)
+        exact = (self._key_len[lo:hi] == len(q)).astype(np.int8)
+        tier = 1 + start + (start & exact)
+        # Meilleur tier par enregistrement
+        order = np.lexsort((-tier, recs))
+        recs, tier = recs[order], tier[order]
+        first = np.ones(recs.size, dtype=bool)
+        first[1:] = recs[1:] != recs[:-1]
+        return recs[first], tier[first]
+
+    def _substring_hits(self, folded: str, exclude: np.ndarray, limit: int) -> np.ndarray:
+        codes = np.fromiter(set(_trigrams(folded)), dtype=np.uint32)
+        pos = np.searchsorted(self._tri_code, codes)
+        if np.any(pos >= self._tri_code.size) or np.any(self._tri_code[np.minimum(pos, self._tri_code.size - 1)] != codes):
+            return np.empty(0, np.uint32)
+        # Intersection en partant des listes les plus courtes
+        lists = sorted(
+            (self._tri_post[self._tri_ptr[p]: self._tri_ptr[p + 1]] for p in pos.tolist()),
+            key=len,
+        )
+        cand = lists[0]
+        for other in lists[1:]:
+            cand = np.intersect1d(cand, other, assume_unique=True)
+            if cand.size == 0:
+                return cand
+        cand = np.setdiff1d(cand, exclude, assume_unique=True)
+        # Vérification (les trigrammes ne garantissent pas la contiguïté), dans l'ordre
+        # du classement final (population décroissante) jusqu'à limit résultats
+        cand = cand[np.lexsort((cand, -self._pop[cand]))]
+        out: List[int] = []
+        for i in cand.tolist():
+            if folded in self._record(i)[3]:
+                out.append(i)
+                if len(out) >= limit:
+                    break
+        return np.asarray(out, dtype=np.uint32)
+
+    def search(self, q: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Classement: exact > début de nom > début de mot > sous-chaîne, puis population."""
+        folded = fold(q)
+        if not folded or self.n == 0:
+            return []
+        recs, tier = self._prefix_hits(folded.encode("ascii"))
+        if recs.size < limit and len(folded) >= 3:
+            sub = self._substring_hits(folded, recs, limit - recs.size)
+            if sub.size:
+                recs = np.concatenate([recs, sub])
+                tier = np.concatenate([tier, np.zeros(sub.size, dtype=np.int8)])
+        if recs.size == 0:
+            return []
+        # Enregistrements triés par nom replié: rec croissant = ordre alphabétique
+        order = np.lexsort((recs, -self._pop[recs], -tier))[:limit]
+        out = []
+        for i in recs[order].tolist():
+            _id, nom, dep, _ = self._record(i)
+            out.append({"id": _id, "nom": nom, "departement": dep})
+        return out
+
+    def close(self) -> None:
+        try:
+            self._mm.close()
+        except BufferError:
+            # Vues numpy encore référencées: libéré au GC
+            pass
+
+
+# ---------- Cycle de vie (chargement + rafraîchissement) ----------
+_index: Optional[CollectivitesIndex] = None
+_index_lock = threading.Lock()
+_refresher: Optional[threading.Thread] = None
+_stop = threading.Event()
+
+
+def collection_fingerprint() -> str:
+    """Change quand la collection change (nombre de docs + dernier updated_at / _id max)."""
+    # Scans complets sur un secondaire (retard borné): le snapshot n'a pas besoin du primaire
+    db = get_read_db()
+    rows = list(db.collectivites.aggregate([
+        {"$group": {"_id": None, "n": {"$sum": 1}, "u": {"$max": "$updated_at"}, "m": {"$max": "$_id"}}},
+    ]))
+    if not rows:
+        return "0"
+    r = rows[0]
+    return f"{r['n']}|{r.get('u')}|{r.get('m')}"
+
+
+def rebuild(path: str = INDEX_PATH, force: bool = False, wait: bool = False) -> bool:
+    """
+    Reconstruit le snapshot si la collection a changé. Un seul worker à la fois (flock);
+    wait=True attend le worker en cours au lieu de rendre la main.
+    """
+    with open(path + ".lock", "a+") as lock:
+        try:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False  # un autre worker s'en charge
+        try:
+            fp = collection_fingerprint()
+            if not force and os.path.exists(path):
+                try:
+                    current = CollectivitesIndex(path)
+                    unchanged = current.fingerprint == fp
+                    current.close()
+                    if unchanged:
+                        return False
+                except (ValueError, OSError):
+                    pass
+            cursor = get_read_db().collectivites.find({}, {"nom": 1, "departement": 1, "population": 1}).batch_size(5000)
+            build_snapshot(cursor, path=path, fingerprint=fp)
+            return True
+        finally:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+
+def _reload_if_replaced(path: str = INDEX_PATH) -> None:
+    global _index
+    try:
+        inode = os.stat(path).st_ino
+    except FileNotFoundError:
+        return
+    if _index is not None and _index.inode == inode:
+        return
+    fresh = CollectivitesIndex(path)
+    with _index_lock:
+        old, _index = _index, fresh
+    if old is not None:
+        old.close()
+
+
+def get_index() -> Optional[CollectivitesIndex]:
+    """
+    Index courant; None tant que le refresher construit le premier snapshot (jamais de
+    construction dans la requête). Sans refresher (REFRESH_S <= 0): construction synchrone.
+    """
+    if _index is None:
+        with _index_lock:
+            need_build = _index is None and not os.path.exists(INDEX_PATH)
+        if need_build:
+            if _refresher is not None and _refresher.is_alive():
+                return None
+            rebuild(wait=True)
+        _reload_if_replaced()
+    return _index
+
+
+def _refresh_loop() -> None:
+    while not _stop.wait(REFRESH_S):
+        try:
+            rebuild()
+            _reload_if_replaced()
+        except Exception:
+            logger.exception("rafraîchissement de l'index échoué")
+
+
+def start_refresher() -> None:
+    """Charge le snapshot existant (démarrage rapide) et lance le rafraîchissement."""
+    global _refresher
+    if REFRESH_S <= 0 or (_refresher is not None and _refresher.is_alive()):
+        return
+    try:
+        _reload_if_replaced()
+    except (ValueError, OSError) as e:
+        logger.warning("snapshot illisible: %s", e)
+    _stop.clear()
+    # Première vérification immédiate, puis toutes les REFRESH_S secondes
+    def _run() -> None:
+        try:
+            rebuild()
+            _reload_if_replaced()
+        except Exception:
+            logger.exception("construction de l'index échouée")
+        _refresh_loop()
+
+    _refresher = threading.Thread(target=_run, name="cc-collectivites-index", daemon=True)
+    _refresher.start()
+
+
+def stop_refresher() -> None:
+    _stop.set()
+
+
+def index_stats() -> Dict[str, Any]:
+    idx = _index
+    if idx is None:
+        return {"loaded": False, "path": INDEX_PATH}
+    return {
+        "loaded": True,
+        "path": INDEX_PATH,
+        "n": idx.n,
+        "keys": int(idx._key_rec.size),
+        "trigrams": int(idx._tri_code.size),
+        "fingerprint": idx.fingerprint,
+        "built_at": idx.built_at,
+    }
@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import os
+import random
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import partial
+from typing import Any, Dict, List, Optional
+
+from pymongo.errors import PyMongoError
+
+from database.mongo import get_db
+from engine.registry import is_registered, run_timed
+from services.metrics import ENGINE_DURATION, ENGINE_SHADOW_RUNS
+
+
+# Moteur candidat exécuté en shadow après chaque run (surchargé par collectivité via
+# settings.engine_shadow_version). Jamais sur le chemin de la requête: pool dédié,
+# résultat comparé et enregistré dans engine_shadow_runs par le callback.
+ENGINE_SHADOW_VERSION = os.getenv("ENGINE_SHADOW_VERSION", "").strip()
+ENGINE_SHADOW_SAMPLE_RATE = float(os.getenv("ENGINE_SHADOW_SAMPLE_RATE", "1.0"))
+ENGINE_SHADOW_WORKERS = int(os.getenv("ENGINE_SHADOW_WORKERS", "1"))
+# Au-delà, les runs shadow sont sautés (comptés) plutôt que mis en file
+ENGINE_SHADOW_MAX_PENDING = int(os.getenv("ENGINE_SHADOW_MAX_PENDING", "8"))
+# process (défaut: hors GIL des workers HTTP) | thread
+ENGINE_SHADOW_MODE = os.getenv("ENGINE_SHADOW_MODE", "process").strip().lower()
+
+_MAX_LISTED = 50  # projets listés par catégorie de différence
+_SCORE_EPS = 1e-9
+
+logger = logging.getLogger("cc.engine_shadow")
+
+_lock = threading.Lock()
+_executor: Optional[Executor] = None
+_pending = 0
+_stats = {"submitted": 0, "completed": 0, "errors": 0, "skipped_busy": 0, "identical": 0, "different": 0, "cancelled": 0}
+
+
+def _utc_now_dt() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _get_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        if ENGINE_SHADOW_MODE == "thread":
+            _executor = ThreadPoolExecutor(max_workers=ENGINE_SHADOW_WORKERS, thread_name_prefix="cc-shadow")
+        else:
+            # spawn: pas de fork d'un worker gunicorn multi-threadé (client Mongo, locks)
+            _executor = ProcessPoolExecutor(
+                max_workers=ENGINE_SHADOW_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+    return _executor
+
+
+def stop_shadow() -> None:
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def shadow_stats() -> Dict[str, Any]:
+    return {
+        "default_candidate": ENGINE_SHADOW_VERSION or None,
+        "mode": ENGINE_SHADOW_MODE,
+        "workers": ENGINE_SHADOW_WORKERS,
+        "pending": _pending,
+        **_stats,
+    }
+
+
+def diff_outputs(primary: Dict[str, Any], candidate: Dict[str, Any]) -> Dict[str, Any]:
+    """Différences de sortie entre deux moteurs (synthèse, sélection, scores, rangs)."""
+    synthese = {
+        k: [v, candidate["synthese"].get(k)]
+        for k, v in primary["synthese"].items()
+        if candidate["synthese"].get(k) != v
+    }
+    a = {p["id"]: (rank, p) for rank, p in enumerate(primary["projets"])}
+    b = {p["id"]: (rank, p) for rank, p in enumerate(candidate["projets"])}
+    missing = sorted(set(a) - set(b))
+    extra = sorted(set(b) - set(a))
+
+    retenu_changed: List[str] = []
+    rank_changed = 0
+    max_score_delta = 0.0
+    for pid, (rank, p) in a.items():
+        other = b.get(pid)
+        if other is None:
+            continue
+        rank_b, q = other
+        if bool(p.get("retenu")) != bool(q.get("retenu")):
+            retenu_changed.append(pid)
+        if rank != rank_b:
+            rank_changed += 1
+        max_score_delta = max(max_score_delta, abs(float(p.get("score", 0.0)) - float(q.get("score", 0.0))))
+
+    identical = not (synthese or missing or extra or retenu_changed or rank_changed or max_score_delta > _SCORE_EPS)
+    return {
+        "identical": identical,
+        "synthese": synthese,
+        "retenu_changed": sorted(retenu_changed)[:_MAX_LISTED],
+        "n_retenu_changed": len(retenu_changed),
+        "n_rank_changed": rank_changed,
+        "max_score_delta": max_score_delta,
+        "missing": missing[:_MAX_LISTED],
+        "extra": extra[:_MAX_LISTED],
+    }
+
+
+def submit_shadow(
+    *,
+    candidate: Optional[str],
+    arbitrage_id: str,
+    collectivite_id: str,
+    primary_version: str,
+    primary_out: Dict[str, Any],
+    primary_s: float,
+    payload: Dict[str, Any],
+    weights: Dict[str, float],
+) -> bool:
+    """Planifie un run shadow (non bloquant). False si rien n'est planifié."""
+    global _pending
+    if not candidate or candidate == primary_version:
+        return False
+    if not is_registered(candidate):
+        logger.warning("moteur shadow inconnu: %s", candidate)
+        return False
+    if ENGINE_SHADOW_SAMPLE_RATE < 1.0 and random.random() >= ENGINE_SHADOW_SAMPLE_RATE:
+        return False
+    with _lock:
+        if _pending >= ENGINE_SHADOW_MAX_PENDING:
+            _stats["skipped_busy"] += 1
+            ENGINE_SHADOW_RUNS.labels(candidate, "skipped").inc()
+            return False
+        _pending += 1
+        _stats["submitted"] += 1
+        executor = _get_executor()
+    # Seuls les champs comparés sont retenus (pas de copie du document complet)
+    primary = {
+        "synthese": dict(primary_out["synthese"]),
+        "projets": [{"id": p["id"], "score": p["score"], "retenu": p["retenu"]} for p in primary_out["projets"]],
+    }
+    ctx = {
+        "arbitrage_id": arbitrage_id,
+        "collectivite_id": collectivite_id,
+        "primary_version": primary_version,
+        "candidate_version": candidate,
+        "primary_ms": round(primary_s * 1000.0, 3),
+        "n_projets": len(primary["projets"]),
+    }
+    try:
+        future = executor.submit(run_timed, candidate, payload, weights)
+    except RuntimeError:
+        # Pool arrêté (shutdown du worker)
+        with _lock:
+            _pending -= 1
+        return False
+    future.add_done_callback(partial(_record, ctx, primary))
+    return True
+
+
+def _record(ctx: Dict[str, Any], primary: Dict[str, Any], future: Future) -> None:
+    global _pending
+    with _lock:
+        _pending -= 1
+        # Arrêt du worker (shutdown cancel_futures): rien à comparer ni à écrire
+        if future.cancelled():
+            _stats["cancelled"] += 1
+            return
+    candidate = ctx["candidate_version"]
+    doc = {**ctx, "created_at": _utc_now_dt()}
+    try:
+        out, duration_s = future.result()
+    except Exception as e:
+        with _lock:
+            _stats["errors"] += 1
+        ENGINE_SHADOW_RUNS.labels(candidate, "error").inc()
+        doc.update({"error": f"{type(e).__name__}: {str(e)[:300]}", "identical": False})
+    else:
+        ENGINE_DURATION.labels(candidate).observe(duration_s)
+        diff = diff_outputs(primary, out)
+        outcome = "identical" if diff["identical"] else "different"
+        with _lock:
+            _stats["completed"] += 1
+            _stats[outcome] += 1
+        ENGINE_SHADOW_RUNS.labels(candidate, outcome).inc()
+        doc.update(diff)
+        doc["candidate_ms"] = round(duration_s * 1000.0, 3)
+        doc["latency_ratio"] = round(duration_s * 1000.0 / ctx["primary_ms"], 4) if ctx["primary_ms"] else None
+    try:
+        get_db().engine_shadow_runs.insert_one(doc)
+    except PyMongoError:
+        logger.warning("run shadow non enregistré (%s)", ctx["arbitrage_id"], exc_info=True)
+
+
+def shadow_report(
+    candidate: Optional[str] = None,
+    collectivite_id: Optional[str] = None,
+    only_diff: bool = False,
+    limit: int = 50,
+) -> Dict[str, Any]:
+    """Synthèse (tous runs du filtre) + derniers runs, pour la revue avant bascule."""
+    filt: Dict[str, Any] = {}
+    if candidate:
+        filt["candidate_version"] = candidate
+    if collectivite_id:
+        filt["collectivite_id"] = collectivite_id
+    db = get_db()
+    summary = list(db.engine_shadow_runs.aggregate([
+        {"$match": filt},
+        {"$group": {
+            "_id": "$candidate_version",
+            "runs": {"$sum": 1},
+            "identical": {"$sum": {"$cond": ["$identical", 1, 0]}},
+            "errors": {"$sum": {"$cond": [{"$gt": ["$error", None]}, 1, 0]}},
+            "avg_primary_ms": {"$avg": "$primary_ms"},
+            "avg_candidate_ms": {"$avg": "$candidate_ms"},
+            "avg_latency_ratio": {"$avg": "$latency_ratio"},
+            "max_score_delta": {"$max": "$max_score_delta"},
+        }},
+        {"$sort": {"_id": 1}},
+    ]))
+    items_filt = dict(filt)
+    if only_diff:
+        items_filt["identical"] = False
+    items = list(
+        db.engine_shadow_runs.find(items_filt, projection={"_id": 0})
+        .sort([("created_at", -1)])
+        .limit(max(1, min(limit, 200)))
+    )
+    return {
+        "summary": [{"candidate_version": s.pop("_id"), **s} for s in summary],
+        "items": items,
+    }
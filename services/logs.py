@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+
+from services.metrics import LOG_DROPPED
+
+
+# Les threads des requêtes ne font jamais d'I/O: ils déposent l'enregistrement dans
+# une file bornée, un thread listener sérialise et écrit sur stdout
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").strip().upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").strip().lower()  # json | text
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Contexte de la requête en cours (request_id, sub, collectivite_id, arbitrage_id...).
+# Le dict est partagé (et non copié) avec les threads du threadpool: un bind() fait
+# dans une route sync ou un service est visible du middleware d'accès
+_request_ctx: ContextVar[Optional[Dict[str, Any]]] = ContextVar("cc_request_ctx", default=None)
+
+
+def open_request(request_id: str):
+    """Ouvre le contexte d'une requête; retourne (ctx, token) pour close_request()."""
+    ctx: Dict[str, Any] = {"request_id": request_id}
+    return ctx, _request_ctx.set(ctx)
+
+
+def close_request(token) -> None:
+    _request_ctx.reset(token)
+
+
+def bind(**fields: Any) -> None:
+    """Ajoute des champs au contexte de la requête en cours (sans effet hors requête)."""
+    ctx = _request_ctx.get()
+    if ctx is not None:
+        ctx.update((k, v) for k, v in fields.items() if v is not None)
+
+
+def current_request_id() -> Optional[str]:
+    ctx = _request_ctx.get()
+    return ctx.get("request_id") if ctx else None
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler qui compte les pertes (file pleine) au lieu de bloquer l'appelant."""
+
+    def __init__(self, q: "queue.Queue"):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Rendu du message ici (les args peuvent muter après l'appel), JSON dans le listener
+        ctx = _request_ctx.get()
+        if ctx is not None and not hasattr(record, "request_id"):
+            record.request_id = ctx.get("request_id")
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            LOG_DROPPED.inc()
+
+
+class JsonFormatter(logging.Formatter):
+    """Une ligne JSON par enregistrement; extra={"fields": {...}} fusionné à la racine."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        out: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "pid": record.process,
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            out["request_id"] = request_id
+        fields = getattr(record, "fields", None)
+        if isinstance(fields, dict):
+            out.update(fields)
+        if record.exc_text:
+            out["exc"] = record.exc_text
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+_lock = threading.Lock()
+_handler: Optional[NonBlockingQueueHandler] = None
+_listener: Optional[QueueListener] = None
+
+
+def setup_logging() -> None:
+    """
+    Installe le pipeline QueueHandler -> QueueListener sur le logger racine.
+    À appeler au startup de chaque worker (après le fork: le thread listener
+    d'un master en preload n'existerait pas dans les workers).
+    """
+    global _handler, _listener
+    with _lock:
+        if _listener is not None:
+            return
+        q: "queue.Queue" = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        out = logging.StreamHandler(sys.stdout)
+        if LOG_FORMAT == "json":
+            out.setFormatter(JsonFormatter())
+        else:
+            out.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s",
+                                               defaults={"request_id": "-"}))
+        _handler = NonBlockingQueueHandler(q)
+        root = logging.getLogger()
+        root.addHandler(_handler)
+        root.setLevel(LOG_LEVEL)
+        _listener = QueueListener(q, out, respect_handler_level=False)
+        _listener.start()
+
+
+def shutdown_logging() -> None:
+    """Vide la file puis arrête le listener (shutdown du worker)."""
+    global _handler, _listener
+    with _lock:
+        if _listener is None:
+            return
+        logging.getLogger().removeHandler(_handler)
+        # File pleine: la sentinelle d'arrêt attend que le listener ait fait de la place
+        for _ in range(500):
+            try:
+                _listener.stop()
+                break
+            except queue.Full:
+                time.sleep(0.01)
+        _listener = None
+
+
+def log_stats() -> Dict[str, Any]:
+    return {
+        "enabled": _listener is not None,
+        "format": LOG_FORMAT,
+        "level": LOG_LEVEL,
+        "queue_size": _handler.queue.qsize() if _handler else 0,
+        "queue_max": LOG_QUEUE_SIZE,
+        "dropped": _handler.dropped if _handler else 0,
+    }
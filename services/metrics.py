@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import os
+from typing import Dict
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+from pymongo import monitoring
+
+
+# PROMETHEUS_MULTIPROC_DIR (lu par prometheus_client à l'import) active le mode
+# multiprocess gunicorn: chaque worker écrit ses valeurs dans des fichiers mmap
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").strip() in ("1", "true", "yes")
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR", "").strip()
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+_MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+_SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+HTTP_DURATION = Histogram(
+    "cc_http_request_duration_seconds",
+    "Durée des requêtes HTTP par route (template)",
+    ["method", "route", "status"],
+    buckets=_LATENCY_BUCKETS,
+)
+HTTP_IN_FLIGHT = Gauge(
+    "cc_http_requests_in_flight",
+    "Requêtes HTTP en cours",
+    ["method", "route"],
+    multiprocess_mode="livesum",
+)
+HTTP_REQUEST_SIZE = Histogram(
+    "cc_http_request_size_bytes",
+    "Taille des corps de requête (Content-Length)",
+    ["route"],
+    buckets=_SIZE_BUCKETS,
+)
+HTTP_RESPONSE_SIZE = Histogram(
+    "cc_http_response_size_bytes",
+    "Taille des corps de réponse",
+    ["route"],
+    buckets=_SIZE_BUCKETS,
+)
+
+ENGINE_DURATION = Histogram(
+    "cc_engine_run_duration_seconds",
+    "Durée d'un run moteur par version (primaire ou shadow)",
+    ["engine_version"],
+    buckets=_LATENCY_BUCKETS,
+)
+ENGINE_SHADOW_RUNS = Counter(
+    "cc_engine_shadow_runs_total",
+    "Runs shadow d'un moteur candidat par issue (identical, different, error, skipped)",
+    ["candidate", "outcome"],
+)
+ENGINE_PORTFOLIO_SIZE = Histogram(
+    "cc_engine_portfolio_size",
+    "Nombre de projets par run moteur",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000),
+)
+RUN_COALESCING = Counter(
+    "cc_arbitrage_run_coalescing_total",
+    "arbitrage:run par issue du single-flight (computed, coalesced_local, coalesced_remote, replayed, timeout, degraded)",
+    ["outcome"],
+)
+CAUSAL_TOKENS = Counter(
+    "cc_mongo_causal_tokens_total",
+    "Jetons de cohérence causale (X-CC-Causal / cookie): received, invalid, issued",
+    ["outcome"],
+)
+SCENARIO_PROJETS = Counter(
+    "cc_scenario_projets_total",
+    "Projets des évaluations de scénarios: scores recalculés ou repris du parent (rescored, reused)",
+    ["outcome"],
+)
+
+MONGO_DURATION = Histogram(
+    "cc_mongo_command_duration_seconds",
+    "Latence des commandes Mongo (driver) par collection et opération",
+    ["collection", "command"],
+    buckets=_MONGO_BUCKETS,
+)
+MONGO_FAILURES = Counter(
+    "cc_mongo_command_failures_total",
+    "Commandes Mongo en échec",
+    ["collection", "command"],
+)
+
+LOG_DROPPED = Counter(
+    "cc_log_records_dropped_total",
+    "Enregistrements de log perdus (file du QueueHandler pleine)",
+)
+
+
+# Commandes de service (handshake, heartbeat, sessions): non mesurées
+_IGNORED_COMMANDS = frozenset({
+    "hello", "ismaster", "isMaster", "ping", "buildinfo", "buildInfo", "saslStart", "saslContinue",
+    "endSessions",
+})
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Listener pymongo: durée mesurée par le driver (duration_micros), collection lue au started."""
+
+    def __init__(self):
+        self._collections: Dict[int, str] = {}
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        if event.command_name in _IGNORED_COMMANDS:
+            return
+        coll = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            coll = event.command.get("collection")
+        self._collections[event.request_id] = coll if isinstance(coll, str) else "-"
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        coll = self._collections.pop(event.request_id, None)
+        if coll is not None:
+            MONGO_DURATION.labels(coll, event.command_name).observe(event.duration_micros / 1e6)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        coll = self._collections.pop(event.request_id, None)
+        if coll is not None:
+            MONGO_DURATION.labels(coll, event.command_name).observe(event.duration_micros / 1e6)
+            MONGO_FAILURES.labels(coll, event.command_name).inc()
+
+
+mongo_listener = MongoCommandMetrics()
+
+
+def render_latest() -> tuple:
+    """(corps, content-type) de /metrics; agrège tous les workers en mode multiprocess."""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def mark_worker_dead(pid: int) -> None:
+    """À appeler depuis le hook gunicorn child_exit (nettoie les gauges livesum)."""
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,322 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set, TextIO, Tuple
+
+from pydantic import TypeAdapter, ValidationError
+from pymongo.errors import DuplicateKeyError
+
+from database.mongo import get_db
+from schemas.arbitrage import ProjetIn
+from services.collectivites_import import iter_csv, iter_json
+
+
+# Portefeuille stocké une fois (portfolios + projets par lots dans portfolio_chunks),
+# référencé ensuite par portfolio_id (arbitrage:run, scénarios): plus de liste
+# inline ni de revalidation à chaque run. Dédupliqué par empreinte de contenu.
+PORTFOLIO_CHUNK_SIZE = int(os.getenv("PORTFOLIO_CHUNK_SIZE", "2000"))  # projets par document (~350 Ko)
+PORTFOLIO_MAX_PROJETS = int(os.getenv("PORTFOLIO_MAX_PROJETS", "200000"))
+PORTFOLIO_UPLOAD_MAX_MB = float(os.getenv("PORTFOLIO_UPLOAD_MAX_MB", "64"))
+# Portefeuilles complets gardés par worker (immuables: pas d'invalidation)
+PORTFOLIO_CACHE_SIZE = int(os.getenv("PORTFOLIO_CACHE_SIZE", "16"))
+# Borne en projets (~1 Ko chacun en mémoire): 16 portefeuilles max épingleraient 3,2 M projets
+PORTFOLIO_CACHE_PROJETS = int(os.getenv("PORTFOLIO_CACHE_PROJETS", "200000"))
+
+_VALIDATE_BATCH = 1000  # lignes validées par appel pydantic
+_MAX_REPORTED = 20  # lignes invalides détaillées dans l'erreur
+# projets: portefeuilles antérieurs au découpage en lots (projets inline, sans source)
+_SUMMARY = {"_id": 0, "contraintes": 0, "hypotheses": 0, "n_chunks": 0, "projets": 0}
+_FIELDS = tuple(ProjetIn.model_fields)
+_projets_adapter = TypeAdapter(List[ProjetIn])
+
+
+def _summary(doc: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if doc is not None:
+        doc.setdefault("source", "json")
+    return doc
+
+
+def _utc_iso() -> str:
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def _canon(obj: Any) -> bytes:
+    return json.dumps(obj, sort_keys=True, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class LRUCache:
+    """
+    Mémo thread-safe (valeurs immuables, ne pas muter), borné en entrées et, si
+    max_projets est donné, en nombre total de projets des valeurs (put(..., n_projets)):
+    une entrée peut porter un portefeuille de PORTFOLIO_MAX_PROJETS projets.
+    """
+
+    def __init__(self, max_entries: int, max_projets: Optional[int] = None):
+        self.max_entries = max_entries
+        self.max_projets = max_projets
+        self._data: "OrderedDict[tuple, Tuple[Any, int]]" = OrderedDict()
+        self._projets = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.skipped = 0  # valeurs plus grosses que le cache entier, jamais gardées
+
+    def get(self, key: tuple) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: tuple, value: Any, n_projets: int = 0) -> None:
+        with self._lock:
+            if self.max_projets is not None and n_projets > self.max_projets:
+                self.skipped += 1
+                return
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._projets -= old[1]
+            self._data[key] = (value, n_projets)
+            self._projets += n_projets
+            while len(self._data) > self.max_entries or (
+                self.max_projets is not None and self._projets > self.max_projets
+            ):
+                _, (_, n) = self._data.popitem(last=False)
+                self._projets -= n
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._data),
+            "projets": self._projets,
+            "max_projets": self.max_projets,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "skipped": self.skipped,
+        }
+
+
+_payloads = LRUCache(PORTFOLIO_CACHE_SIZE, PORTFOLIO_CACHE_PROJETS)
+
+
+def portfolio_stats() -> Dict[str, Any]:
+    return {"payloads": _payloads.stats()}
+
+
+class _Builder:
+    """Écrit un portefeuille lot par lot; le document portfolios n'est inséré qu'à la fin."""
+
+    def __init__(self, collectivite_id: str, header: Dict[str, Any]):
+        self.collectivite_id = collectivite_id
+        self.header = header
+        self.portfolio_id = f"pf-{uuid.uuid4().hex[:12]}"
+        self.ids: Set[str] = set()
+        self.batch: List[Dict[str, Any]] = []
+        self.n_chunks = 0
+        # Empreinte identique quel que soit le mode d'envoi (JSON inline ou fichier)
+        self._hash = hashlib.sha256(_canon(header) + b"\n")
+
+    def add(self, projet: Dict[str, Any]) -> None:
+        self.ids.add(projet["id"])
+        self._hash.update(_canon(projet) + b"\n")
+        self.batch.append(projet)
+        if len(self.batch) >= PORTFOLIO_CHUNK_SIZE:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self.batch:
+            return
+        get_db().portfolio_chunks.insert_one({
+            "portfolio_id": self.portfolio_id,
+            "collectivite_id": self.collectivite_id,
+            "seq": self.n_chunks,
+            "projets": self.batch,
+        })
+        self.n_chunks += 1
+        self.batch = []
+
+    def abort(self) -> None:
+        get_db().portfolio_chunks.delete_many({"portfolio_id": self.portfolio_id})
+
+    def commit(self, created_by: str, source: str) -> Dict[str, Any]:
+        self._flush()
+        db = get_db()
+        content_hash = self._hash.hexdigest()
+        filt = {"collectivite_id": self.collectivite_id, "content_hash": content_hash}
+        existing = db.portfolios.find_one(filt, projection=_SUMMARY)
+        if existing:
+            self.abort()
+            return _summary(existing)
+        doc = {
+            "portfolio_id": self.portfolio_id,
+            "collectivite_id": self.collectivite_id,
+            **self.header,
+            "n_projets": len(self.ids),
+            "n_chunks": self.n_chunks,
+            "content_hash": content_hash,
+            "source": source,
+            "created_at": _utc_iso(),
+            "created_by": created_by,
+        }
+        try:
+            db.portfolios.insert_one(doc)
+        except DuplicateKeyError:
+            # Même contenu envoyé en concurrence: on rend le premier
+            self.abort()
+            return _summary(db.portfolios.find_one(filt, projection=_SUMMARY))
+        return {k: v for k, v in doc.items() if k not in _SUMMARY}
+
+
+def create_portfolio(collectivite_id: str, payload: Dict[str, Any], created_by: str) -> Dict[str, Any]:
+    """Portefeuille déjà validé (ArbitrageRunIn). ValueError si ids en double."""
+    projets = payload.get("projets") or []
+    ids = [p["id"] for p in projets]
+    if len(set(ids)) != len(ids):
+        raise ValueError("ids de projets en double: un scénario les désigne par id")
+    builder = _Builder(collectivite_id, {k: payload[k] for k in ("mandat", "contraintes", "hypotheses")})
+    try:
+        for p in projets:
+            builder.add(p)
+        return builder.commit(created_by, source="json")
+    except BaseException:
+        builder.abort()
+        raise
+
+
+def _csv_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    # Colonnes hors ProjetIn ignorées (exports tableur); décimales à la française acceptées
+    out = {k: (row.get(k) or "").strip() for k in _FIELDS if k in row}
+    if out.get("cout_ttc"):
+        out["cout_ttc"] = out["cout_ttc"].replace(" ", "").replace("\u00a0", "").replace(",", ".")
+    return out
+
+
+def _error_lines(e: ValidationError, first_line: int) -> List[str]:
+    lines = []
+    for err in e.errors(include_url=False):
+        loc = err.get("loc") or ()
+        line = first_line + loc[0] if loc and isinstance(loc[0], int) else first_line
+        field = ".".join(str(x) for x in loc[1:]) or "-"
+        lines.append(f"ligne {line}: {field}: {err.get('msg')}")
+    return lines
+
+
+def ingest_portfolio(
+    collectivite_id: str,
+    header: Dict[str, Any],
+    f: TextIO,
+    fmt: str,
+    created_by: str,
+) -> Dict[str, Any]:
+    """
+    Import en flux d'un fichier CSV ou NDJSON de projets: validation ProjetIn par lots
+    de _VALIDATE_BATCH lignes, écriture par lots de PORTFOLIO_CHUNK_SIZE. Mémoire bornée
+    par les lots (+ les ids). ValueError (lignes fautives, max _MAX_REPORTED) si invalide:
+    rien n'est conservé.
+    """
+    rows: Iterable[Dict[str, Any]] = (_csv_row(r) for r in iter_csv(f)) if fmt == "csv" else iter_json(f)
+    builder = _Builder(collectivite_id, header)
+    errors: List[str] = []
+    n_errors = 0
+    pending: List[Dict[str, Any]] = []
+    n_rows = 0
+    # Numéro de la première ligne du lot (en-tête CSV = ligne 1)
+    line = 2 if fmt == "csv" else 1
+
+    def _validate(batch: List[Dict[str, Any]], first_line: int) -> None:
+        nonlocal n_errors
+        try:
+            projets = _projets_adapter.validate_python(batch)
+        except ValidationError as e:
+            bad = _error_lines(e, first_line)
+            n_errors += len(bad)
+            errors.extend(bad[: max(0, _MAX_REPORTED - len(errors))])
+            return
+        for i, p in enumerate(projets):
+            if p.id in builder.ids:
+                n_errors += 1
+                if len(errors) < _MAX_REPORTED:
+                    errors.append(f"ligne {first_line + i}: id: id en double ({p.id})")
+            elif not n_errors:
+                builder.add(p.model_dump())
+            else:
+                # Fichier déjà invalide: on continue à valider pour le rapport, sans écrire
+                builder.ids.add(p.id)
+
+    try:
+        for row in rows:
+            n_rows += 1
+            if n_rows > PORTFOLIO_MAX_PROJETS:
+                raise ValueError(f"portefeuille trop grand (> {PORTFOLIO_MAX_PROJETS} projets)")
+            pending.append(row)
+            if len(pending) >= _VALIDATE_BATCH:
+                _validate(pending, line)
+                line += len(pending)
+                pending = []
+        if pending:
+            _validate(pending, line)
+        if n_errors:
+            raise ValueError(f"{n_errors} erreur(s) de validation: " + "; ".join(errors))
+        if not builder.ids:
+            raise ValueError("aucun projet dans le fichier")
+        return builder.commit(created_by, source=fmt)
+    except json.JSONDecodeError as e:
+        builder.abort()
+        raise ValueError(f"NDJSON invalide (ligne {e.lineno} du flux): {e.msg}") from e
+    except BaseException:
+        builder.abort()
+        raise
+
+
+def get_portfolio(collectivite_id: str, portfolio_id: str) -> Dict[str, Any]:
+    doc = get_db().portfolios.find_one(
+        {"collectivite_id": collectivite_id, "portfolio_id": portfolio_id}, projection=_SUMMARY
+    )
+    if not doc:
+        raise KeyError(f"Portefeuille introuvable: {portfolio_id}")
+    return _summary(doc)
+
+
+def portfolio_payload(collectivite_id: str, portfolio_id: str) -> Dict[str, Any]:
+    """Payload ArbitrageRunIn complet (mémoïsé par worker, ne pas muter). KeyError si absent."""
+    key = (collectivite_id, portfolio_id)
+    payload = _payloads.get(key)
+    if payload is not None:
+        return payload
+    db = get_db()
+    doc = db.portfolios.find_one({"collectivite_id": collectivite_id, "portfolio_id": portfolio_id})
+    if not doc:
+        raise KeyError(f"Portefeuille introuvable: {portfolio_id}")
+    projets: List[Dict[str, Any]] = []
+    if "projets" in doc:
+        # Portefeuille ancien format: projets inline, pas de lots
+        projets.extend(doc["projets"])
+    else:
+        for chunk in db.portfolio_chunks.find({"portfolio_id": portfolio_id}, projection={"_id": 0, "projets": 1}).sort("seq", 1):
+            projets.extend(chunk["projets"])
+    payload = {k: doc[k] for k in ("mandat", "contraintes", "hypotheses")}
+    payload["projets"] = projets
+    _payloads.put(key, payload, len(projets))
+    return payload
+
+
+def resolve_run_payload(collectivite_id: str, ref: Dict[str, Any]) -> Dict[str, Any]:
+    """Payload d'un arbitrage:run par référence (portfolio_id + surcharges éventuelles)."""
+    base = portfolio_payload(collectivite_id, ref["portfolio_id"])
+    return {
+        "mandat": ref.get("mandat") or base["mandat"],
+        "contraintes": ref.get("contraintes") or base["contraintes"],
+        "hypotheses": ref.get("hypotheses") or base["hypotheses"],
+        "projets": list(base["projets"]),
+    }
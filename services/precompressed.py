@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import gzip
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from bson import Binary
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+try:
+    import brotli
+except ImportError:  # gzip seul
+    brotli = None
+
+from database.mongo import get_db, get_read_db
+from schemas.arbitrage import ArbitrageRunOut
+
+
+# Un arbitrage est immuable une fois écrit: sa réponse JSON est compressée une seule
+# fois (niveaux max, coût payé au premier accès), stockée dans arbitrages_blobs et
+# gardée en LRU par worker. Le middleware de compression ne la recompresse jamais.
+# Blobs purgés par TTL (PRECOMPRESSED_RETENTION_DAYS, index dans ensure_indexes) et à
+# l'archivage de l'arbitrage; reconstruits au besoin.
+PRECOMPRESSED_ENABLED = os.getenv("PRECOMPRESSED_ENABLED", "1").strip() in ("1", "true", "yes")
+PRECOMPRESSED_CACHE_MB = float(os.getenv("PRECOMPRESSED_CACHE_MB", "64"))
+_GZIP_LEVEL = 9
+_BROTLI_QUALITY = 9  # 10-11: x5 à x10 plus lent pour ~3% de gain
+
+BLOB_VERSION = 1  # à incrémenter si la forme de ArbitrageRunOut change
+
+
+class Blob:
+    __slots__ = ("size", "gzip", "br")
+
+    def __init__(self, size: int, gz: bytes, br: Optional[bytes]):
+        self.size = size
+        self.gzip = gz
+        self.br = br
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.gzip) + len(self.br or b"")
+
+    def body_for(self, encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+        """(corps, content-encoding) pour l'encodage négocié; identité = gunzip."""
+        if encoding == "br" and self.br is not None:
+            return self.br, "br"
+        if encoding in ("br", "gzip"):
+            return self.gzip, "gzip"
+        return gzip.decompress(self.gzip), None
+
+
+def build_blob(out: Dict[str, Any]) -> Blob:
+    body = ArbitrageRunOut.model_validate(out).model_dump_json().encode("utf-8")
+    br = brotli.compress(body, quality=_BROTLI_QUALITY) if brotli is not None else None
+    return Blob(len(body), gzip.compress(body, compresslevel=_GZIP_LEVEL, mtime=0), br)
+
+
+class _BlobCache:
+    """LRU borné en octets (compressés) par worker."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[str, Blob]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.store_hits = 0
+        self.builds = 0
+
+    def get(self, key: str) -> Optional[Blob]:
+        with self._lock:
+            blob = self._data.get(key)
+            if blob is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+            return blob
+
+    def put(self, key: str, blob: Blob) -> None:
+        if blob.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            self._data[key] = blob
+            self._bytes += blob.nbytes
+            while self._bytes > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "store_hits": self.store_hits,
+            "builds": self.builds,
+        }
+
+
+_cache = _BlobCache(int(PRECOMPRESSED_CACHE_MB * 1024 * 1024))
+
+
+def precompressed_stats() -> Dict[str, Any]:
+    return {"enabled": PRECOMPRESSED_ENABLED, "brotli": brotli is not None, **_cache.stats()}
+
+
+def _blob_key(collectivite_id: str, arbitrage_id: str) -> str:
+    return f"{collectivite_id}:{arbitrage_id}"
+
+
+def delete_blobs(docs: List[Dict[str, Any]]) -> None:
+    """Supprime les blobs stockés des arbitrages (collectivite_id, arbitrage_id) donnés."""
+    keys = [_blob_key(d.get("collectivite_id"), d["arbitrage_id"]) for d in docs]
+    if keys:
+        get_db().arbitrages_blobs.delete_many({"_id": {"$in": keys}})
+
+
+def _load_stored(key: str) -> Optional[Blob]:
+    # Blob immuable par clé: un secondaire en retard ne fait que manquer le cache (reconstruit)
+    doc = get_read_db().arbitrages_blobs.find_one({"_id": key, "v": BLOB_VERSION})
+    if not doc:
+        return None
+    br = doc.get("br")
+    return Blob(int(doc["size"]), bytes(doc["gzip"]), bytes(br) if br is not None else None)
+
+
+def _store(key: str, blob: Blob) -> None:
+    try:
+        get_db().arbitrages_blobs.replace_one(
+            {"_id": key},
+            {
+                "v": BLOB_VERSION,
+                "size": blob.size,
+                "gzip": Binary(blob.gzip),
+                "br": Binary(blob.br) if blob.br is not None else None,
+                "created_at": datetime.now(timezone.utc),
+            },
+            upsert=True,
+        )
+    except (DuplicateKeyError, PyMongoError):
+        # Stockage best-effort: le blob sera reconstruit au prochain accès
+        pass
+
+
+def get_blob(collectivite_id: str, arbitrage_id: str, loader: Callable[[], Dict[str, Any]]) -> Blob:
+    """
+    Blob pré-compressé de la réponse ArbitrageRunOut: LRU worker, puis arbitrages_blobs,
+    puis loader() (lève KeyError si l'arbitrage n'existe pas) + compression + stockage.
+    """
+    key = _blob_key(collectivite_id, arbitrage_id)
+    blob = _cache.get(key)
+    if blob is not None:
+        return blob
+    blob = _load_stored(key)
+    if blob is not None:
+        _cache.store_hits += 1
+    else:
+        blob = build_blob(loader())
+        _cache.builds += 1
+        _store(key, blob)
+    _cache.put(key, blob)
+    return blob
+
@@ -0,0 +1,258 @@
+from __future__ import annotations
+
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+import pymongo
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+import database.mongo as mongo
+from engine.registry import get_engine
+from services.sort_keys import backfill_sort_keys
+
+
+# Bail Mongo pour la réconciliation des index (une seule instance par déploiement)
+INDEX_LEASE_TTL_S = float(os.getenv("INDEX_LEASE_TTL_S", "300"))
+# Ping Mongo mis en cache pour /ready (la sonde App Gateway ne touche jamais Mongo)
+READY_PING_INTERVAL_S = float(os.getenv("READY_PING_INTERVAL_S", "5"))
+READY_PING_TIMEOUT_S = float(os.getenv("READY_PING_TIMEOUT_S", "2"))
+# Au-delà, le dernier ping réussi est considéré périmé
+READY_PING_MAX_AGE_S = float(os.getenv("READY_PING_MAX_AGE_S", "30"))
+# Réconciliation des index en erreur: retentée avec un délai doublé à chaque échec (plafonné)
+INDEX_RETRY_BASE_S = float(os.getenv("INDEX_RETRY_BASE_S", "30"))
+INDEX_RETRY_MAX_S = float(os.getenv("INDEX_RETRY_MAX_S", "600"))
+
+logger = logging.getLogger("cc.readiness")
+
+_INSTANCE = uuid.uuid4().hex[:6]
+
+
+def lease_owner() -> str:
+    # pid lu à l'appel: avec preload_app, le module est importé dans le master avant le fork
+    return f"{socket.gethostname()}:{os.getpid()}:{_INSTANCE}"
+
+_WARMUP_PAYLOAD = {
+    "mandat": "warmup",
+    "contraintes": {"budget_investissement_max": 1000.0, "seuil_capacite_desendettement_ans": 12.0},
+    "hypotheses": {
+        "taux_subventions_moyen": 0.2,
+        "inflation_travaux": 0.02,
+        "annee_reference": 2025,
+        "epargne_brute_annuelle": 100.0,
+        "encours_dette_initial": 10.0,
+    },
+    "projets": [
+        {"id": "w1", "nom": "warmup", "cout_ttc": 100.0, "priorite": "elevee",
+         "impact_climat": "fort", "impact_education": "moyen", "annee_realisation": 2026},
+    ],
+}
+
+
+def _utc_now_dt() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _deploy_id() -> str:
+    return os.getenv("DEPLOY_SHA", "").strip() or os.getenv("RENDER_GIT_COMMIT", "").strip() or "unknown"
+
+
+# ---------- Rapport de démarrage ----------
+def _process_age_s() -> float:
+    """Âge du process (Linux, /proc): les marques incluent le temps d'import de l'app."""
+    try:
+        with open("/proc/self/stat", "r") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime", "r") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+class StartupReport:
+    def __init__(self):
+        # t0 = lancement du process (et non import de ce module)
+        self.t0 = time.perf_counter() - _process_age_s()
+        self.marks: Dict[str, float] = {}
+        self.first_request: Optional[Dict[str, Any]] = None
+        self._first_lock = threading.Lock()
+
+    def mark(self, name: str) -> None:
+        self.marks[name] = round((time.perf_counter() - self.t0) * 1000.0, 2)
+
+    def first_request_done(self, path: str, duration_s: float) -> None:
+        if self.first_request is not None:
+            return
+        with self._first_lock:
+            if self.first_request is None:
+                self.first_request = {
+                    "path": path,
+                    "at_ms": round((time.perf_counter() - self.t0) * 1000.0, 2),
+                    "duration_ms": round(duration_s * 1000.0, 2),
+                }
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"pid": os.getpid(), "marks_ms": dict(self.marks), "first_request": self.first_request}
+
+
+startup_report = StartupReport()
+
+
+# ---------- Réconciliation des index sous bail ----------
+def acquire_lease(name: str, ttl_s: float = INDEX_LEASE_TTL_S) -> bool:
+    db = mongo.get_db()
+    now = _utc_now_dt()
+    owner = lease_owner()
+    try:
+        db.leases.find_one_and_update(
+            {"_id": name, "$or": [{"expires_at": {"$lt": now}}, {"owner": owner}]},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=ttl_s), "acquired_at": now}},
+            upsert=True,
+        )
+        return True
+    except DuplicateKeyError:
+        # Bail détenu (et valide) par une autre instance
+        return False
+
+
+def release_lease(name: str) -> None:
+    mongo.get_db().leases.delete_one({"_id": name, "owner": lease_owner()})
+
+
+def reconcile_indexes(force: bool = False) -> str:
+    """
+    ensure_indexes() puis backfill des sort_key legacy, une fois par déploiement
+    (DEPLOY_SHA) pour tout le parc.
+    Retourne "done", "skipped" (déjà fait pour ce déploiement) ou "busy" (bail pris ailleurs).
+    """
+    db = mongo.get_db()
+    deploy = _deploy_id()
+    marker = db.system_state.find_one({"_id": "indexes"}) or {}
+    if not force and deploy != "unknown" and marker.get("deploy") == deploy:
+        return "skipped"
+    if not acquire_lease("ensure_indexes"):
+        return "busy"
+    try:
+        # Re-vérifie sous le bail (une autre instance a pu finir entre-temps)
+        marker = db.system_state.find_one({"_id": "indexes"}) or {}
+        if not force and deploy != "unknown" and marker.get("deploy") == deploy:
+            return "skipped"
+        t = time.perf_counter()
+        mongo.ensure_indexes()
+        # Pagination keyset: docs antérieurs à sort_key, hors du chemin de lecture
+        backfilled = backfill_sort_keys()
+        db.system_state.update_one(
+            {"_id": "indexes"},
+            {"$set": {
+                "deploy": deploy,
+                "sort_keys_backfilled": backfilled,
+                "done_at": _utc_now_dt(),
+                "owner": lease_owner(),
+                "duration_ms": round((time.perf_counter() - t) * 1000.0, 1),
+            }},
+            upsert=True,
+        )
+        return "done"
+    finally:
+        release_lease("ensure_indexes")
+
+
+# ---------- Readiness ----------
+class Readiness:
+    def __init__(self):
+        self.mongo_ok = False
+        self.mongo_checked_at: Optional[float] = None  # monotonic du dernier ping réussi
+        self.mongo_latency_ms: Optional[float] = None
+        self.mongo_error: Optional[str] = None
+        self.engine_warm = False
+        self.indexes: str = "pending"
+        self._index_failures = 0
+        self._index_retry_at = 0.0  # monotonic
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def ping(self) -> None:
+        client = mongo._client
+        if client is None:
+            self.mongo_ok, self.mongo_error = False, "MONGO_URI manquant"
+            return
+        t = time.perf_counter()
+        try:
+            with pymongo.timeout(READY_PING_TIMEOUT_S):
+                client.admin.command("ping")
+            self.mongo_latency_ms = round((time.perf_counter() - t) * 1000.0, 2)
+            self.mongo_checked_at = time.monotonic()
+            self.mongo_ok, self.mongo_error = True, None
+        except PyMongoError as e:
+            self.mongo_ok, self.mongo_error = False, str(e)[:200]
+
+    def warm_engine(self) -> None:
+        # Moteur par défaut du registre (les versions épinglées se chauffent au premier run)
+        get_engine()(_WARMUP_PAYLOAD, {"poids_climat": 0.4, "poids_education": 0.3, "poids_financier": 0.3})
+        self.engine_warm = True
+
+    def reconcile(self) -> None:
+        try:
+            self.indexes = reconcile_indexes()
+            self._index_failures = 0
+        except Exception as e:
+            self.indexes = f"error: {str(e)[:200]}"
+            self._index_failures += 1
+            delay = min(INDEX_RETRY_MAX_S, INDEX_RETRY_BASE_S * 2 ** (self._index_failures - 1))
+            self._index_retry_at = time.monotonic() + delay
+            logger.warning("réconciliation des index échouée (%d), nouvel essai dans %.0f s: %s",
+                           self._index_failures, delay, e)
+
+    def _index_due(self) -> bool:
+        if self.indexes in ("pending", "busy"):
+            return True
+        return self.indexes.startswith("error") and time.monotonic() >= self._index_retry_at
+
+    def _run(self) -> None:
+        self.ping()
+        try:
+            self.warm_engine()
+        except Exception:
+            logger.exception("warmup moteur échoué")
+        startup_report.mark("ready_checks_done")
+        if self.mongo_ok:
+            self.reconcile()
+            startup_report.mark("indexes_" + self.indexes.split(":")[0])
+        while not self._stop.wait(READY_PING_INTERVAL_S):
+            self.ping()
+            if self.mongo_ok and self._index_due():
+                self.reconcile()
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="cc-readiness", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def status(self) -> Dict[str, Any]:
+        fresh = (
+            self.mongo_ok
+            and self.mongo_checked_at is not None
+            and (time.monotonic() - self.mongo_checked_at) <= READY_PING_MAX_AGE_S
+        )
+        age = None if self.mongo_checked_at is None else round(time.monotonic() - self.mongo_checked_at, 1)
+        return {
+            # Les index ne conditionnent pas la readiness (réconciliés en arrière-plan)
+            "ready": bool(fresh and self.engine_warm),
+            "mongo": {"ok": fresh, "latency_ms": self.mongo_latency_ms, "age_s": age, "error": self.mongo_error},
+            "engine_warm": self.engine_warm,
+            "indexes": self.indexes,
+        }
+
+
+readiness = Readiness()
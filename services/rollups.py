@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from pymongo import ASCENDING, UpdateOne
+
+from database.mongo import get_db
+
+
+# Rollups: compteurs additifs par (collectivite_id, bucket, period_start);
+# les moyennes sont dérivées à la lecture (sum / count).
+BUCKETS = ("day", "month")
+_KEY = ("collectivite_id", "bucket", "period_start")
+
+
+def _period_start(dt: datetime, bucket: str) -> datetime:
+    dt = dt.astimezone(timezone.utc) if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+    if bucket == "month":
+        return datetime(dt.year, dt.month, 1, tzinfo=timezone.utc)
+    return datetime(dt.year, dt.month, dt.day, tzinfo=timezone.utc)
+
+
+def _doc_metrics(doc: Dict[str, Any]) -> Dict[str, float]:
+    synthese = doc.get("synthese") or {}
+    scores = [float(p.get("score", 0.0) or 0.0) for p in doc.get("projets") or [] if isinstance(p, dict)]
+    return {
+        "budget_max_sum": float(synthese.get("budget_max", 0.0) or 0.0),
+        "budget_retenu_sum": float(synthese.get("budget_retenu", 0.0) or 0.0),
+        "nb_projets_total_sum": int(synthese.get("nb_projets_total", 0) or 0),
+        "nb_projets_retenus_sum": int(synthese.get("nb_projets_retenus", 0) or 0),
+        "score_sum": float(sum(scores)),
+        "score_n": len(scores),
+    }
+
+
+def apply_rollups(docs: Iterable[Dict[str, Any]]) -> None:
+    """
+    Mise à jour incrémentale (upsert $inc/$min/$max) des rollups jour + mois
+    pour des arbitrages fraîchement insérés. Un seul bulk_write non ordonné.
+    """
+    ops: List[UpdateOne] = []
+    for doc in docs:
+        created_at_dt = doc.get("created_at_dt")
+        if not isinstance(created_at_dt, datetime):
+            continue
+        m = _doc_metrics(doc)
+        for bucket in BUCKETS:
+            ops.append(UpdateOne(
+                {
+                    "collectivite_id": doc["collectivite_id"],
+                    "bucket": bucket,
+                    "period_start": _period_start(created_at_dt, bucket),
+                },
+                {
+                    "$inc": {"count": 1, **m},
+                    "$min": {"budget_retenu_min": m["budget_retenu_sum"]},
+                    "$max": {"budget_retenu_max": m["budget_retenu_sum"], "last_created_at_dt": created_at_dt},
+                },
+                upsert=True,
+            ))
+    if ops:
+        get_db().arbitrages_rollups.bulk_write(ops, ordered=False)
+
+
+def _rebuild_pipeline(bucket: str, match: Dict[str, Any], into: str, rebuild_id: str) -> List[Dict[str, Any]]:
+    parts: Dict[str, Any] = {
+        "year": {"$year": "$created_at_dt"},
+        "month": {"$month": "$created_at_dt"},
+    }
+    if bucket == "day":
+        parts["day"] = {"$dayOfMonth": "$created_at_dt"}
+
+    return [
+        {"$match": {**match, "created_at_dt": {"$type": "date"}}},
+        {"$project": {
+            "_id": 0,
+            "collectivite_id": 1,
+            "created_at_dt": 1,
+            "period_start": {"$dateFromParts": parts},
+            "budget_max": {"$ifNull": ["$synthese.budget_max", 0]},
+            "budget_retenu": {"$ifNull": ["$synthese.budget_retenu", 0]},
+            "nb_projets_total": {"$ifNull": ["$synthese.nb_projets_total", 0]},
+            "nb_projets_retenus": {"$ifNull": ["$synthese.nb_projets_retenus", 0]},
+            # Stubs archivés: projets retirés, stats conservées dans projets_stats
+            "score_sum": {"$ifNull": ["$projets_stats.score_sum", {"$sum": {"$ifNull": ["$projets.score", []]}}]},
+            "score_n": {"$ifNull": ["$projets_stats.score_n", {"$size": {"$ifNull": ["$projets", []]}}]},
+        }},
+        {"$group": {
+            "_id": {"collectivite_id": "$collectivite_id", "period_start": "$period_start"},
+            "count": {"$sum": 1},
+            "budget_max_sum": {"$sum": "$budget_max"},
+            "budget_retenu_sum": {"$sum": "$budget_retenu"},
+            "budget_retenu_min": {"$min": "$budget_retenu"},
+            "budget_retenu_max": {"$max": "$budget_retenu"},
+            "nb_projets_total_sum": {"$sum": "$nb_projets_total"},
+            "nb_projets_retenus_sum": {"$sum": "$nb_projets_retenus"},
+            "score_sum": {"$sum": "$score_sum"},
+            "score_n": {"$sum": "$score_n"},
+            "last_created_at_dt": {"$max": "$created_at_dt"},
+        }},
+        {"$project": {
+            "_id": 0,
+            "collectivite_id": "$_id.collectivite_id",
+            "bucket": {"$literal": bucket},
+            "period_start": "$_id.period_start",
+            "count": 1,
+            "budget_max_sum": 1,
+            "budget_retenu_sum": 1,
+            "budget_retenu_min": 1,
+            "budget_retenu_max": 1,
+            "nb_projets_total_sum": 1,
+            "nb_projets_retenus_sum": 1,
+            "score_sum": 1,
+            "score_n": 1,
+            "last_created_at_dt": 1,
+            "rebuild_id": {"$literal": rebuild_id},
+        }},
+        {"$merge": {"into": into, "on": list(_KEY), "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ]
+
+
+def rebuild_rollups(collectivite_ids: Optional[Sequence[str]] = None) -> int:
+    """
+    Backfill complet (pipeline d'agrégation + $merge) depuis db.arbitrages.
+    Recalcul dans une collection temporaire, puis report d'un seul $merge (replace)
+    dans arbitrages_rollups: les lectures ne voient jamais de rollups vides et les
+    $inc live ne sont exposés qu'à la durée du report, pas à celle de l'agrégation.
+    Les rollups du périmètre sans arbitrage (purgés) sont ensuite supprimés.
+    Retourne le nombre de rollups du périmètre.
+    """
+    db = get_db()
+    match: Dict[str, Any] = {}
+    if collectivite_ids:
+        match["collectivite_id"] = {"$in": list(collectivite_ids)}
+
+    rebuild_id = uuid.uuid4().hex
+    started = datetime.now(timezone.utc)
+    tmp = db[f"arbitrages_rollups_rebuild_{rebuild_id[:12]}"]
+    # $merge on=... exige un index unique sur la cible
+    tmp.create_index([(k, ASCENDING) for k in _KEY], unique=True)
+    try:
+        for bucket in BUCKETS:
+            db.arbitrages.aggregate(_rebuild_pipeline(bucket, match, tmp.name, rebuild_id), allowDiskUse=True)
+        tmp.aggregate([
+            {"$project": {"_id": 0}},
+            {"$merge": {
+                "into": "arbitrages_rollups",
+                "on": list(_KEY),
+                "whenMatched": "replace",
+                "whenNotMatched": "insert",
+            }},
+        ])
+        # Non reconstruits et sans arbitrage depuis le début du rebuild (un upsert live est récent)
+        db.arbitrages_rollups.delete_many(
+            {**match, "rebuild_id": {"$ne": rebuild_id}, "last_created_at_dt": {"$lt": started}}
+        )
+    finally:
+        tmp.drop()
+    return db.arbitrages_rollups.count_documents(match)
+
+
+def _rollup_out(doc: Dict[str, Any]) -> Dict[str, Any]:
+    count = int(doc.get("count", 0) or 0)
+    score_n = int(doc.get("score_n", 0) or 0)
+    period_start = doc["period_start"]
+    if isinstance(period_start, datetime):
+        period_start = period_start.replace(tzinfo=None).isoformat() + "Z"
+    return {
+        "period_start": period_start,
+        "nb_arbitrages": count,
+        "budget_max_avg": float(doc.get("budget_max_sum", 0.0)) / count if count else 0.0,
+        "budget_retenu_avg": float(doc.get("budget_retenu_sum", 0.0)) / count if count else 0.0,
+        "budget_retenu_min": float(doc.get("budget_retenu_min", 0.0) or 0.0),
+        "budget_retenu_max": float(doc.get("budget_retenu_max", 0.0) or 0.0),
+        "nb_projets_retenus_avg": float(doc.get("nb_projets_retenus_sum", 0)) / count if count else 0.0,
+        "score_avg": float(doc.get("score_sum", 0.0)) / score_n if score_n else 0.0,
+    }
+
+
+def get_rollups(
+    collectivite_id: str,
+    bucket: str = "day",
+    date_from: datetime | None = None,
+    date_to: datetime | None = None,
+) -> Dict[str, Any]:
+    """Lecture en une requête sur l'index (collectivite_id, bucket, period_start)."""
+    if bucket not in BUCKETS:
+        raise ValueError(f"bucket invalide: {bucket}")
+    db = get_db()
+    filt: Dict[str, Any] = {"collectivite_id": collectivite_id, "bucket": bucket}
+    rng: Dict[str, Any] = {}
+    if date_from is not None:
+        rng["$gte"] = _period_start(date_from, bucket)
+    if date_to is not None:
+        rng["$lte"] = date_to
+    if rng:
+        filt["period_start"] = rng
+
+    cursor = db.arbitrages_rollups.find(filt, projection={"_id": 0}).sort("period_start", 1)
+    return {
+        "collectivite_id": collectivite_id,
+        "bucket": bucket,
+        "items": [_rollup_out(d) for d in cursor],
+    }
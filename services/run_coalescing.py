@@ -0,0 +1,269 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from database.mongo import get_db
+from services.arbitrage_service import _payload_hash, get_arbitrage_by_id, get_run_settings
+from services.causal import causal_session
+from services.metrics import RUN_COALESCING
+from services.readiness import acquire_lease, release_lease
+
+
+# Single-flight des arbitrage:run identiques (double-clic, retries du front ou de l'App
+# Gateway): clé (collectivite_id, payload_hash, poids, moteur). Dans un worker, les
+# arrivées suivantes attendent le calcul en cours; entre workers et instances, un bail
+# Mongo court désigne le calculateur et run_flights publie l'arbitrage_id obtenu.
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "1").strip() in ("1", "true", "yes")
+# Au-delà, un run en attente calcule lui-même (jamais bloqué par un calculateur disparu)
+SINGLE_FLIGHT_WAIT_S = float(os.getenv("SINGLE_FLIGHT_WAIT_S", "30"))
+SINGLE_FLIGHT_LEASE_S = float(os.getenv("SINGLE_FLIGHT_LEASE_S", "30"))
+# Runs du même worker en attente du calculateur: plus longtemps que lui (attente du bail
+# + calcul sous bail), pour ne jamais calculer en parallèle d'un calculateur actif
+SINGLE_FLIGHT_FOLLOWER_WAIT_S = float(
+    os.getenv("SINGLE_FLIGHT_FOLLOWER_WAIT_S", str(SINGLE_FLIGHT_WAIT_S + 2 * SINGLE_FLIGHT_LEASE_S))
+)
+SINGLE_FLIGHT_POLL_S = float(os.getenv("SINGLE_FLIGHT_POLL_S", "0.05"))
+# Fenêtre pendant laquelle un run terminé est encore partagé (arrivées juste après la fin)
+SINGLE_FLIGHT_REUSE_S = float(os.getenv("SINGLE_FLIGHT_REUSE_S", "10"))
+# Durée de vie d'une Idempotency-Key (index TTL sur idempotency_keys.created_at)
+IDEMPOTENCY_TTL_H = float(os.getenv("IDEMPOTENCY_TTL_H", "24"))
+IDEMPOTENCY_KEY_MAX_LEN = 200
+
+logger = logging.getLogger("cc.run_coalescing")
+
+
+def _utc_now_dt() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[BaseException] = None
+
+
+_lock = threading.Lock()
+_inflight: Dict[str, _Call] = {}
+
+
+def flight_key(collectivite_id: str, payload: Dict[str, Any]) -> str:
+    weights, engine_version = get_run_settings(collectivite_id)
+    raw = json.dumps(
+        [collectivite_id, _payload_hash(payload), sorted(weights.items()), engine_version],
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _published(collectivite_id: str, key: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+    """(run publié, sortie lisible ou None)."""
+    # Même session causale: la lecture (secondaire) de l'arbitrage attend la publication lue ici
+    doc = get_db().run_flights.find_one(
+        {"_id": key, "expires_at": {"$gt": _utc_now_dt()}}, session=causal_session()
+    )
+    if not doc:
+        return False, None
+    try:
+        return True, get_arbitrage_by_id(collectivite_id, doc["arbitrage_id"])
+    except KeyError:
+        # Write-behind de l'autre worker pas encore écrit: publié, à relire au prochain tour
+        return True, None
+
+
+def _distributed(collectivite_id: str, key: str, compute: Callable[[], Dict[str, Any]]) -> Tuple[Dict[str, Any], str]:
+    lease = f"run:{key}"
+    deadline = time.monotonic() + SINGLE_FLIGHT_WAIT_S
+    try:
+        while True:
+            published, out = _published(collectivite_id, key)
+            if out is not None:
+                return out, "coalesced_remote"
+            # Publié mais pas encore lisible: le bail est libre, mais le prendre referait le calcul
+            if not published and acquire_lease(lease, ttl_s=SINGLE_FLIGHT_LEASE_S):
+                # Le précédent détenteur a pu publier entre la lecture et la prise du bail
+                published, out = _published(collectivite_id, key)
+                if not published:
+                    break
+                release_lease(lease)
+                if out is not None:
+                    return out, "coalesced_remote"
+            if time.monotonic() > deadline:
+                logger.warning("single-flight: attente dépassée, calcul sans coalescence")
+                return compute(), "timeout"
+            time.sleep(SINGLE_FLIGHT_POLL_S)
+    except PyMongoError:
+        logger.warning("single-flight: coordination Mongo indisponible, calcul local", exc_info=True)
+        return compute(), "degraded"
+
+    try:
+        out = compute()
+        try:
+            get_db().run_flights.replace_one(
+                {"_id": key},
+                {
+                    "arbitrage_id": out["arbitrage_id"],
+                    "collectivite_id": collectivite_id,
+                    "expires_at": _utc_now_dt() + timedelta(seconds=SINGLE_FLIGHT_REUSE_S),
+                },
+                upsert=True,
+            )
+        except PyMongoError:
+            logger.warning("single-flight: résultat non publié", exc_info=True)
+        return out, "computed"
+    finally:
+        try:
+            release_lease(lease)
+        except PyMongoError:
+            pass  # expire tout seul (SINGLE_FLIGHT_LEASE_S)
+
+
+def run_single_flight(
+    collectivite_id: str,
+    payload: Dict[str, Any],
+    compute: Callable[[], Dict[str, Any]],
+) -> Tuple[Dict[str, Any], str]:
+    """
+    (sortie, issue) où issue vaut "computed", "coalesced_local", "coalesced_remote",
+    "timeout", "degraded" ou "disabled". compute() n'est appelé que par le calculateur:
+    il doit prendre lui-même le slot moteur (les runs en attente n'en occupent pas).
+    """
+    if not SINGLE_FLIGHT_ENABLED:
+        return compute(), "disabled"
+    key = flight_key(collectivite_id, payload)
+    with _lock:
+        call = _inflight.get(key)
+        leader = call is None
+        if leader:
+            call = _inflight[key] = _Call()
+
+    if not leader:
+        if not call.done.wait(SINGLE_FLIGHT_FOLLOWER_WAIT_S):
+            RUN_COALESCING.labels("timeout").inc()
+            return compute(), "timeout"
+        RUN_COALESCING.labels("coalesced_local").inc()
+        if call.error is not None:
+            raise call.error
+        return call.result, "coalesced_local"
+
+    try:
+        call.result, outcome = _distributed(collectivite_id, key, compute)
+        RUN_COALESCING.labels(outcome).inc()
+        return call.result, outcome
+    except BaseException as e:
+        call.error = e
+        raise
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+        call.done.set()
+
+
+# ---------- Idempotency-Key ----------
+# Clé réservée (status "pending") avant le calcul, complétée (status "done" + arbitrage_id)
+# après: deux requêtes concurrentes avec la même clé ne calculent jamais toutes les deux.
+
+def _idem_id(collectivite_id: str, sub: str, idempotency_key: str) -> str:
+    return f"{collectivite_id}:{sub}:{idempotency_key}"
+
+
+def _replay(collectivite_id: str, rec: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    try:
+        out = get_arbitrage_by_id(collectivite_id, rec["arbitrage_id"])
+    except KeyError:
+        # Arbitrage purgé depuis: la clé est rejouée comme nouvelle
+        return None
+    RUN_COALESCING.labels("replayed").inc()
+    return out
+
+
+def reserve_idempotency_key(
+    collectivite_id: str, sub: str, idempotency_key: str, payload: Dict[str, Any]
+) -> Optional[Dict[str, Any]]:
+    """
+    Réserve la clé avant le calcul. Retourne la sortie de l'arbitrage déjà créé pour
+    cette clé (rejeu), ou None si la réservation est acquise: l'appelant calcule puis
+    appelle complete_idempotency_key (ou release_idempotency_key en cas d'échec).
+    ValueError si la clé a déjà servi pour un autre payload; TimeoutError si une autre
+    requête la détient encore après SINGLE_FLIGHT_WAIT_S.
+    """
+    if not idempotency_key or len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LEN:
+        raise ValueError(f"Idempotency-Key vide ou trop longue (max {IDEMPOTENCY_KEY_MAX_LEN})")
+    coll = get_db().idempotency_keys
+    key_id = _idem_id(collectivite_id, sub, idempotency_key)
+    payload_hash = _payload_hash(payload)
+    deadline = time.monotonic() + SINGLE_FLIGHT_WAIT_S
+    while True:
+        try:
+            coll.insert_one({
+                "_id": key_id,
+                "payload_hash": payload_hash,
+                "status": "pending",
+                "created_at": _utc_now_dt(),
+            })
+            return None
+        except DuplicateKeyError:
+            pass
+        rec = coll.find_one({"_id": key_id}, session=causal_session())
+        if rec is None:
+            continue  # libérée entre-temps: nouvel essai de réservation
+        if rec["payload_hash"] != payload_hash:
+            raise ValueError("Idempotency-Key déjà utilisée avec un autre payload")
+        if rec.get("arbitrage_id"):
+            out = _replay(collectivite_id, rec)
+            if out is not None:
+                return out
+            # Reprise de la clé (arbitrage purgé)
+            if coll.update_one(
+                {"_id": key_id, "arbitrage_id": rec["arbitrage_id"]},
+                {"$set": {"status": "pending", "created_at": _utc_now_dt()}, "$unset": {"arbitrage_id": ""}},
+            ).modified_count:
+                return None
+            continue
+        # Réservation d'une requête en cours: attente de son résultat
+        stale = _utc_now_dt() - timedelta(seconds=SINGLE_FLIGHT_WAIT_S + SINGLE_FLIGHT_LEASE_S)
+        created_at = rec.get("created_at")
+        if created_at is not None and created_at.replace(tzinfo=timezone.utc) < stale:
+            # Détenteur disparu (crash) sans libérer la clé: reprise
+            if coll.update_one(
+                {"_id": key_id, "status": "pending", "created_at": created_at},
+                {"$set": {"created_at": _utc_now_dt()}},
+            ).modified_count:
+                return None
+            continue
+        if time.monotonic() > deadline:
+            raise TimeoutError("Idempotency-Key en cours de traitement par une autre requête")
+        time.sleep(SINGLE_FLIGHT_POLL_S)
+
+
+def complete_idempotency_key(collectivite_id: str, sub: str, idempotency_key: str, arbitrage_id: str) -> None:
+    try:
+        get_db().idempotency_keys.update_one(
+            {"_id": _idem_id(collectivite_id, sub, idempotency_key)},
+            {"$set": {"status": "done", "arbitrage_id": arbitrage_id}},
+            session=causal_session(),
+        )
+    except PyMongoError:
+        logger.warning("Idempotency-Key non enregistrée (%s)", arbitrage_id, exc_info=True)
+
+
+def release_idempotency_key(collectivite_id: str, sub: str, idempotency_key: str) -> None:
+    """Run échoué (429, 503, erreur): la clé redevient libre pour un retry."""
+    try:
+        get_db().idempotency_keys.delete_one(
+            {"_id": _idem_id(collectivite_id, sub, idempotency_key), "status": "pending"}
+        )
+    except PyMongoError:
+        # Reprise possible après expiration (reserve_idempotency_key)
+        logger.warning("Idempotency-Key non libérée", exc_info=True)
@@ -0,0 +1,249 @@
+from __future__ import annotations
+
+import os
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic import ValidationError
+
+from database.mongo import get_db
+from engine.arbitrage_v2 import ENGINE_VERSION as V2_0, rescorer_delta, scorer_projets, selectionner
+from engine.registry import get_engine
+from schemas.arbitrage import ProjetIn
+from services.arbitrage_service import get_run_settings
+from services.metrics import SCENARIO_PROJETS
+from services.portfolio_service import LRUCache, portfolio_payload
+
+
+# Scénarios "what if": le portefeuille de base est stocké une fois (portfolio_service), un
+# scénario n'en garde que l'écart (ajouts, retraits, surcharges), éventuellement
+# chaîné à un scénario parent. Tout est immuable: le portefeuille complet n'est
+# matérialisé qu'au calcul, les projets inchangés partagent les dicts du parent et
+# leurs scores triés sont repris tels quels (seuls les projets du delta sont rescorés).
+SCENARIO_MAX_DEPTH = int(os.getenv("SCENARIO_MAX_DEPTH", "8"))
+# Ajouts + retraits + surcharges d'un scénario (au-delà: créer un portefeuille)
+SCENARIO_MAX_DELTA = int(os.getenv("SCENARIO_MAX_DELTA", "5000"))
+# Portefeuilles matérialisés / listes scorées gardés par worker (pas d'invalidation: immuables),
+# bornés en entrées et en projets (un portefeuille peut compter PORTFOLIO_MAX_PROJETS projets)
+SCENARIO_CACHE_SIZE = int(os.getenv("SCENARIO_CACHE_SIZE", "64"))
+SCENARIO_CACHE_PROJETS = int(os.getenv("SCENARIO_CACHE_PROJETS", "200000"))
+
+def _utc_iso() -> str:
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+_payloads = LRUCache(SCENARIO_CACHE_SIZE, SCENARIO_CACHE_PROJETS)
+_scored = LRUCache(SCENARIO_CACHE_SIZE, SCENARIO_CACHE_PROJETS)
+
+
+def scenario_stats() -> Dict[str, Any]:
+    return {"payloads": _payloads.stats(), "scored": _scored.stats()}
+
+
+def _is_portfolio(node_id: str) -> bool:
+    return node_id.startswith("pf-")
+
+
+def _parent_of(doc: Dict[str, Any]) -> str:
+    return doc.get("parent_scenario_id") or doc["portfolio_id"]
+
+
+def _budget(payload: Dict[str, Any]) -> float:
+    return float(payload["contraintes"]["budget_investissement_max"])
+
+
+def _scenario_doc(collectivite_id: str, scenario_id: str) -> Dict[str, Any]:
+    doc = get_db().scenarios.find_one(
+        {"collectivite_id": collectivite_id, "scenario_id": scenario_id}, projection={"_id": 0}
+    )
+    if not doc:
+        raise KeyError(f"Scénario introuvable: {scenario_id}")
+    return doc
+
+
+# ---------- matérialisation ----------
+
+def _apply_delta(base: Dict[str, Any], doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Portefeuille du scénario: ordre du parent conservé, ajouts en fin (cf. rescorer_delta)."""
+    delta = doc["delta"]
+    removed = set(delta["removed"])
+    overrides = delta["overrides"]
+    projets: List[Dict[str, Any]] = []
+    for p in base["projets"]:
+        if p["id"] in removed:
+            continue
+        ov = overrides.get(p["id"])
+        # Copie à l'écriture: seuls les projets surchargés sont dupliqués
+        projets.append({**p, **ov} if ov else p)
+    projets.extend(delta["added"])
+    return {
+        "mandat": doc.get("mandat") or base["mandat"],
+        "contraintes": doc.get("contraintes") or base["contraintes"],
+        "hypotheses": doc.get("hypotheses") or base["hypotheses"],
+        "projets": projets,
+    }
+
+
+def _payload(collectivite_id: str, node_id: str) -> Dict[str, Any]:
+    """Portefeuille complet d'un portefeuille de base ou d'un scénario (mémoïsé, ne pas muter)."""
+    key = (collectivite_id, node_id)
+    payload = _payloads.get(key)
+    if payload is not None:
+        return payload
+    if _is_portfolio(node_id):
+        # Déjà mémoïsé par portfolio_service
+        return portfolio_payload(collectivite_id, node_id)
+    doc = _scenario_doc(collectivite_id, node_id)
+    payload = _apply_delta(_payload(collectivite_id, _parent_of(doc)), doc)
+    _payloads.put(key, payload, len(payload["projets"]))
+    return payload
+
+
+def _check_delta(base: Dict[str, Any], delta: Dict[str, Any]) -> None:
+    size = len(delta["added"]) + len(delta["removed"]) + len(delta["overrides"])
+    if size > SCENARIO_MAX_DELTA:
+        raise ValueError(f"delta trop grand ({size} > {SCENARIO_MAX_DELTA}): créer un portefeuille")
+    by_id = {p["id"]: p for p in base["projets"]}
+    removed = set(delta["removed"])
+    unknown = sorted((removed | set(delta["overrides"])) - set(by_id))
+    if unknown:
+        raise ValueError(f"projets absents de la base: {unknown[:20]}")
+    both = sorted(removed & set(delta["overrides"]))
+    if both:
+        raise ValueError(f"projets à la fois retirés et surchargés: {both[:20]}")
+    added = [p["id"] for p in delta["added"]]
+    clash = sorted({pid for pid in added if pid in by_id and pid not in removed})
+    if clash or len(set(added)) != len(added):
+        raise ValueError(f"ids ajoutés déjà présents ou en double: {clash[:20]}")
+    for pid, ov in delta["overrides"].items():
+        try:
+            ProjetIn.model_validate({**by_id[pid], **ov})
+        except ValidationError as e:
+            raise ValueError(f"surcharge invalide pour {pid}: {e}") from e
+
+
+# ---------- scénarios ----------
+
+def create_scenario(collectivite_id: str, body: Dict[str, Any], created_by: str) -> Dict[str, Any]:
+    """KeyError si la base n'existe pas, ValueError si le delta ne s'applique pas."""
+    parent_id = body.get("parent_scenario_id")
+    if parent_id:
+        parent = _scenario_doc(collectivite_id, parent_id)
+        portfolio_id = parent["portfolio_id"]
+        depth = int(parent["depth"]) + 1
+        if depth > SCENARIO_MAX_DEPTH:
+            raise ValueError(f"profondeur max atteinte ({SCENARIO_MAX_DEPTH}): brancher depuis un ancêtre")
+    else:
+        portfolio_id = body["portfolio_id"]
+        depth = 1
+    base = _payload(collectivite_id, parent_id or portfolio_id)
+    _check_delta(base, body["delta"])
+
+    doc: Dict[str, Any] = {
+        "scenario_id": f"sc-{uuid.uuid4().hex[:12]}",
+        "collectivite_id": collectivite_id,
+        "name": body["name"],
+        "portfolio_id": portfolio_id,
+        "parent_scenario_id": parent_id,
+        "depth": depth,
+        "delta": body["delta"],
+        "created_at": _utc_iso(),
+        "created_by": created_by,
+    }
+    for field in ("mandat", "contraintes", "hypotheses"):
+        if body.get(field) is not None:
+            doc[field] = body[field]
+    payload = _apply_delta(base, doc)
+    doc["n_projets"] = len(payload["projets"])
+    get_db().scenarios.insert_one(doc)
+    doc.pop("_id", None)
+    # Souvent évalué juste après: matérialisation déjà faite
+    _payloads.put((collectivite_id, doc["scenario_id"]), payload, len(payload["projets"]))
+    return doc
+
+
+def get_scenario(collectivite_id: str, scenario_id: str, materialize: bool = False) -> Dict[str, Any]:
+    doc = _scenario_doc(collectivite_id, scenario_id)
+    if materialize:
+        doc["materialized"] = _payload(collectivite_id, scenario_id)
+    return doc
+
+
+def list_scenarios(collectivite_id: str, portfolio_id: Optional[str] = None, limit: int = 100) -> Dict[str, Any]:
+    filt: Dict[str, Any] = {"collectivite_id": collectivite_id}
+    if portfolio_id:
+        filt["portfolio_id"] = portfolio_id
+    items = list(
+        get_db().scenarios.find(filt, projection={"_id": 0})
+        .sort([("created_at", -1)])
+        .limit(max(1, min(limit, 500)))
+    )
+    return {"collectivite_id": collectivite_id, "items": items}
+
+
+def materialize_scenario(collectivite_id: str, scenario_id: str) -> Dict[str, Any]:
+    """Payload ArbitrageRunIn complet du scénario (copie superficielle, pour run_arbitrage)."""
+    payload = _payload(collectivite_id, scenario_id)
+    return {**payload, "projets": list(payload["projets"])}
+
+
+def _scored_for(
+    collectivite_id: str, node_id: str, budget_max: float, weights: Dict[str, float]
+) -> Tuple[List[Dict[str, Any]], str, int]:
+    """(projets scorés triés, mode, nb rescorés pour ce noeud) — reprend les scores du parent si possible."""
+    key = (collectivite_id, node_id, budget_max, tuple(sorted(weights.items())))
+    scored = _scored.get(key)
+    if scored is not None:
+        return scored, "cache", 0
+    payload = _payload(collectivite_id, node_id)
+    scored, mode, rescored = None, "full", len(payload["projets"])
+    if not _is_portfolio(node_id):
+        doc = _scenario_doc(collectivite_id, node_id)
+        parent_id = _parent_of(doc)
+        # Le score financier dépend du budget: un budget surchargé impose un calcul complet
+        if _budget(_payload(collectivite_id, parent_id)) == budget_max:
+            base, _, _ = _scored_for(collectivite_id, parent_id, budget_max, weights)
+            changed = set(doc["delta"]["overrides"]) | {p["id"] for p in doc["delta"]["added"]}
+            scored = rescorer_delta(base, payload["projets"], changed, budget_max, weights)
+            mode, rescored = "delta", len(changed)
+    if scored is None:
+        scored = scorer_projets(payload["projets"], budget_max, weights)
+    SCENARIO_PROJETS.labels("rescored").inc(rescored)
+    SCENARIO_PROJETS.labels("reused").inc(len(scored) - rescored)
+    _scored.put(key, scored, len(scored))
+    return scored, mode, rescored
+
+
+def scenario_calc(
+    collectivite_id: str, scenario_id: str, weights: Dict[str, float], engine_version: str
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """(sortie moteur, reuse) du scénario: scores des projets inchangés repris du parent (moteur 2.0)."""
+    payload = _payload(collectivite_id, scenario_id)
+    budget_max = _budget(payload)
+    n = len(payload["projets"])
+    if engine_version == V2_0:
+        scored, mode, rescored = _scored_for(collectivite_id, scenario_id, budget_max, weights)
+        calc = selectionner(payload["mandat"], scored, budget_max)
+    else:
+        # Moteur épinglé sans scores réutilisables: calcul complet
+        calc = get_engine(engine_version)(payload, weights)
+        mode, rescored = "full", n
+    return calc, {"mode": mode, "rescored": rescored, "reused": n - rescored}
+
+
+def evaluate_scenario(collectivite_id: str, scenario_id: str) -> Dict[str, Any]:
+    """Arbitrage du scénario sans persistance (exploration); :run pour l'enregistrer."""
+    doc = _scenario_doc(collectivite_id, scenario_id)
+    weights, engine_version = get_run_settings(collectivite_id)
+    calc, reuse = scenario_calc(collectivite_id, scenario_id, weights, engine_version)
+    return {
+        "scenario_id": scenario_id,
+        "collectivite_id": collectivite_id,
+        "portfolio_id": doc["portfolio_id"],
+        "mandat": calc["mandat"],
+        "engine_version": engine_version,
+        "synthese": calc["synthese"],
+        "projets": calc["projets"],
+        "reuse": reuse,
+    }
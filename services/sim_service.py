@@ -0,0 +1,514 @@
+from __future__ import annotations
+
+import logging
+import os
+import statistics
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from pymongo.errors import PyMongoError
+
+from database.mongo import get_db
+from engine.registry import engine_versions
+from services.arbitrage_writer import get_writer
+
+
+# Nombre d'arbitrages récents pris en compte pour les indicateurs
+SIM_HISTORY = int(os.getenv("SIM_HISTORY", "12"))
+# Filet de sécurité inter-workers: l'invalidation est locale au process
+SIM_CACHE_TTL_S = float(os.getenv("SIM_CACHE_TTL_S", "60"))
+# Entrées mémoïsées par worker (LRU); seules les collectivités avec historique ou fixture y entrent
+SIM_MEMO_SIZE = int(os.getenv("SIM_MEMO_SIZE", "4096"))
+
+logger = logging.getLogger("cc.sim")
+
+# Démo: collectivités de référence servies tant qu'elles n'ont pas d'historique
+SIM_FIXTURES: Dict[str, Dict[str, Any]] = {
+    "lyon": {
+        "label": "Ville de Lyon",
+        "ieb": 74,
+        "iep": 69,
+        "ics": 62,
+        "delta_ism": -3,
+        "volatilite": 31,
+        "signaux_faibles": 2,
+        "confidence": "moyenne",
+        "weights": {"b": 0.42, "p": 0.33, "s": 0.25},
+        "risks": [
+            "Tension sur le phasage budgétaire",
+            "Retards multi-lots sur projets structurants",
+            "Charge d'exécution des services élevée",
+        ],
+    },
+    "paris": {
+        "label": "Ville de Paris",
+        "ieb": 78,
+        "iep": 73,
+        "ics": 66,
+        "delta_ism": -1,
+        "volatilite": 27,
+        "signaux_faibles": 2,
+        "confidence": "moyenne",
+        "weights": {"b": 0.40, "p": 0.35, "s": 0.25},
+        "risks": [
+            "Complexité d'exécution sur portefeuille dense",
+            "Sensibilité calendrier",
+            "Arbitrages inter-dépendants",
+        ],
+    },
+    "marseille": {
+        "label": "Ville de Marseille",
+        "ieb": 64,
+        "iep": 58,
+        "ics": 54,
+        "delta_ism": -6,
+        "volatilite": 39,
+        "signaux_faibles": 3,
+        "confidence": "faible",
+        "weights": {"b": 0.43, "p": 0.32, "s": 0.25},
+        "risks": [
+            "Volatilité d'exécution élevée",
+            "Risque de dérive coût/délai",
+            "Capacité de pilotage sous tension",
+        ],
+    },
+}
+
+
+def sim_norm(cid: Optional[str]) -> str:
+    cid = (cid or "lyon").strip().lower()
+    return cid if cid else "lyon"
+
+
+def zone_ism(score: int) -> str:
+    if score >= 75:
+        return "favorable"
+    if score >= 55:
+        return "sous_controle"
+    return "critique"
+
+
+def zone_irm(score: int) -> str:
+    if score < 30:
+        return "faible"
+    if score < 60:
+        return "vigilance"
+    return "eleve"
+
+
+def projection_status(ism: int, irm: int, delta_ism: int) -> str:
+    if irm >= 60 or delta_ism <= -5:
+        return "Sous tension"
+    if ism >= 75 and irm < 30:
+        return "Stable"
+    return "Vigilance"
+
+
+def compute_ism(cfg: Dict[str, Any]) -> int:
+    w = cfg["weights"]
+    return int(round((w["b"] * int(cfg["ieb"])) + (w["p"] * int(cfg["iep"])) + (w["s"] * int(cfg["ics"]))))
+
+
+def compute_irm(delta_ism: int, volatilite: int, signaux: int) -> int:
+    return int(round(max(0, min(100, (max(0, -delta_ism) * 4.0) + (volatilite * 0.55) + (signaux * 9.0)))))
+
+
+def build_payload(cid: str, cfg: Dict[str, Any], source: str) -> Dict[str, Any]:
+    """Payload exécutif (ISM/IRM/zones/projection) à partir des drivers de cfg."""
+    ieb = int(cfg["ieb"])
+    iep = int(cfg["iep"])
+    ics = int(cfg["ics"])
+    ism = compute_ism(cfg)
+
+    delta_ism = int(cfg["delta_ism"])
+    volatilite = int(cfg["volatilite"])
+    signaux = int(cfg["signaux_faibles"])
+    irm = compute_irm(delta_ism, volatilite, signaux)
+
+    if delta_ism >= 2:
+        trend = "Hausse"
+    elif delta_ism <= -2:
+        trend = "Baisse"
+    else:
+        trend = "Stable"
+
+    return {
+        "collectivite_id": cid,
+        "collectivite_label": cfg["label"],
+        "drivers": {
+            "ieb": ieb,
+            "iep": iep,
+            "ics": ics,
+        },
+        "ism": {
+            "score": ism,
+            "trend": trend,
+            "confidence": cfg["confidence"],
+            "zone": zone_ism(ism),
+        },
+        "irm": {
+            "score": irm,
+            "zone": zone_irm(irm),
+        },
+        "projection": {
+            "status": projection_status(ism, irm, delta_ism),
+            "delta_ism": delta_ism,
+            "volatilite": volatilite,
+            "signaux_faibles": signaux,
+            "horizon_days": 90,
+        },
+        "risks": {
+            "top": list(cfg["risks"][:3]),
+        },
+        "meta": {
+            "source": source,
+            "generated_at": datetime.utcnow().isoformat() + "Z",
+            "nb_arbitrages": int(cfg.get("nb_arbitrages", 0)),
+        },
+    }
+
+
+# ---------- Drivers depuis l'historique ----------
+def _clip(v: float) -> int:
+    return int(round(max(0.0, min(100.0, v))))
+
+
+def _run_metrics(doc: Dict[str, Any]) -> Dict[str, float]:
+    s = doc.get("synthese") or {}
+    budget_max = float(s.get("budget_max", 0.0) or 0.0)
+    budget_retenu = float(s.get("budget_retenu", 0.0) or 0.0)
+    nb_total = int(s.get("nb_projets_total", 0) or 0)
+    nb_retenus = int(s.get("nb_projets_retenus", 0) or 0)
+
+    projets = doc.get("projets")
+    if isinstance(projets, list):
+        scores = [float(p.get("score", 0.0) or 0.0) for p in projets if isinstance(p, dict)]
+        score_sum, score_n = sum(scores), len(scores)
+    else:
+        # Stub archivé
+        stats = doc.get("projets_stats") or {}
+        score_sum, score_n = float(stats.get("score_sum", 0.0)), int(stats.get("score_n", 0))
+
+    return {
+        "utilisation": budget_retenu / budget_max if budget_max > 0 else 0.0,
+        "budget_restant_ratio": (budget_max - budget_retenu) / budget_max if budget_max > 0 else 0.0,
+        "retenus_ratio": nb_retenus / nb_total if nb_total else 0.0,
+        "score_mean": score_sum / score_n if score_n else 0.0,
+        "budget_retenu": budget_retenu,
+    }
+
+
+def _weights_from_settings(settings: Dict[str, Any]) -> Dict[str, float]:
+    """
+    Pondération ISM dérivée des poids de scoring de la collectivité:
+    budget <- poids_financier, portefeuille <- climat + éducation, stabilité fixe (0.25).
+    """
+    fin = float(settings.get("poids_financier", 0.3))
+    proj = float(settings.get("poids_climat", 0.4)) + float(settings.get("poids_education", 0.3))
+    total = fin + proj
+    if total <= 0:
+        return {"b": 0.42, "p": 0.33, "s": 0.25}
+    return {"b": 0.75 * fin / total, "p": 0.75 * proj / total, "s": 0.25}
+
+
+def _drivers(runs: List[Dict[str, float]]) -> Tuple[int, int, int]:
+    last = runs[0]
+    # IEB: exécution budgétaire = taux d'utilisation de l'enveloppe
+    ieb = _clip(100.0 * last["utilisation"])
+    # IEP: qualité du portefeuille = score moyen des projets
+    iep = _clip(100.0 * last["score_mean"])
+    # ICS: cohérence/stabilité = 100 - coefficient de variation du budget retenu
+    budgets = [r["budget_retenu"] for r in runs]
+    mean = statistics.fmean(budgets) if budgets else 0.0
+    cv = statistics.pstdev(budgets) / mean if len(budgets) > 1 and mean > 0 else 0.0
+    ics = _clip(100.0 * (1.0 - cv))
+    return ieb, iep, ics
+
+
+def derive_config(
+    cid: str,
+    docs: List[Dict[str, Any]],
+    settings: Dict[str, Any],
+    label: Optional[str] = None,
+) -> Optional[Dict[str, Any]]:
+    """docs: arbitrages du plus récent au plus ancien. None si historique vide."""
+    if not docs:
+        return None
+    runs = [_run_metrics(d) for d in docs]
+    weights = _weights_from_settings(settings)
+
+    ieb, iep, ics = _drivers(runs)
+    cfg: Dict[str, Any] = {"ieb": ieb, "iep": iep, "ics": ics, "weights": weights}
+    ism = compute_ism(cfg)
+
+    if len(runs) > 1:
+        prev_ieb, prev_iep, prev_ics = _drivers(runs[1:])
+        prev_ism = compute_ism({"ieb": prev_ieb, "iep": prev_iep, "ics": prev_ics, "weights": weights})
+        delta_ism = ism - prev_ism
+        volatilite = _clip(100.0 * statistics.pstdev([r["retenus_ratio"] for r in runs]) * 2.0)
+    else:
+        delta_ism, volatilite = 0, 0
+
+    risks: List[str] = []
+    if runs[0]["budget_restant_ratio"] < 0.05:
+        risks.append("Enveloppe d'investissement quasi saturée")
+    if runs[0]["retenus_ratio"] < 0.5:
+        risks.append("Moins de la moitié des projets financés")
+    if len(runs) > 1 and runs[0]["score_mean"] < runs[1]["score_mean"] - 0.05:
+        risks.append("Dégradation du score moyen du portefeuille")
+    if volatilite >= 35:
+        risks.append("Volatilité élevée des arbitrages successifs")
+    if delta_ism <= -5:
+        risks.append("Baisse marquée de l'indice de maîtrise")
+
+    n = len(docs)
+    cfg.update({
+        "label": label or cid,
+        "delta_ism": delta_ism,
+        "volatilite": volatilite,
+        "signaux_faibles": len(risks),
+        "confidence": "forte" if n >= 10 else ("moyenne" if n >= 3 else "faible"),
+        "risks": risks or ["Aucun signal faible détecté"],
+        "nb_arbitrages": n,
+    })
+    return cfg
+
+
+# Score des projets résumé côté serveur (même forme que le stub archivé): jamais les tableaux
+_HISTORY_FIELDS = {
+    "_id": 0,
+    "collectivite_id": 1,
+    "arbitrage_id": 1,
+    "sort_key": 1,
+    "synthese": 1,
+    "projets_stats": {"$cond": [
+        {"$isArray": "$projets"},
+        {"score_sum": {"$sum": "$projets.score"}, "score_n": {"$size": "$projets"}},
+        "$projets_stats",
+    ]},
+}
+
+
+def _merge_pending(cid: str, docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # Read-your-writes avec le write-behind
+    writer = get_writer()
+    pending = writer.pending_last(cid) if writer is not None else None
+    if pending is not None and all(d.get("arbitrage_id") != pending["arbitrage_id"] for d in docs):
+        docs = [pending] + docs[: SIM_HISTORY - 1]
+    return docs
+
+
+def _load_histories(cids: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+    """Historique récent de plusieurs collectivités en un seul aller-retour Mongo."""
+    db = get_db()
+    out: Dict[str, List[Dict[str, Any]]] = {cid: [] for cid in cids}
+    if len(cids) == 1:
+        cid = cids[0]
+        out[cid] = list(db.arbitrages.aggregate([
+            {"$match": {"collectivite_id": cid, "engine_version": {"$in": engine_versions()}}},
+            {"$sort": {"sort_key": -1}},
+            {"$limit": SIM_HISTORY},
+            {"$project": _HISTORY_FIELDS},
+        ]))
+    else:
+        # $topN (MongoDB >= 5.2): SIM_HISTORY docs retenus par groupe, jamais tout l'historique
+        pipeline = [
+            {"$match": {"collectivite_id": {"$in": cids}, "engine_version": {"$in": engine_versions()}}},
+            {"$project": _HISTORY_FIELDS},
+            {"$group": {"_id": "$collectivite_id", "docs": {
+                "$topN": {"n": SIM_HISTORY, "sortBy": {"sort_key": -1}, "output": "$$ROOT"},
+            }}},
+        ]
+        for row in db.arbitrages.aggregate(pipeline, allowDiskUse=True):
+            out[row["_id"]] = row["docs"]
+    return {cid: _merge_pending(cid, docs) for cid, docs in out.items()}
+
+
+def _load_settings(cids: List[str]) -> Dict[str, Dict[str, Any]]:
+    cursor = get_db().collectivites_settings.find({"collectivite_id": {"$in": cids}}, projection={"_id": 0})
+    return {d["collectivite_id"]: d for d in cursor}
+
+
+# ---------- Mémoïsation ----------
+class _SimEntry:
+    __slots__ = ("collectivite_id", "cfg", "source", "generated_at", "expires_at")
+
+    def __init__(self, collectivite_id: str, cfg: Dict[str, Any], source: str, expires_at: float):
+        self.collectivite_id = collectivite_id
+        self.cfg = cfg
+        self.source = source
+        self.generated_at = datetime.utcnow().isoformat() + "Z"
+        self.expires_at = expires_at
+
+
+_memo: "OrderedDict[str, _SimEntry]" = OrderedDict()
+_memo_lock = threading.Lock()
+memo_stats = {"hits": 0, "misses": 0, "invalidations": 0, "evictions": 0}
+
+
+_FIXTURE_SOURCE = "sim_local_v1_fixture"
+
+
+def _fixture_entry(cid: str, expires_at: float) -> Optional[_SimEntry]:
+    fixture = SIM_FIXTURES.get(cid.lower())
+    if fixture is None:
+        return None
+    return _SimEntry(cid.lower(), fixture, _FIXTURE_SOURCE, expires_at)
+
+
+def _compute_entries(cids: List[str], expires_at: float) -> Dict[str, _SimEntry]:
+    """Entrées des collectivités avec historique (ou fixture de démo); les autres sont absentes."""
+    try:
+        histories = _load_histories(cids)
+        settings = _load_settings(cids)
+    except RuntimeError:
+        # Mongo non configuré (dev local): fixtures
+        histories, settings = {}, {}
+    except PyMongoError as e:
+        # Mongo injoignable: fixtures seulement (non mémoïsées), sinon indisponible
+        if any(cid.lower() not in SIM_FIXTURES for cid in cids):
+            raise ConnectionError("historique d'arbitrages indisponible") from e
+        logger.warning("sim: Mongo indisponible, fixtures servies", exc_info=True)
+        return {cid: _fixture_entry(cid, 0.0) for cid in cids}
+
+    out: Dict[str, _SimEntry] = {}
+    for cid in cids:
+        fixture = SIM_FIXTURES.get(cid.lower())
+        cfg = derive_config(cid, histories.get(cid, []), settings.get(cid, {}), label=(fixture or {}).get("label"))
+        entry = _SimEntry(cid, cfg, "arbitrages_v1", expires_at) if cfg is not None else _fixture_entry(cid, expires_at)
+        if entry is not None:
+            out[cid] = entry
+    return out
+
+
+def get_entries(collectivite_ids: List[str]) -> Dict[str, _SimEntry]:
+    """
+    Drivers mémoïsés par collectivité; les absents sont calculés en lot. Les collectivités
+    sans historique ni fixture sont omises. ConnectionError si Mongo est injoignable.
+    """
+    now = time.monotonic()
+    out: Dict[str, _SimEntry] = {}
+    missing: List[str] = []
+    with _memo_lock:
+        for cid in collectivite_ids:
+            entry = _memo.get(cid)
+            if entry is not None and entry.expires_at > now:
+                _memo.move_to_end(cid)
+                out[cid] = entry
+            else:
+                missing.append(cid)
+    memo_stats["hits"] += len(out)
+    if missing:
+        memo_stats["misses"] += len(missing)
+        fresh = _compute_entries(missing, now + SIM_CACHE_TTL_S)
+        with _memo_lock:
+            for cid, entry in fresh.items():
+                if entry.expires_at > now:
+                    _memo[cid] = entry
+                    _memo.move_to_end(cid)
+            while len(_memo) > SIM_MEMO_SIZE:
+                _memo.popitem(last=False)
+                memo_stats["evictions"] += 1
+        out.update(fresh)
+    return out
+
+
+def get_executive_payload(collectivite_id: Optional[str]) -> Dict[str, Any]:
+    """KeyError si la collectivité n'a pas d'historique; ConnectionError si Mongo est injoignable."""
+    cid = sim_norm(collectivite_id)
+    entry = get_entries([cid]).get(cid)
+    if entry is None:
+        raise KeyError(f"Aucun arbitrage enregistré pour {cid}")
+    payload = build_payload(entry.collectivite_id, entry.cfg, source=entry.source)
+    payload["meta"]["generated_at"] = entry.generated_at
+    return payload
+
+
+def invalidate(collectivite_id: str) -> None:
+    """Appelé après un nouvel arbitrage ou un changement de settings."""
+    with _memo_lock:
+        if _memo.pop(sim_norm(collectivite_id), None) is not None:
+            memo_stats["invalidations"] += 1
+
+
+# ---------- Classement multi-collectivités (vectorisé) ----------
+_ZONES_ISM = np.array(["critique", "sous_controle", "favorable"])
+_ZONES_IRM = np.array(["faible", "vigilance", "eleve"])
+
+
+def rank_executive(
+    collectivite_ids: List[str],
+    zone_ism: Optional[str] = None,
+    zone_irm: Optional[str] = None,
+    sort: str = "ism",
+    top: Optional[int] = None,
+    offset: int = 0,
+    limit: int = 50,
+) -> Dict[str, Any]:
+    """
+    ISM/IRM/zones de toutes les collectivités en opérations NumPy sur la matrice
+    des drivers (mêmes formules que build_payload), puis filtre, top-k et pagination.
+    sort: "ism" (décroissant) ou "irm" (décroissant, les plus à risque d'abord).
+    Seules les collectivités avec historique d'arbitrages sont classées.
+    """
+    entries = get_entries(sorted({sim_norm(c) for c in collectivite_ids}))
+    # Sans historique: pas de ligne au classement (une fixture de démo n'est pas une mesure)
+    cids = sorted(c for c, e in entries.items() if e.source != _FIXTURE_SOURCE)
+    n = len(cids)
+    if n == 0:
+        return {"total": 0, "offset": offset, "limit": limit, "items": []}
+
+    cfgs = [entries[c].cfg for c in cids]
+    drivers = np.array([(c["ieb"], c["iep"], c["ics"]) for c in cfgs], dtype=np.int64).reshape(n, 3)
+    weights = np.array([(c["weights"]["b"], c["weights"]["p"], c["weights"]["s"]) for c in cfgs], dtype=np.float64).reshape(n, 3)
+    proj = np.array([(c["delta_ism"], c["volatilite"], c["signaux_faibles"]) for c in cfgs], dtype=np.int64).reshape(n, 3)
+    delta, vol, sig = proj[:, 0], proj[:, 1], proj[:, 2]
+
+    # Somme explicite (même ordre d'opérations que compute_ism)
+    ism = np.round(
+        weights[:, 0] * drivers[:, 0] + weights[:, 1] * drivers[:, 1] + weights[:, 2] * drivers[:, 2]
+    ).astype(np.int64)
+    irm = np.round(np.clip(np.maximum(0, -delta) * 4.0 + vol * 0.55 + sig * 9.0, 0, 100)).astype(np.int64)
+
+    ism_zone = _ZONES_ISM[(ism >= 55).astype(np.int8) + (ism >= 75)]
+    irm_zone = _ZONES_IRM[(irm >= 30).astype(np.int8) + (irm >= 60)]
+    status = np.where(
+        (irm >= 60) | (delta <= -5),
+        "Sous tension",
+        np.where((ism >= 75) & (irm < 30), "Stable", "Vigilance"),
+    )
+
+    mask = np.ones(n, dtype=bool)
+    if zone_ism:
+        mask &= ism_zone == zone_ism
+    if zone_irm:
+        mask &= irm_zone == zone_irm
+    idx = np.flatnonzero(mask)
+
+    key = ism if sort == "ism" else irm
+    # Tri stable décroissant; cids déjà triés -> départage par collectivite_id
+    order = idx[np.argsort(-key[idx], kind="stable")]
+    if top is not None:
+        order = order[:top]
+    total = int(order.size)
+    page = order[offset: offset + limit]
+
+    items = [
+        {
+            "rank": offset + i + 1,
+            "collectivite_id": entries[cids[j]].collectivite_id,
+            "collectivite_label": cfgs[j]["label"],
+            "ism": int(ism[j]),
+            "ism_zone": str(ism_zone[j]),
+            "irm": int(irm[j]),
+            "irm_zone": str(irm_zone[j]),
+            "status": str(status[j]),
+            "source": entries[cids[j]].source,
+        }
+        for i, j in enumerate(page.tolist())
+    ]
+    return {"total": total, "offset": offset, "limit": limit, "items": items}
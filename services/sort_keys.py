@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict
+
+from pymongo import UpdateOne
+
+from database.mongo import get_db
+
+logger = logging.getLogger("cc.arbitrage")
+
+
+# Clé keyset des arbitrages: "created_at_dt ISO|arbitrage_id", unique et monotone,
+# couverte par l'index (collectivite_id, engine_version, sort_key). Partagée par la
+# pagination (arbitrage_service) et la rétention (archive_service).
+def make_sort_key(created_at_dt: datetime, arbitrage_id: str) -> str:
+    # PyMongo rend des datetimes naïfs (UTC implicite)
+    dt = created_at_dt if created_at_dt.tzinfo else created_at_dt.replace(tzinfo=timezone.utc)
+    return f"{dt.strftime('%Y-%m-%dT%H:%M:%S.%fZ')}|{arbitrage_id}"
+
+
+def _sort_key_for_doc(doc: Dict[str, Any]) -> str:
+    """sort_key d'un doc (y compris legacy sans created_at_dt), pour le backfill."""
+    dt = doc.get("created_at_dt")
+    if not isinstance(dt, datetime):
+        raw = doc.get("created_at")
+        if isinstance(raw, datetime):
+            dt = raw
+        else:
+            try:
+                dt = datetime.fromisoformat(str(raw).replace("Z", "+00:00"))
+            except ValueError:
+                dt = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    return make_sort_key(dt, doc.get("arbitrage_id", ""))
+
+
+def backfill_sort_keys(collectivite_id: str | None = None, batch_size: int = 500) -> int:
+    """
+    Ajoute sort_key aux arbitrages antérieurs (absents des pages sinon). Idempotent: ne
+    traite que les docs sans sort_key. Lancé une fois par déploiement sous le bail de
+    réconciliation (services.readiness), par l'archivage et par
+    cc_arbitrages_backfill_sort_key_v1.py. Retourne le nombre de docs mis à jour.
+    """
+    db = get_db()
+    filt: Dict[str, Any] = {"sort_key": {"$exists": False}}
+    if collectivite_id is not None:
+        filt["collectivite_id"] = collectivite_id
+    cursor = db.arbitrages.find(
+        filt, projection={"_id": 1, "arbitrage_id": 1, "created_at_dt": 1, "created_at": 1}
+    ).batch_size(batch_size)
+
+    ops, n = [], 0
+    for doc in cursor:
+        ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"sort_key": _sort_key_for_doc(doc)}}))
+        if len(ops) >= batch_size:
+            db.arbitrages.bulk_write(ops, ordered=False)
+            n += len(ops)
+            ops = []
+    if ops:
+        db.arbitrages.bulk_write(ops, ordered=False)
+        n += len(ops)
+    if n:
+        logger.info("sort_key ajouté à %d arbitrages legacy", n)
+    return n
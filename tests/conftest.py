@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+# Avant tout import de l'app (secrets lus au chargement des modules)
+os.environ.setdefault("JWT_SECRET", "test-secret")
+
+import database.mongo as mongo
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """Base Mongo en mémoire (mongomock), index de l'app compris."""
+    mongomock = pytest.importorskip("mongomock")
+    monkeypatch.setattr(mongo, "_client", mongomock.MongoClient())
+    mongo.ensure_indexes()
+    return mongo.get_db()
+
+
+_PRIORITES = ("elevee", "moyenne", "faible")
+_IMPACTS = ("fort", "moyen", "faible")
+
+
+@pytest.fixture
+def make_payload():
+    """Fabrique de payloads ArbitrageRunIn aléatoires: make_payload(rng, n_projets)."""
+
+    def _make(rng, n):
+        return {
+            "mandat": "2026-2032",
+            "contraintes": {
+                "budget_investissement_max": float(rng.randint(5, 60) * 1_000_000),
+                "seuil_capacite_desendettement_ans": 12.0,
+            },
+            "hypotheses": {
+                "taux_subventions_moyen": round(rng.uniform(0.1, 0.4), 2),
+                "inflation_travaux": 0.03,
+                "annee_reference": 2026,
+                "epargne_brute_annuelle": float(rng.randint(2, 10) * 1_000_000),
+                "encours_dette_initial": float(rng.randint(10, 80) * 1_000_000),
+            },
+            "projets": [
+                {
+                    "id": f"PRJ-{i:04d}",
+                    "nom": f"Projet {i}",
+                    "cout_ttc": float(rng.randint(2, 150) * 100_000),
+                    "priorite": rng.choice(_PRIORITES),
+                    "impact_climat": rng.choice(_IMPACTS),
+                    "impact_education": rng.choice(_IMPACTS),
+                    "annee_realisation": rng.randint(2026, 2032),
+                }
+                for i in range(n)
+            ],
+        }
+
+    return _make
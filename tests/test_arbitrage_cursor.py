@@ -0,0 +1,64 @@
+import base64
+import json
+import random
+
+import pytest
+
+from services.arbitrage_service import (
+    _decode_cursor,
+    _encode_cursor,
+    list_arbitrages_cursor,
+    run_arbitrage,
+)
+from services.sort_keys import backfill_sort_keys
+
+
+@pytest.fixture
+def runs(db, make_payload):
+    rng = random.Random(7)
+    ids = [run_arbitrage("c1", make_payload(rng, 3 + i), triggered_by="test")["arbitrage_id"] for i in range(7)]
+    return ids[::-1]  # plus récent d'abord
+
+
+def _ids(page):
+    return [i["arbitrage_id"] for i in page["items"]]
+
+
+def test_pages_suivantes_et_precedentes(runs):
+    p1 = list_arbitrages_cursor("c1", limit=3)
+    p2 = list_arbitrages_cursor("c1", limit=3, cursor=p1["next_cursor"])
+    p3 = list_arbitrages_cursor("c1", limit=3, cursor=p2["next_cursor"])
+    assert _ids(p1) + _ids(p2) + _ids(p3) == runs
+    assert p1["prev_cursor"] is None and p3["next_cursor"] is None
+
+    back = list_arbitrages_cursor("c1", limit=3, cursor=p3["prev_cursor"])
+    assert _ids(back) == runs[3:6]
+    back = list_arbitrages_cursor("c1", limit=3, cursor=back["prev_cursor"])
+    assert _ids(back) == runs[0:3]
+    assert back["prev_cursor"] is None
+
+
+def test_curseur_aller_retour():
+    assert _decode_cursor(_encode_cursor("2026-01-01T00:00:00.000000Z|a1", "prev")) == (
+        "2026-01-01T00:00:00.000000Z|a1",
+        "prev",
+    )
+
+
+def test_curseur_altere_refuse():
+    cursor = _encode_cursor("2026-01-01T00:00:00.000000Z|a1", "next")
+    version, body, sig = cursor.split(".")
+    forged = base64.urlsafe_b64encode(
+        json.dumps({"k": "2099-01-01T00:00:00.000000Z|zz", "d": "next"}, separators=(",", ":")).encode()
+    ).decode().rstrip("=")
+    legacy = base64.urlsafe_b64encode(json.dumps({"created_at_dt": "2099-01-01T00:00:00Z"}).encode()).decode()
+    for bad in (f"{version}.{forged}.{sig}", f"{version}.{body}.{sig[:-2]}xx", legacy, "v1." + body + "." + sig, ""):
+        with pytest.raises(ValueError):
+            _decode_cursor(bad)
+
+
+def test_doc_legacy_visible_apres_backfill(db, runs):
+    db.arbitrages.update_one({"arbitrage_id": runs[-1]}, {"$unset": {"sort_key": ""}})
+    assert runs[-1] not in _ids(list_arbitrages_cursor("c1", limit=50))
+    assert backfill_sort_keys("c1") == 1
+    assert _ids(list_arbitrages_cursor("c1", limit=50)) == runs
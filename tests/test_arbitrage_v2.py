@@ -0,0 +1,134 @@
+import random
+from typing import Any, Dict, List
+
+import pytest
+
+from engine.arbitrage_v2 import (
+    ENGINE_VERSION,
+    calculer_arbitrage_2_0,
+    rescorer_delta,
+    scorer_projets,
+    selectionner,
+)
+
+_IMPACTS = ("fort", "moyen", "faible")
+
+
+def _weights(rng: random.Random) -> Dict[str, float]:
+    return {
+        "poids_climat": round(rng.uniform(0.0, 1.0), 2),
+        "poids_education": round(rng.uniform(0.0, 1.0), 2),
+        "poids_financier": round(rng.uniform(0.0, 1.0), 2),
+    }
+
+
+def _payload(make_payload, rng: random.Random, n: int, ties: bool) -> Dict[str, Any]:
+    payload = make_payload(rng, n)
+    if ties:
+        # Peu de valeurs distinctes: beaucoup d'égalités (score, coût) -> départage par l'ordre
+        for p in payload["projets"]:
+            p["cout_ttc"] = rng.choice((200_000.0, 500_000.0))
+            p["impact_education"] = "moyen"
+    return payload
+
+
+def _reference_2_0(payload: Dict[str, Any], weights: Dict[str, float]) -> Dict[str, Any]:
+    """Calcul 2.0 d'origine (avant le découpage scorer_projets / selectionner)."""
+    budget_max = float(payload["contraintes"]["budget_investissement_max"])
+    w_climat = float(weights.get("poids_climat", 0.4))
+    w_edu = float(weights.get("poids_education", 0.3))
+    w_fin = float(weights.get("poids_financier", 0.3))
+    levels = {"faible": 0.2, "moyen": 0.6, "fort": 1.0}
+    priorites = {"faible": 0.2, "moyenne": 0.6, "elevee": 1.0}
+
+    scored: List[Dict[str, Any]] = []
+    for p in payload.get("projets", []):
+        cout = float(p["cout_ttc"])
+        score_climat = levels.get(p["impact_climat"], 0.0)
+        score_edu = levels.get(p["impact_education"], 0.0)
+        score_prio = priorites.get(p["priorite"], 0.0)
+        score_fin = 1.0 / (1.0 + (cout / max(budget_max, 1.0)))
+        score = w_climat * score_climat + w_edu * score_edu + w_fin * (0.6 * score_fin + 0.4 * score_prio)
+        scored.append(
+            {
+                "id": p["id"],
+                "nom": p["nom"],
+                "cout_ttc": cout,
+                "annee_realisation": int(p["annee_realisation"]),
+                "score": float(round(score, 6)),
+                "details_score": {
+                    "score_climat": score_climat,
+                    "score_education": score_edu,
+                    "score_financier": score_fin,
+                    "score_priorite": score_prio,
+                    "poids": {"climat": w_climat, "education": w_edu, "financier": w_fin},
+                },
+            }
+        )
+    scored.sort(key=lambda x: (-x["score"], x["cout_ttc"]))
+
+    budget_retenu = 0.0
+    projets_out: List[Dict[str, Any]] = []
+    for p in scored:
+        retenu = budget_retenu + p["cout_ttc"] <= budget_max
+        if retenu:
+            budget_retenu += p["cout_ttc"]
+        projets_out.append({**p, "retenu": retenu})
+
+    return {
+        "mandat": payload["mandat"],
+        "synthese": {
+            "budget_max": float(round(budget_max, 2)),
+            "budget_retenu": float(round(budget_retenu, 2)),
+            "budget_restant": float(round(budget_max - budget_retenu, 2)),
+            "nb_projets_total": len(projets_out),
+            "nb_projets_retenus": sum(1 for p in projets_out if p["retenu"]),
+        },
+        "projets": projets_out,
+        "engine_version": ENGINE_VERSION,
+    }
+
+
+def _derive(rng: random.Random, parent: List[Dict[str, Any]]):
+    """Portefeuille enfant comme scenario_service._apply_delta: retraits, surcharges, ajouts en fin."""
+    removed = {p["id"] for p in parent if rng.random() < 0.15}
+    overrides = {}
+    for p in parent:
+        if p["id"] not in removed and rng.random() < 0.2:
+            ov = {"cout_ttc": float(rng.randint(2, 150) * 100_000)} if rng.random() < 0.5 else {}
+            if rng.random() < 0.5:
+                ov["impact_climat"] = rng.choice(_IMPACTS)
+            overrides[p["id"]] = ov
+    added = [
+        {**rng.choice(parent), "id": f"ADD-{i:03d}", "nom": f"Ajout {i}"}
+        for i in range(rng.randint(0, 8))
+    ]
+    projets = [{**p, **overrides[p["id"]]} if p["id"] in overrides else p for p in parent if p["id"] not in removed]
+    projets.extend(added)
+    return projets, set(overrides) | {p["id"] for p in added}
+
+
+@pytest.mark.parametrize("ties", [False, True])
+def test_calculer_arbitrage_2_0_inchange(make_payload, ties):
+    rng = random.Random(20 + ties)
+    for _ in range(100):
+        payload = _payload(make_payload, rng, rng.randint(0, 80), ties)
+        weights = _weights(rng)
+        budget_max = float(payload["contraintes"]["budget_investissement_max"])
+        out = calculer_arbitrage_2_0(payload, weights)
+        assert out == _reference_2_0(payload, weights)
+        assert out == selectionner(payload["mandat"], scorer_projets(payload["projets"], budget_max, weights), budget_max)
+
+
+@pytest.mark.parametrize("ties", [False, True])
+def test_rescorer_delta_equivaut_a_scorer_projets(make_payload, ties):
+    rng = random.Random(40 + ties)
+    for _ in range(200):
+        payload = _payload(make_payload, rng, rng.randint(1, 80), ties)
+        weights = _weights(rng)
+        budget_max = float(payload["contraintes"]["budget_investissement_max"])
+        base_scored = scorer_projets(payload["projets"], budget_max, weights)
+        projets, changed = _derive(rng, payload["projets"])
+        assert rescorer_delta(base_scored, projets, changed, budget_max, weights) == scorer_projets(
+            projets, budget_max, weights
+        )
@@ -0,0 +1,52 @@
+from datetime import datetime, timezone
+
+from bson import json_util
+
+from services.arbitrage_writer import ArbitrageWriter
+
+
+def _doc(i):
+    return {
+        "arbitrage_id": f"arb-{i}",
+        "collectivite_id": "c1",
+        "created_at_dt": datetime(2026, 3, 4, 10, i, tzinfo=timezone.utc),
+        "synthese": {"budget_max": 100.0, "budget_retenu": 80.0, "nb_projets_total": 2, "nb_projets_retenus": 1},
+        "projets": [{"score": 0.5}, {"score": 0.25}],
+    }
+
+
+def _day_count(db):
+    doc = db.arbitrages_rollups.find_one({"collectivite_id": "c1", "bucket": "day"})
+    return doc["count"] if doc else 0
+
+
+def test_ack_en_echec_ne_reessaie_pas_le_lot(db, tmp_path, monkeypatch):
+    writer = ArbitrageWriter(wal_dir=tmp_path)
+    docs = [_doc(i) for i in range(3)]
+    for d in docs:
+        writer._pending[d["arbitrage_id"]] = d
+
+    def _wal_append(lines):
+        raise OSError("disque plein")
+
+    monkeypatch.setattr(writer, "_wal_append", _wal_append)
+    writer._commit(docs)
+
+    assert db.arbitrages.count_documents({}) == 3
+    assert _day_count(db) == 3
+    assert not writer._pending
+    assert writer.stats["errors"] == 1
+
+
+def test_rejeu_wal_ne_recompte_pas_les_docs_inseres(db, tmp_path):
+    writer = ArbitrageWriter(wal_dir=tmp_path)
+    docs = [_doc(i) for i in range(3)]
+    writer._commit(docs[:2])
+    # WAL d'un worker mort sans ack: deux docs déjà en base, un seul nouveau
+    orphan = tmp_path / "arbitrages-1-dead.wal"
+    orphan.write_text("".join(json_util.dumps({"op": "put", "doc": d}) + "\n" for d in docs))
+
+    assert writer.replay_orphan_wals() == 3
+    assert db.arbitrages.count_documents({}) == 3
+    assert _day_count(db) == 3
+    assert not orphan.exists()
@@ -0,0 +1,30 @@
+from datetime import datetime, timedelta, timezone
+
+from services.archive_service import archive_collectivite
+from services.sort_keys import make_sort_key
+
+
+def _doc(i, legacy):
+    created = datetime(2026, 1, 1, tzinfo=timezone.utc) + timedelta(hours=i)
+    doc = {
+        "arbitrage_id": f"arb-{i:03d}",
+        "collectivite_id": "c1",
+        "created_at": created.isoformat().replace("+00:00", "Z"),
+        "created_at_dt": created,
+        "synthese": {"budget_retenu": 1.0},
+        "projets": [{"score": 0.5}],
+    }
+    if not legacy:
+        doc["sort_key"] = make_sort_key(created, doc["arbitrage_id"])
+    return doc
+
+
+def test_archive_inclut_les_docs_legacy_sans_sort_key(db):
+    # 4 anciens docs sans sort_key, 6 récents avec
+    db.arbitrages.insert_many([_doc(i, legacy=i < 4) for i in range(10)])
+
+    assert archive_collectivite("c1", keep_last=3) == 7
+    archived = {d["arbitrage_id"] for d in db.arbitrages.find({"archived": True})}
+    assert archived == {f"arb-{i:03d}" for i in range(7)}
+    assert db.arbitrages_archive.count_documents({}) == 7
+    assert db.arbitrages.count_documents({"sort_key": {"$exists": False}}) == 0
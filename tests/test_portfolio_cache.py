@@ -0,0 +1,36 @@
+import random
+
+import services.portfolio_service as portfolio_service
+from services.portfolio_service import LRUCache, create_portfolio, portfolio_payload
+
+
+def test_lru_borne_en_projets():
+    cache = LRUCache(16, max_projets=100)
+    cache.put(("a",), "A", 60)
+    cache.put(("b",), "B", 30)
+    assert cache.get(("a",)) == "A"
+    # a est le plus récent: b évincé pour faire place à c
+    cache.put(("c",), "C", 40)
+    assert cache.get(("b",)) is None
+    assert cache.get(("a",)) == "A" and cache.get(("c",)) == "C"
+    assert cache.stats()["projets"] == 100
+    assert cache.stats()["evictions"] == 1
+
+
+def test_lru_valeur_trop_grosse_jamais_gardee():
+    cache = LRUCache(16, max_projets=100)
+    cache.put(("a",), "A", 10)
+    cache.put(("big",), "BIG", 101)
+    assert cache.get(("big",)) is None
+    assert cache.get(("a",)) == "A"
+    assert cache.stats()["skipped"] == 1
+
+
+def test_portfolio_payload_borne_par_projets(db, make_payload, monkeypatch):
+    monkeypatch.setattr(portfolio_service, "_payloads", LRUCache(16, max_projets=50))
+    rng = random.Random(3)
+    ids = [create_portfolio("c1", make_payload(rng, 30), "test")["portfolio_id"] for _ in range(3)]
+    for pid in ids:
+        assert len(portfolio_payload("c1", pid)["projets"]) == 30
+    stats = portfolio_service.portfolio_stats()["payloads"]
+    assert stats["entries"] == 1 and stats["projets"] == 30
@@ -0,0 +1,106 @@
+from datetime import timedelta
+
+import pytest
+
+from services import run_coalescing as rc
+
+_PAYLOAD = {"mandat": "m", "projets": [{"id": "p1"}]}
+
+
+@pytest.fixture
+def arbitrages(db, monkeypatch):
+    """Arbitrages lisibles (arbitrage_id -> sortie), sans passer par le moteur."""
+    store = {}
+
+    def _get(collectivite_id, arbitrage_id):
+        if arbitrage_id not in store:
+            raise KeyError(arbitrage_id)
+        return store[arbitrage_id]
+
+    monkeypatch.setattr(rc, "get_arbitrage_by_id", _get)
+    monkeypatch.setattr(rc, "SINGLE_FLIGHT_WAIT_S", 0.2)
+    monkeypatch.setattr(rc, "SINGLE_FLIGHT_POLL_S", 0.01)
+    return store
+
+
+def _reserve(payload=_PAYLOAD):
+    return rc.reserve_idempotency_key("c1", "u", "k1", payload)
+
+
+def test_reservation_puis_rejeu(db, arbitrages):
+    assert _reserve() is None
+    arbitrages["a1"] = {"arbitrage_id": "a1"}
+    rc.complete_idempotency_key("c1", "u", "k1", "a1")
+    assert _reserve() == {"arbitrage_id": "a1"}
+
+
+def test_autre_payload_refuse(db, arbitrages):
+    assert _reserve() is None
+    with pytest.raises(ValueError):
+        _reserve({**_PAYLOAD, "mandat": "autre"})
+
+
+def test_reservation_en_cours(db, arbitrages):
+    assert _reserve() is None
+    with pytest.raises(TimeoutError):
+        _reserve()
+    # Run échoué: clé libérée, de nouveau réservable
+    rc.release_idempotency_key("c1", "u", "k1")
+    assert _reserve() is None
+
+
+def test_reprise_arbitrage_purge(db, arbitrages):
+    assert _reserve() is None
+    rc.complete_idempotency_key("c1", "u", "k1", "a-purge")
+    assert _reserve() is None
+    rec = db.idempotency_keys.find_one({})
+    assert rec["status"] == "pending" and "arbitrage_id" not in rec
+
+
+def test_reprise_reservation_abandonnee(db, arbitrages):
+    assert _reserve() is None
+    old = rc._utc_now_dt() - timedelta(seconds=rc.SINGLE_FLIGHT_WAIT_S + rc.SINGLE_FLIGHT_LEASE_S + 5)
+    db.idempotency_keys.update_one({}, {"$set": {"created_at": old}})
+    assert _reserve() is None
+    assert db.idempotency_keys.find_one({})["created_at"].replace(tzinfo=None) > old.replace(tzinfo=None)
+
+
+def _publish(db, arbitrage_id):
+    db.run_flights.insert_one({
+        "_id": "fk",
+        "arbitrage_id": arbitrage_id,
+        "collectivite_id": "c1",
+        "expires_at": rc._utc_now_dt() + timedelta(seconds=60),
+    })
+
+
+def test_run_publie_pas_encore_lisible(db, arbitrages, monkeypatch):
+    # Write-behind: publié par un autre worker, lisible plus tard; jamais recalculé
+    _publish(db, "a1")
+    polls = []
+
+    def _get(collectivite_id, arbitrage_id):
+        polls.append(arbitrage_id)
+        if len(polls) < 3:
+            raise KeyError(arbitrage_id)
+        return {"arbitrage_id": arbitrage_id}
+
+    monkeypatch.setattr(rc, "get_arbitrage_by_id", _get)
+    out, outcome = rc._distributed("c1", "fk", lambda: pytest.fail("recalcul"))
+    assert (out, outcome) == ({"arbitrage_id": "a1"}, "coalesced_remote")
+
+
+def test_run_publie_jamais_lisible(db, arbitrages):
+    _publish(db, "a-absent")
+    out, outcome = rc._distributed("c1", "fk", lambda: {"arbitrage_id": "a2"})
+    assert outcome == "timeout"
+    # Bail jamais pris pendant l'attente
+    assert db.leases.count_documents({}) == 0
+
+
+def test_calcul_publie(db, arbitrages):
+    out, outcome = rc._distributed("c1", "fk", lambda: {"arbitrage_id": "a3"})
+    assert outcome == "computed"
+    assert db.run_flights.find_one({"_id": "fk"})["arbitrage_id"] == "a3"
+    arbitrages["a3"] = out
+    assert rc._distributed("c1", "fk", lambda: pytest.fail("recalcul")) == (out, "coalesced_remote")
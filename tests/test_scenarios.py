@@ -0,0 +1,60 @@
+import random
+
+from engine.arbitrage_v2 import calculer_arbitrage_2_0
+from services.arbitrage_service import get_run_settings
+from services.portfolio_service import create_portfolio
+from services.scenario_service import create_scenario, evaluate_scenario, materialize_scenario
+
+
+def _delta(rng, projets, prefix="ADD"):
+    removed = [p["id"] for p in projets[:5]]
+    overrides = {p["id"]: {"cout_ttc": float(rng.randint(2, 150) * 100_000)} for p in projets[10:15]}
+    added = [{**projets[-1], "id": f"{prefix}-{i:03d}", "nom": f"Ajout {i}"} for i in range(3)]
+    return {"removed": removed, "overrides": overrides, "added": added}
+
+
+def _attendu(collectivite_id, scenario_id):
+    weights, _ = get_run_settings(collectivite_id)
+    return calculer_arbitrage_2_0(materialize_scenario(collectivite_id, scenario_id), weights)
+
+
+def test_evaluate_scenario_reprend_les_scores_du_parent(db, make_payload):
+    rng = random.Random(7)
+    payload = make_payload(rng, 60)
+    pf = create_portfolio("c1", payload, "test")
+    parent = create_scenario("c1", {"name": "parent", "portfolio_id": pf["portfolio_id"], "delta": _delta(rng, payload["projets"])}, "test")
+    enfant = create_scenario(
+        "c1",
+        {"name": "enfant", "parent_scenario_id": parent["scenario_id"], "delta": _delta(rng, payload["projets"][5:], "ADD2")},
+        "test",
+    )
+
+    # Parent évalué d'abord: l'enfant ne rescore que ses surcharges et ajouts
+    evaluate_scenario("c1", parent["scenario_id"])
+    out = evaluate_scenario("c1", enfant["scenario_id"])
+    assert out["reuse"]["mode"] == "delta"
+    assert out["reuse"]["rescored"] == 5 + 3
+    assert out["reuse"]["reused"] == out["synthese"]["nb_projets_total"] - 8
+
+    attendu = _attendu("c1", enfant["scenario_id"])
+    assert out["projets"] == attendu["projets"]
+    assert out["synthese"] == attendu["synthese"]
+
+
+def test_evaluate_scenario_budget_surcharge_calcul_complet(db, make_payload):
+    rng = random.Random(8)
+    payload = make_payload(rng, 40)
+    pf = create_portfolio("c1", payload, "test")
+    contraintes = {**payload["contraintes"], "budget_investissement_max": payload["contraintes"]["budget_investissement_max"] * 2}
+    sc = create_scenario(
+        "c1",
+        {"name": "budget x2", "portfolio_id": pf["portfolio_id"], "delta": _delta(rng, payload["projets"]), "contraintes": contraintes},
+        "test",
+    )
+
+    out = evaluate_scenario("c1", sc["scenario_id"])
+    assert out["reuse"]["mode"] == "full"
+    assert out["reuse"]["reused"] == 0
+    attendu = _attendu("c1", sc["scenario_id"])
+    assert out["projets"] == attendu["projets"]
+    assert out["synthese"]["budget_max"] == contraintes["budget_investissement_max"]
@@ -46,7 +46,7 @@ echo "== build & run =="
 cd /opt/colconnect/app
 sudo docker rm -f colconnect-api >/dev/null 2>&1 || true
 sudo docker build -t colconnect-api:local .
-sudo docker run -d --name colconnect-api --restart=always -p 8000:8000 colconnect-api:local
+sudo docker run -d --name colconnect-api --restart=always -p 8000:8000 -v /var/lib/colconnect:/var/lib/colconnect colconnect-api:local
 
 echo "== verify =="
 sleep 3